@@ -48,6 +48,7 @@ if not settings.configured:
             'django.middleware.csrf.CsrfViewMiddleware',
             'django.contrib.auth.middleware.AuthenticationMiddleware',
             'django.contrib.messages.middleware.MessageMiddleware',
+            'timepiece.middleware.PermissionSnapshotMiddleware',
             'pagination.middleware.PaginationMiddleware',
         ),
         ROOT_URLCONF='timepiece_project.urls',
@@ -1,11 +1,10 @@
-from django.db.models import Q
 from django.conf import settings
 
 from timepiece import utils
 from timepiece.crm.forms import QuickSearchForm
 
 from timepiece.crm.models import Project
-from timepiece.entries.models import Entry
+from timepiece.entries.models import get_recent_projects
 
 
 def quick_search(request):
@@ -20,28 +19,33 @@ def quick_clock_in(request):
     leave_projects = []
 
     if user.is_authenticated() and user.is_active:
-        # Display all active paid leave projects that the user is assigned to.
         leave_ids = utils.get_setting('TIMEPIECE_PAID_LEAVE_PROJECTS').values()
-        lq = Q(users=user) & Q(id__in=leave_ids)
-        leave_projects = Project.trackable.filter(lq).order_by('name')
 
-        # Get all projects this user has clocked in to.
-        entries = Entry.objects.filter(user=user)
-        project_ids = list(entries.values_list('project', flat=True))
+        # Get the projects this user most recently clocked in to.
+        recent_ids = [project_id for project_id, start_time
+                in get_recent_projects(user.pk)]
+
+        # Load the recent and the paid leave projects which can still be
+        # clocked in to with one query, noting whether the user is assigned
+        # to each.
+        projects = Project.trackable.filter(id__in=recent_ids + leave_ids) \
+                .order_by()
+        projects = projects.extra(select={'assigned': 'EXISTS (SELECT 1 '
+                'FROM timepiece_projectrelationship WHERE '
+                'timepiece_projectrelationship.project_id = '
+                'timepiece_project.id AND '
+                'timepiece_projectrelationship.user_id = %s)'},
+                select_params=(user.pk,))
+        projects = dict((project.pk, project) for project in projects)
 
-        # Narrow to projects which can still be clocked in to.
-        pq = Q(id__in=project_ids)
-        valid_projects = Project.trackable.filter(pq).exclude(id__in=leave_ids)
-        valid_ids = list(valid_projects.values_list('id', flat=True))
+        # Display all active paid leave projects that the user is assigned to.
+        leave_projects = [projects[i] for i in set(leave_ids)
+                if i in projects and projects[i].assigned]
+        leave_projects.sort(key=lambda project: project.name)
 
         # Display the 10 projects this user most recently clocked into.
-        work_ids = []
-        for i in project_ids:
-            if len(work_ids) > 10:
-                break
-            if i in valid_ids and i not in work_ids:
-                work_ids.append(i)
-        work_projects = [valid_projects.get(pk=i) for i in work_ids]
+        work_projects = [projects[i] for i in recent_ids
+                if i in projects and i not in leave_ids][:10]
 
     return {
         'leave_projects': leave_projects,
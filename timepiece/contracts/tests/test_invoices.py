@@ -41,7 +41,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 3)
+        self.assertEquals(len(response.context['object_list']), 3)
         for obj in object_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -51,8 +51,8 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 1)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(len(response.context['object_list']), 1)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_no_results(self):
         """Page should render if there are no search results."""
@@ -60,7 +60,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_one_result(self):
         """Page should render if there is only one search result."""
@@ -68,8 +68,8 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 1)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(len(response.context['object_list']), 1)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_multiple_results(self):
         """Page should render if there are multiple search results."""
@@ -77,7 +77,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 2)
+        self.assertEquals(len(response.context['object_list']), 2)
         for obj in obj_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -87,7 +87,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         other_obj = self.factory.create()
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_filter_comments(self):
         """User should be able to filter by search query."""
@@ -95,7 +95,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         other_obj = self.factory.create()
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_filter_project_name(self):
         """User should be able to filter by search query."""
@@ -103,7 +103,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         other_obj = self.factory.create()
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_filter_user_username(self):
         """User should be able to filter by search query."""
@@ -111,7 +111,7 @@ class TestListInvoicesView(ViewTestMixin, TestCase):
         other_obj = self.factory.create()
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(response.context['object_list'][0], obj)
 
 
 class InvoiceViewPreviousTestCase(ViewTestMixin, LogTimeMixin, TestCase):
@@ -141,11 +141,14 @@ class InvoiceViewPreviousTestCase(ViewTestMixin, LogTimeMixin, TestCase):
 
     def log_many(self, projects, num_entries=20, start=None, billable=True):
         start = utils.add_timezone(datetime.datetime(2011, 1, 1, 0, 0, 0))
+        # The entries of each call start at the same times, so they are
+        # logged for a new user to avoid overlaps.
+        user = factories.User()
         for index in xrange(0, num_entries):
             start += relativedelta(hours=(5 * index))
             project = projects[index % len(projects)]  # Alternate projects
             self.log_time(start=start, status=Entry.APPROVED, project=project,
-                          billable=billable)
+                          billable=billable, user=user)
         return start
 
     def create_invoice(self, project=None, data=None):
@@ -443,8 +446,8 @@ class InvoiceCreateTestCase(ViewTestMixin, TestCase):
     def test_invoice_confirm_totals(self):
         """Verify that the per activity totals are valid."""
         # Make a few extra entries to test per activity totals
-        start = utils.add_timezone(datetime.datetime(2011, 1, 1, 8))
-        end = utils.add_timezone(datetime.datetime(2011, 1, 1, 12))
+        start = utils.add_timezone(datetime.datetime(2011, 1, 1, 13))
+        end = utils.add_timezone(datetime.datetime(2011, 1, 1, 17))
         # start = utils.add_timezone(datetime.datetime.now())
         # end = start + relativedelta(hours=4)
         activity = factories.Activity(billable=True, name='activity1')
@@ -600,7 +603,7 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         form = response.context['form']
         self.assertFalse(form.is_bound)
         self.assertFalse(form.is_valid())
-        self.assertEquals(response.context['project_totals'].count(), 3)
+        self.assertEquals(len(response.context['project_totals']), 2)
 
     def test_list_outstanding(self):
         """Only billable projects should be listed."""
@@ -608,20 +611,37 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         self.assertEquals(response.status_code, 200)
         form = response.context['form']
         self.assertTrue(form.is_valid(), form.errors)
-        # The number of projects should be 3 because entry4 has billable=False
-        self.assertEquals(response.context['project_totals'].count(), 3)
+        # The number of projects should be 2 because entry4 has billable=False
+        self.assertEquals(len(response.context['project_totals']), 2)
         # Verify that the date on the mark as invoiced links will be correct
         self.assertEquals(response.context['to_date'], self.to_date.date())
         self.assertEquals(list(response.context['unverified']), [])
         self.assertEquals(list(response.context['unapproved']), [])
 
+    def test_project_totals(self):
+        """Hours should be totaled per project and split by billable."""
+        contract = factories.ProjectContract(projects=[self.project_billable])
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        totals = dict((t['pk'], t) for t in response.context['project_totals'])
+        billable = totals[self.project_billable.pk]
+        self.assertEquals(billable['billable'], self.entry1.hours +
+                self.entry2.hours)
+        self.assertEquals(billable['non_billable'], 0)
+        self.assertEquals(billable['contracts'], [contract])
+        billable2 = totals[self.project_billable2.pk]
+        self.assertEquals(billable2['billable'], 0)
+        self.assertEquals(billable2['non_billable'], self.entry3.hours)
+        self.assertEquals(billable2['contracts'], [])
+
     def test_unverified(self):
         start = utils.add_timezone(datetime.datetime(2011, 1, 1, 8))
         end = utils.add_timezone(datetime.datetime(2011, 1, 1, 12))
         unverified_entry = factories.Entry(user=self.user,
             project=self.project_non_billable,
-            start_time=start + relativedelta(hours=11),
-            end_time=end + relativedelta(hours=15), status=Entry.UNVERIFIED
+            start_time=start + relativedelta(days=1, hours=11),
+            end_time=end + relativedelta(days=1, hours=15),
+            status=Entry.UNVERIFIED
         )
         response = self._get()
         self.assertEquals(response.status_code, 200)
@@ -640,13 +660,15 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         end = utils.add_timezone(datetime.datetime(2011, 1, 1, 12))
         unapproved_entry_a = factories.Entry(user=self.user,
             project=self.project_non_billable,
-            start_time=start + relativedelta(hours=11),
-            end_time=end + relativedelta(hours=15), status=Entry.VERIFIED
+            start_time=start + relativedelta(days=1, hours=11),
+            end_time=end + relativedelta(days=1, hours=15),
+            status=Entry.VERIFIED
         )
         unapproved_entry_b = factories.Entry(user=self.user,
             project=self.project_non_billable,
-            start_time=start + relativedelta(hours=11),
-            end_time=end + relativedelta(hours=15), status=Entry.VERIFIED
+            start_time=start + relativedelta(days=2, hours=11),
+            end_time=end + relativedelta(days=2, hours=15),
+            status=Entry.VERIFIED
         )
         response = self._get()
         self.assertEquals(response.status_code, 200)
@@ -668,7 +690,7 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         self.assertEquals(response.status_code, 200)
         form = response.context['form']
         self.assertTrue(form.is_valid(), form.errors)
-        self.assertEquals(response.context['project_totals'].count(), 0)
+        self.assertEquals(len(response.context['project_totals']), 0)
 
     def test_to_date_required(self):
         """to_date is required."""
@@ -677,8 +699,7 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         self.assertEquals(response.status_code, 200)
         form = response.context['form']
         self.assertFalse(form.is_valid(), form.errors)
-        # The number of projects should be 1 because entry3 has billable=False
-        self.assertEquals(response.context['project_totals'].count(), 0)
+        self.assertEquals(len(response.context['project_totals']), 0)
 
     def test_from_date(self):
         from_date = utils.add_timezone(datetime.datetime(2011, 1, 1, 0, 0, 0))
@@ -687,8 +708,8 @@ class ListOutstandingInvoicesViewTestCase(ViewTestMixin, TestCase):
         self.assertEquals(response.status_code, 200)
         form = response.context['form']
         self.assertTrue(form.is_valid(), form.errors)
-        # From date filters out one entry
-        self.assertEquals(response.context['project_totals'].count(), 1)
+        # From date filters out two entries
+        self.assertEquals(len(response.context['project_totals']), 1)
         # Verify that the date on the mark as invoiced links will be correct
         self.assertEquals(response.context['to_date'], self.to_date.date())
         self.assertEquals(response.context['from_date'], from_date.date())
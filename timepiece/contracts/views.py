@@ -18,7 +18,7 @@ from timepiece.utils.search import SearchListView
 
 from timepiece.contracts.forms import InvoiceForm, OutstandingHoursFilterForm
 from timepiece.contracts.models import ProjectContract, HourGroup, EntryGroup
-from timepiece.entries.models import Project, Entry
+from timepiece.entries.models import Project, Entry, TimesheetPeriod
 
 
 class ContractDetail(PermissionsRequiredMixin, DetailView):
@@ -109,6 +109,10 @@ def create_invoice(request):
             else:
                 # We got the lock, we can carry on
                 invoice = invoice_form.save()
+                if invoice.status == EntryGroup.INVOICED:
+                    TimesheetPeriod.objects.advance(
+                        TimesheetPeriod.objects.entry_periods(entries),
+                        TimesheetPeriod.INVOICED)
                 entries.update(status=invoice.status,
                                entry_group=invoice)
                 messages.add_message(request, messages.INFO,
@@ -142,6 +146,27 @@ def create_invoice(request):
     })
 
 
+def add_active_contracts(project_totals):
+    """
+    Adds the list of active contracts to each of the given project totals,
+    using a single query for all projects.
+    """
+    ProjectContracts = ProjectContract.projects.through
+    pks = [totals['pk'] for totals in project_totals]
+    relations = ProjectContracts.objects.filter(project__in=pks)
+    relations = relations.exclude(
+            projectcontract__status=ProjectContract.STATUS_COMPLETE)
+    relations = relations.select_related('projectcontract')
+    relations = relations.order_by('projectcontract__name')
+    contracts = {}
+    for relation in relations:
+        contracts.setdefault(relation.project_id, []).append(
+                relation.projectcontract)
+    for totals in project_totals:
+        totals['contracts'] = contracts.get(totals['pk'], [])
+    return project_totals
+
+
 @permission_required('contracts.change_entrygroup')
 def list_outstanding_invoices(request):
     form = OutstandingHoursFilterForm(request.GET or None)
@@ -160,19 +185,14 @@ def list_outstanding_invoices(request):
         project_status = Q(project__status__in=statuses)\
                 if statuses is not None else Q()
         # Calculate hours for each project
-        ordering = ('project__type__label', 'project__status__label',
-                'project__business__name', 'project__name', 'status')
         project_totals = Entry.objects.filter(
-            dates, billable, entry_status, project_status).order_by(*ordering)
+            dates, billable, entry_status, project_status).project_totals()
+        add_active_contracts(project_totals)
         # Find users with unverified/unapproved entries to warn invoice creator
         date_range_entries = Entry.objects.filter(dates)
-        user_values = ['user__pk', 'user__first_name', 'user__last_name']
-        unverified = date_range_entries.filter(
-            status=Entry.UNVERIFIED).values_list(*user_values).order_by('user__first_name').distinct()
-        unapproved = date_range_entries.filter(
-            status=Entry.VERIFIED).values_list(*user_values).order_by('user__first_name').distinct()
+        unverified, unapproved = date_range_entries.blocking_users()
     else:
-        project_totals = unverified = unapproved = Entry.objects.none()
+        project_totals, unverified, unapproved = [], [], []
     return render(request, 'timepiece/invoice/outstanding.html', {
         'date_form': form,
         'project_totals': project_totals,
@@ -184,6 +204,7 @@ def list_outstanding_invoices(request):
 
 
 class ListInvoices(PermissionsRequiredMixin, SearchListView):
+    keyset_ordering = ('-created',)
     model = EntryGroup
     permissions = ('contracts.add_entrygroup',)
     search_fields = ['user__username__icontains', 'project__name__icontains',
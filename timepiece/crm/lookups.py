@@ -1,35 +1,119 @@
+from bisect import bisect_left
 from collections import namedtuple
 
 from django.contrib.auth.models import User
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
 from selectable.base import LookupBase
 from selectable.base import ModelLookup
 from selectable.registry import registry
 
-from timepiece.crm.models import Project, Business
+from timepiece.crm.models import Project, Business, SearchIndex, \
+        LOOKUP_CATALOGUES
+from timepiece.utils import cache
+
+
+SearchResult = namedtuple('SearchResult', ['result_type', 'pk', 'label',
+        'value'])
+
+
+CatalogueItem = namedtuple('CatalogueItem', ['pk', 'name'])
+
+
+class Catalogue(object):
+    """
+    A compact, read-only list of objects sorted by normalized name. Each
+    entry keeps only the primary key, the display name and the normalized
+    text which is searched.
+    """
+
+    def __init__(self, rows):
+        rows = sorted((SearchIndex.normalize(name), pk, name,
+                SearchIndex.normalize(u'\n'.join(fields)))
+                for pk, name, fields in rows)
+        self.keys = tuple(row[0] for row in rows)
+        self.items = tuple(CatalogueItem(row[1], row[2]) for row in rows)
+        self.texts = tuple(row[3] for row in rows)
+
+    def search(self, term):
+        """
+        Returns the items whose text contains the term, those with a name
+        which starts with it first. Each group is ordered by name.
+        """
+        term = SearchIndex.normalize(term)
+        if not term:
+            return list(self.items)
+        start = bisect_left(self.keys, term)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(term):
+            end += 1
+        results = list(self.items[start:end])
+        results.extend(item for index, (item, text) in
+                enumerate(zip(self.items, self.texts))
+                if term in text and not start <= index < end)
+        return results
+
+
+class CatalogueLookup(ModelLookup):
+    """
+    Answers autocomplete queries from a catalogue kept in process memory
+    rather than querying the database on each keystroke. The catalogue is
+    rebuilt when the version of LOOKUP_CATALOGUES changes, which happens
+    whenever a project or business is saved or deleted.
+
+    Subclasses define get_catalogue_rows(), which returns (pk, name,
+    searched fields) tuples.
+    """
+    _catalogues = {}
+
+    def get_catalogue_rows(self):
+        raise NotImplementedError
+
+    def get_catalogue(self):
+        version = cache.get_version(LOOKUP_CATALOGUES)
+        key = self.__class__
+        cached = self._catalogues.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, Catalogue(self.get_catalogue_rows()))
+            self._catalogues[key] = cached
+        return cached[1]
 
+    def get_query(self, request, term):
+        return self.get_catalogue().search(term)
 
-class ProjectLookup(ModelLookup):
+
+class ProjectLookup(CatalogueLookup):
     model = Project
     search_fields = ('name__icontains', 'business__name__icontains',
             'business__short_name__icontains')
 
+    def get_catalogue_rows(self):
+        projects = Project.objects.values_list('pk', 'name',
+                'business__name', 'business__short_name')
+        return [(pk, name, (name, business or '', short_name or ''))
+                for pk, name, business, short_name in projects]
+
     def get_item_label(self, project):
         return mark_safe(u'<span class="project">%s</span>' %
-                self.get_item_value(project))
+                escape(self.get_item_value(project)))
 
     def get_item_value(self, project):
         return project.name if project else ''
 
 
-class BusinessLookup(ModelLookup):
+class BusinessLookup(CatalogueLookup):
     model = Business
     search_fields = ('name__icontains', 'short_name__icontains')
 
+    def get_catalogue_rows(self):
+        businesses = Business.objects.values_list('pk', 'name', 'short_name')
+        return [(pk, name, (name, short_name or ''))
+                for pk, name, short_name in businesses]
+
     def get_item_label(self, business):
         return mark_safe(u'<span class="business">%s</span>' %
-                self.get_item_value(business))
+                escape(self.get_item_value(business)))
 
     def get_item_value(self, business):
         return business.name if business else ''
@@ -62,23 +146,19 @@ class QuickLookup(LookupBase):
         super(QuickLookup, self).__init__(*args, **kwargs)
 
     def get_query(self, request, q):
-        results = []
-        SearchResult = namedtuple('SearchResult', ['result_type', 'item', 'label', 'value'])
+        return [SearchResult(row.result_type, row.object_id,
+                    self.format_label(row.result_type, row.value), row.value)
+                for row in SearchIndex.objects.search(q)]
 
-        for result_type, lookup in self.lookups.items():
-            for item in lookup.get_query(request, q)[:10]:
-                label = lookup.get_item_label(item)
-                value = lookup.get_item_value(item)
-                results.append(SearchResult(result_type, item, label, value))
-
-        results.sort(lambda a, b: cmp(a.value, b.value))
-        return results
+    def format_label(self, result_type, value):
+        return mark_safe(u'<span class="%s">%s</span>' % (result_type,
+                escape(value)))
 
     def get_item_label(self, item):
         return item.label
 
     def get_item_id(self, item):
-        return '{0}-{1}'.format(item.result_type, item.item.pk)
+        return '{0}-{1}'.format(item.result_type, item.pk)
 
     def get_item(self, value):
         try:
@@ -2,13 +2,17 @@ from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.db.models import get_model
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
 
+from timepiece.utils import cache
 
-# Add a utility method to the User class that will tell whether or not a
-# particular user has any unclosed entries
-User.clocked_in = property(lambda user: user.timepiece_entries.filter(
-    end_time__isnull=True).count() > 0)
 
+# Cache namespace for the project and business autocomplete catalogues.
+LOOKUP_CATALOGUES = 'crm-lookup-catalogues'
+
+# The user fields which are indexed for the quick search.
+SEARCH_USER_FIELDS = ('username', 'first_name', 'last_name', 'email')
 
 # Utility method to get user's name, falling back to username.
 User.get_name_or_username = lambda user: user.get_full_name() or user.username
@@ -202,3 +206,149 @@ class ProjectRelationship(models.Model):
             self.project.name,
             self.user.get_name_or_username(),
         )
+
+
+class SearchIndexManager(models.Manager):
+
+    def search(self, q, limit=30):
+        """
+        Returns the index rows which contain the query, ranking those which
+        start with it first, then those with a word that starts with it.
+        """
+        q = SearchIndex.normalize(q)
+        if not q:
+            return self.none()
+        like = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rank = "CASE WHEN text LIKE %s THEN 0 WHEN text LIKE %s THEN 1 " \
+               "ELSE 2 END"
+        qs = self.filter(text__contains=q)
+        qs = qs.extra(select={'rank': rank},
+                select_params=(like + '%', '% ' + like + '%'))
+        return qs.order_by('rank', 'value')[:limit]
+
+    def update_users(self, users):
+        self._update(SearchIndex.USER, users, lambda user: (
+            user.get_name_or_username(),
+            [getattr(user, name) for name in SEARCH_USER_FIELDS],
+        ))
+
+    def update_projects(self, projects):
+        self._update(SearchIndex.PROJECT, projects, lambda project: (
+            project.name,
+            (project.name, project.business.name,
+                project.business.short_name),
+        ))
+
+    def update_businesses(self, businesses):
+        self._update(SearchIndex.BUSINESS, businesses, lambda business: (
+            business.name,
+            (business.name, business.short_name),
+        ))
+
+    def remove(self, result_type, pks):
+        self.filter(result_type=result_type, object_id__in=pks).delete()
+
+    def rebuild(self):
+        """Recreates the whole index from the indexed models."""
+        self.all().delete()
+        self.update_users(User.objects.all())
+        self.update_projects(Project.objects.select_related('business'))
+        self.update_businesses(Business.objects.all())
+
+    def _update(self, result_type, objects, fields):
+        rows = []
+        for obj in objects:
+            value, text = fields(obj)
+            rows.append(SearchIndex(result_type=result_type,
+                    object_id=obj.pk, value=value[:255],
+                    text=SearchIndex.normalize(' '.join(text))))
+        self.remove(result_type, [row.object_id for row in rows])
+        self.bulk_create(rows)
+
+
+class SearchIndex(models.Model):
+    """
+    Denormalized search text for users, projects and businesses, used by
+    the quick search so that each keystroke runs a single query. Rows are
+    kept in sync by signal handlers; use the rebuild_search_index command
+    to populate the index for existing data.
+    """
+    USER = 'user'
+    PROJECT = 'project'
+    BUSINESS = 'business'
+    RESULT_TYPES = {
+        USER: 'User',
+        PROJECT: 'Project',
+        BUSINESS: 'Business',
+    }
+
+    result_type = models.CharField(max_length=16,
+            choices=RESULT_TYPES.items())
+    object_id = models.PositiveIntegerField()
+    value = models.CharField(max_length=255)
+    text = models.TextField()
+
+    objects = SearchIndexManager()
+
+    class Meta:
+        db_table = 'timepiece_searchindex'
+        unique_together = ('result_type', 'object_id')
+
+    def __unicode__(self):
+        return self.value
+
+    @staticmethod
+    def normalize(text):
+        return u' '.join((text or u'').lower().split())
+
+
+@receiver(post_init, sender=User)
+def remember_user_search(sender, instance, **kwargs):
+    instance._search = [getattr(instance, name)
+            for name in SEARCH_USER_FIELDS]
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, created=False, **kwargs):
+    """
+    A user was added or changed. Saves which leave the indexed fields as
+    they were, such as the update of last_login, keep the index row.
+    """
+    current = [getattr(instance, name) for name in SEARCH_USER_FIELDS]
+    if created or current != getattr(instance, '_search', None):
+        SearchIndex.objects.update_users([instance])
+    instance._search = current
+
+
+@receiver(post_save, sender=Project)
+def index_project(sender, instance, **kwargs):
+    SearchIndex.objects.update_projects([instance])
+
+
+@receiver(post_save, sender=Business)
+def index_business(sender, instance, **kwargs):
+    SearchIndex.objects.update_businesses([instance])
+    # Projects are found by the name of their business too.
+    projects = instance.new_business_projects.select_related('business')
+    SearchIndex.objects.update_projects(projects)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Business)
+def unindex(sender, instance, **kwargs):
+    result_type = {
+        User: SearchIndex.USER,
+        Project: SearchIndex.PROJECT,
+        Business: SearchIndex.BUSINESS,
+    }[sender]
+    SearchIndex.objects.remove(result_type, [instance.pk])
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Business)
+def invalidate_lookup_catalogues(sender, **kwargs):
+    """Project or business names changed."""
+    cache.bump_version(LOOKUP_CATALOGUES)
@@ -0,0 +1,4 @@
+-- Trigram index so that substring searches on the quick search index do not
+-- need a sequential scan. Requires the pg_trgm extension (PostgreSQL 9.1+).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX timepiece_searchindex_text_trgm ON timepiece_searchindex USING gin (text gin_trgm_ops);
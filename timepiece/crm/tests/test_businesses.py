@@ -138,7 +138,7 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 3)
+        self.assertEquals(len(response.context['object_list']), 3)
         for obj in object_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -148,7 +148,7 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_list_one(self):
         """Page should render if there is one object & no search query."""
@@ -156,8 +156,8 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 1)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(len(response.context['object_list']), 1)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_no_results(self):
         """Page should render if there are no search results."""
@@ -165,7 +165,7 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_one_result(self):
         """If there is only one search result, user should be redirected."""
@@ -179,7 +179,7 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 2)
+        self.assertEquals(len(response.context['object_list']), 2)
         for obj in obj_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -196,3 +196,41 @@ class TestListBusinessesView(ViewTestMixin, TestCase):
         other_obj = self.factory.create()
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertRedirectsNoFollow(response, obj.get_absolute_url())
+
+    def test_keyset_pages(self):
+        """Pages seek from the first or last row of the adjacent page."""
+        objs = [self.factory.create(name='business{0:02d}'.format(i))
+                for i in range(25)]
+        response = self._get()
+        page = response.context['page_obj']
+        self.assertEquals(response.context['object_list'], objs[:20])
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+        response = self._get(get_kwargs={'after': objs[19].pk})
+        page = response.context['page_obj']
+        self.assertEquals(response.context['object_list'], objs[20:])
+        self.assertTrue(page.has_previous())
+        self.assertFalse(page.has_next())
+        self.assertEquals(page.previous_query(),
+                'before={0}'.format(objs[20].pk))
+
+        response = self._get(get_kwargs={'before': objs[20].pk})
+        self.assertEquals(response.context['object_list'], objs[:20])
+        self.assertFalse(response.context['page_obj'].has_previous())
+
+    def test_keyset_page_keeps_search(self):
+        """Paging through search results keeps the search query."""
+        objs = [self.factory.create(name='hello{0:02d}'.format(i))
+                for i in range(21)]
+        self.factory.create(name='goodbye')
+        response = self._get(get_kwargs={'search': 'hello'})
+        query = response.context['page_obj'].next_query()
+        self.assertTrue('search=hello' in query)
+        response = self._get(url='{0}?{1}'.format(self._url(), query))
+        self.assertEquals(response.context['object_list'], objs[20:])
+
+    def test_bad_cursor(self):
+        response = self._get(get_kwargs={'after': 'abc'})
+        self.assertEquals(response.status_code, 404)
+
@@ -9,11 +9,13 @@ from timepiece import utils
 from timepiece.tests import factories
 from timepiece.tests.base import ViewTestMixin, LogTimeMixin
 
+from ..lookups import ProjectLookup
 from ..models import Project
 
 
 __all__ = ['TestCreateProjectView', 'TestDeleteProjectView',
-        'TestListProjectsView', 'TestProjectTimesheetView']
+        'TestListProjectsView', 'TestProjectTimesheetView',
+        'ProjectLookupTest']
 
 
 class TestCreateProjectView(ViewTestMixin, TestCase):
@@ -128,7 +130,7 @@ class TestListProjectsView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 3)
+        self.assertEquals(len(response.context['object_list']), 3)
         for obj in object_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -138,7 +140,7 @@ class TestListProjectsView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_list_one(self):
         """Page should render if there is one object & no search query."""
@@ -146,8 +148,8 @@ class TestListProjectsView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 1)
-        self.assertEquals(response.context['object_list'].get(), obj)
+        self.assertEquals(len(response.context['object_list']), 1)
+        self.assertEquals(response.context['object_list'][0], obj)
 
     def test_no_results(self):
         """Page should render if there are no search results."""
@@ -155,7 +157,7 @@ class TestListProjectsView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'goodbye'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_one_result(self):
         """If there is only one search result, user should be redirected."""
@@ -169,7 +171,7 @@ class TestListProjectsView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'ello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 2)
+        self.assertEquals(len(response.context['object_list']), 2)
         for obj in obj_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -335,3 +337,37 @@ class TestProjectTimesheetView(ViewTestMixin, LogTimeMixin, TestCase):
         headers = contents[0].split(',')
         # Assure user's comments are not included.
         self.assertTrue('comments' not in headers)
+
+
+class ProjectLookupTest(TestCase):
+
+    def test_search_business_names(self):
+        business = factories.Business(name='Initech', short_name='ITC')
+        project = factories.Project(name='TPS Reports', business=business)
+        other = factories.Project(name='Itch')
+        lookup = ProjectLookup()
+        self.assertEquals([p.pk for p in lookup.get_query(None, 'itc')],
+                [other.pk, project.pk])
+        self.assertEquals([p.pk for p in lookup.get_query(None, 'ini')],
+                [project.pk])
+
+    def test_catalogue_is_cached(self):
+        project = factories.Project(name='Cached')
+        lookup = ProjectLookup()
+        lookup.get_query(None, 'cached')
+        with self.assertNumQueries(0):
+            results = lookup.get_query(None, 'cached')
+        self.assertEquals([p.name for p in results], ['Cached'])
+        self.assertEquals(lookup.get_item_id(results[0]), project.pk)
+
+    def test_catalogue_invalidated_on_save(self):
+        project = factories.Project(name='Before')
+        lookup = ProjectLookup()
+        self.assertEquals(len(lookup.get_query(None, 'before')), 1)
+        project.name = 'After'
+        project.save()
+        self.assertEquals(lookup.get_query(None, 'before'), [])
+        self.assertEquals(len(lookup.get_query(None, 'after')), 1)
+        project.business.name = 'Renamed'
+        project.business.save()
+        self.assertEquals(len(lookup.get_query(None, 'renamed')), 1)
@@ -1,5 +1,11 @@
+import mock
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
 
+from timepiece.crm.lookups import QuickLookup
+from timepiece.crm.models import SearchIndex
 from timepiece.tests import factories
 from timepiece.tests.base import ViewTestMixin
 
@@ -81,3 +87,58 @@ class QuickSearchTest(ViewTestMixin, TestCase):
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
         self.assertFalse(response.context['form'].is_valid())
+
+
+class SearchIndexTest(TestCase):
+
+    def _found(self, q, project):
+        return ('project', project.pk) in [(r.result_type, r.object_id)
+                for r in SearchIndex.objects.search(q)]
+
+    def test_ranking(self):
+        """Results starting with the query come before other matches."""
+        later = factories.Project(name='Acmewebsite')
+        first = factories.Project(name='Website Redesign')
+        second = factories.Project(name='New Website')
+        values = [r.value for r in SearchIndex.objects.search('  WEBsite ')]
+        self.assertEquals(values[:3], [first.name, second.name, later.name])
+
+    def test_search_escapes_wildcards(self):
+        factories.Project(name='Half done')
+        factories.Project(name='100% done')
+        values = [r.value for r in SearchIndex.objects.search('%')]
+        self.assertEquals(values, ['100% done'])
+
+    def test_sync_on_save_and_delete(self):
+        business = factories.Business(name='Initech')
+        project = factories.Project(name='TPS Reports', business=business)
+        self.assertTrue(self._found('initech', project))
+
+        business.name = 'Initrode'
+        business.save()
+        self.assertFalse(self._found('initech', project))
+        self.assertTrue(self._found('initrode', project))
+
+        project.delete()
+        self.assertFalse(SearchIndex.objects.filter(result_type='project',
+                object_id=project.pk).exists())
+
+    def test_user_reindexed_on_name_change(self):
+        """Users are only reindexed when an indexed field changes."""
+        user = User.objects.get(pk=factories.User(first_name='Zed').pk)
+        with mock.patch.object(SearchIndex.objects, 'update_users') as update:
+            user.last_login = timezone.now()
+            user.save()
+            self.assertFalse(update.called)
+            user.first_name = 'Zack'
+            user.save()
+            update.assert_called_once_with([user])
+
+    def test_quick_lookup(self):
+        user = factories.User(first_name='Zed', last_name='<b>Bold</b>')
+        results = QuickLookup().get_query(None, 'bold')
+        self.assertEquals(len(results), 1)
+        result = results[0]
+        self.assertEquals(QuickLookup().get_item_id(result),
+                'user-{0}'.format(user.pk))
+        self.assertTrue('&lt;b&gt;' in result.label)
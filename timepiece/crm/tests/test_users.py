@@ -149,7 +149,7 @@ class TestListUsersView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 3)
+        self.assertEquals(len(response.context['object_list']), 3)
         for obj in object_list:
             self.assertTrue(obj in response.context['object_list'])
 
@@ -158,8 +158,8 @@ class TestListUsersView(ViewTestMixin, TestCase):
         response = self._get()
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 1)
-        self.assertEquals(response.context['object_list'].get(), self.user)
+        self.assertEquals(len(response.context['object_list']), 1)
+        self.assertEquals(response.context['object_list'][0], self.user)
 
     def test_no_results(self):
         """Page should render if there are no search results."""
@@ -167,7 +167,7 @@ class TestListUsersView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 0)
+        self.assertEquals(len(response.context['object_list']), 0)
 
     def test_one_result(self):
         """If there is only one search result, user should be redirected."""
@@ -181,7 +181,7 @@ class TestListUsersView(ViewTestMixin, TestCase):
         response = self._get(get_kwargs={'search': 'hello'})
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, self.template_name)
-        self.assertEquals(response.context['object_list'].count(), 2)
+        self.assertEquals(len(response.context['object_list']), 2)
         for obj in obj_list:
             self.assertTrue(obj in response.context['object_list'])
 
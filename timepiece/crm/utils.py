@@ -1,8 +1,14 @@
+from decimal import Decimal
 from itertools import groupby
 
-from django.db.models import Sum
+from dateutil.relativedelta import relativedelta
 
-from timepiece.utils import add_timezone, get_hours_summary, get_week_start
+from django.db.models import Count, Sum
+from django.utils.datastructures import SortedDict
+
+from timepiece import utils
+from timepiece.utils import get_hours_summary, get_week_start
+from timepiece.entries.models import Entry, SimpleEntry
 
 
 def daily_summary(day_entries):
@@ -20,28 +26,122 @@ def daily_summary(day_entries):
 
 
 def grouped_totals(entries):
-    select = {
-        "day": {"date": """DATE_TRUNC('day', end_time)"""},
-        "week": {"date": """DATE_TRUNC('week', end_time)"""},
+    daily = entries.extra(select={'date': 'timepiece_entry.work_date'})
+    daily = daily.values('date', 'project__name', 'billable')
+    daily = daily.annotate(hours=Sum('hours'))
+    return group_by_week(daily)
+
+
+def group_by_week(daily):
+    """
+    Groups rows of hours per day, project name and billable status into
+    (week, week totals, days) tuples, where days holds a (day, daily
+    summary) tuple for each day of the week with hours.
+    """
+    daily = sorted(daily, key=lambda x: (x['date'], x['project__name']))
+    weeks = []
+    for week, week_entries in groupby(daily,
+            lambda x: get_week_start(x['date'])):
+        week_entries = list(week_entries)
+        days = [(day, daily_summary(day_entries)) for day, day_entries
+                in groupby(week_entries, lambda x: x['date'])]
+        weeks.append((week, get_hours_summary(week_entries), days))
+    return weeks
+
+
+def timesheet_summary(entries, from_date, to_date):
+    """
+    Computes the figures for a user's monthly time sheet with a single
+    grouped query over the entries:
+
+    * summary: the billable, non-billable, invoiced, uninvoiced, total,
+      total worked and paid leave hours for the month, as returned by
+      Entry.summary.
+    * project_entries: the hours per project for the month, largest first.
+    * grouped_totals: the hours per week, day and project, as returned by
+      grouped_totals. The first week is backdated to its Monday, unless
+      that falls in the previous month and there are no entries between
+      the start of the month and the end of the first week.
+    """
+    first_week = get_week_start(from_date)
+    month_week = first_week + relativedelta(weeks=1)
+    select = SortedDict([
+        ('date', 'timepiece_entry.work_date'),
+        ('in_month', 'timepiece_entry.work_date >= %s'),
+        ('in_first_week', 'start_time >= %s AND start_time < %s'),
+    ])
+    rows = entries.timespan(first_week, to_date=to_date)
+    rows = rows.extra(select=select,
+            select_params=(utils.get_local_date(from_date), from_date,
+                month_week))
+    rows = rows.values('date', 'in_month', 'in_first_week', 'project',
+            'project__name', 'billable', 'status')
+    rows = list(rows.annotate(hours=Sum('hours')).order_by())
+
+    leave = utils.get_setting('TIMEPIECE_PAID_LEAVE_PROJECTS')
+    leave_names = dict((pk, name) for name, pk in leave.iteritems())
+    summary = {
+        'billable': Decimal('0'), 'non_billable': Decimal('0'),
+        'invoiced': Decimal('0'), 'uninvoiced': Decimal('0'),
+        'total': Decimal('0'),
+        'paid_leave': dict((name, None) for name in leave),
+    }
+    projects = {}
+    month_rows = []
+    for row in rows:
+        if not row['in_month']:
+            continue
+        month_rows.append(row)
+        hours = row['hours']
+        summary['total'] += hours
+        if row['status'] == Entry.INVOICED:
+            summary['invoiced'] += hours
+        else:
+            summary['uninvoiced'] += hours
+        name = leave_names.get(row['project'])
+        if name is not None:
+            summary['paid_leave'][name] = \
+                    (summary['paid_leave'][name] or 0) + hours
+        elif row['billable']:
+            summary['billable'] += hours
+        else:
+            summary['non_billable'] += hours
+        name = row['project__name']
+        projects[name] = projects.get(name, 0) + hours
+    summary['total_worked'] = summary['billable'] + summary['non_billable']
+
+    project_entries = [{'project__name': name, 'sum': hours}
+            for name, hours in projects.iteritems()]
+    project_entries.sort(key=lambda x: x['sum'], reverse=True)
+
+    totals = ''
+    if month_rows:
+        intersection = any(row['in_first_week'] for row in rows)
+        if not intersection and first_week.month < from_date.month:
+            rows = month_rows
+        totals = group_by_week(rows)
+
+    return {
+        'summary': summary,
+        'project_entries': project_entries,
+        'grouped_totals': totals,
+    }
+
+
+def simple_entry_summary(simple_entries):
+    """
+    Returns the total hours of the simple entries and the number of simple
+    entries with each status, using a single grouped query.
+    """
+    rows = simple_entries.values('status').annotate(hours=Sum('hours'),
+            minutes=Sum('minutes'), count=Count('id')).order_by()
+    hours = minutes = 0
+    statuses = dict((status, 0) for status in SimpleEntry.STATUSES)
+    for row in rows:
+        hours += row['hours'] or 0
+        minutes += row['minutes'] or 0
+        statuses[row['status']] = row['count']
+    return {
+        'total': hours + minutes / 60,
+        'statuses': statuses,
     }
-    weekly = entries.extra(select=select["week"]).values('date', 'billable')
-    weekly = weekly.annotate(hours=Sum('hours')).order_by('date')
-    daily = entries.extra(select=select["day"]).values('date', 'project__name',
-                                                       'billable')
-    daily = daily.annotate(hours=Sum('hours')).order_by('date',
-                                                        'project__name')
-    weeks = {}
-    for week, week_entries in groupby(weekly, lambda x: x['date']):
-        if week is not None:
-            week = add_timezone(week)
-        weeks[week] = get_hours_summary(week_entries)
-    days = []
-    last_week = None
-    for day, day_entries in groupby(daily, lambda x: x['date']):
-        week = get_week_start(day)
-        if last_week and week > last_week:
-            yield last_week, weeks.get(last_week, {}), days
-            days = []
-        days.append((day, daily_summary(day_entries)))
-        last_week = week
-    yield week, weeks.get(week, {}), days
@@ -29,8 +29,9 @@ from timepiece.crm.forms import (CreateEditBusinessForm, CreateEditProjectForm,
         ProjectSearchForm, QuickSearchForm)
 from timepiece.crm.models import Business, Project, ProjectRelationship,\
         UserProfile
-from timepiece.crm.utils import grouped_totals
-from timepiece.entries.models import Entry, SimpleEntry
+from timepiece.crm.utils import simple_entry_summary, timesheet_summary
+from timepiece.entries.models import Entry, SimpleEntry, TimesheetPeriod, \
+        get_period_month
 
 
 @cbv_decorator(login_required)
@@ -61,6 +62,10 @@ def reject_user_timesheet(request, user_id):
                     % count
             else:
                 msg = 'There are no verified entries to reject.'
+            TimesheetPeriod.objects.filter(user=user,
+                    month=get_period_month(from_date),
+                    state=TimesheetPeriod.VERIFIED) \
+                    .update(state=TimesheetPeriod.OPEN)
             messages.info(request, msg)
         else:
             return render(request, 'timepiece/user/timesheet/reject.html', {
@@ -194,9 +199,9 @@ class UserTimesheetCSV(CSVViewMixin):
         for entry in context['month_simple_entries']:
             data = [
                 str(entry.date),
-                entry.user.first_name + ' ' + entry.user.last_name,
-                entry.project.business.name,
-                entry.project.name,
+                entry.user_name,
+                entry.business_name,
+                entry.project_name,
                 str(entry.hours + entry.minutes/60),
                 entry.comments,
                 entry.status,
@@ -249,44 +254,25 @@ def view_user_timesheet(request, user_id, active_tab):
 
     simple_entries_qs = SimpleEntry.objects.filter(user=user)
     month_se_qs = simple_entries_qs.timespan(from_date, span='month')
-    month_simple_entries = month_se_qs
-
-    # For grouped entries, back date up to the start of the week.
-    first_week = utils.get_week_start(from_date)
-    month_week = first_week + relativedelta(weeks=1)
-    grouped_qs = entries_qs.timespan(first_week, to_date=to_date)
-    intersection = grouped_qs.filter(start_time__lt=month_week,
-        start_time__gte=from_date)
-    # If the month of the first week starts in the previous
-    # month and we dont have entries in that previous ISO
-    # week, then update the first week to start at the first
-    # of the actual month
-    if not intersection and first_week.month < from_date.month:
-        grouped_qs = entries_qs.timespan(from_date, to_date=to_date)
-    totals =grouped_totals(grouped_qs) if month_entries else ''
-    project_entries = month_qs.order_by().values(
-        'project__name').annotate(sum=Sum('hours')).order_by('-sum')
-    summary = Entry.summary(user, from_date, to_date)
-    summary_se = SimpleEntry.summary(user, from_date, to_date)
+    # Only the rows of the page shown are fetched, as plain values.
+    month_simple_entries = month_se_qs.order_by('date', 'pk').rows()
+
+    # The hour totals for the overview and daily summary tabs come from one
+    # grouped query over the entries, and one over the simple entries.
+    totals = timesheet_summary(entries_qs, from_date, to_date)
+    summary_se = simple_entry_summary(month_se_qs)
 
     show_approve = show_verify = False
     can_change = request.user.has_perm('entries.change_entry')
     can_approve = request.user.has_perm('entries.approve_timesheet')
-#     if can_change or can_approve or user == request.user:
-#         statuses = list(month_qs.values_list('status', flat=True))
-#         total_statuses = len(statuses)
-#         unverified_count = statuses.count(Entry.UNVERIFIED)
-#         verified_count = statuses.count(Entry.VERIFIED)
-#         approved_count = statuses.count(Entry.APPROVED)
     if can_change or can_approve or user == request.user:
-        statuses_se = list(month_simple_entries.values_list('status', flat=True))
-        total_statuses_se = len(statuses_se)
-        unverified_count_se = statuses_se.count(SimpleEntry.UNVERIFIED)
-        verified_count_se = statuses_se.count(SimpleEntry.VERIFIED)
-        approved_count_se = statuses_se.count(SimpleEntry.APPROVED)
+        statuses_se = summary_se['statuses']
+        total_statuses_se = sum(statuses_se.values())
+        unverified_count_se = statuses_se[SimpleEntry.UNVERIFIED]
+        verified_count_se = statuses_se[SimpleEntry.VERIFIED]
+        approved_count_se = statuses_se[SimpleEntry.APPROVED]
 
     if can_change or user == request.user:
-        # show_verify = unverified_count != 0
         show_verify = unverified_count_se != 0
     if can_approve:
         show_approve = verified_count_se + approved_count_se == total_statuses_se \
@@ -305,9 +291,9 @@ def view_user_timesheet(request, user_id, active_tab):
         'timesheet_user': user,
         'entries': month_entries,
         'month_simple_entries': month_simple_entries,
-        'grouped_totals': totals,
-        'project_entries': project_entries,
-        'summary': summary,
+        'grouped_totals': totals['grouped_totals'],
+        'project_entries': totals['project_entries'],
+        'summary': totals['summary'],
         'summary_se': summary_se,
         'prev_date_link': reverse('view_user_timesheet', args=(user_id,))+'?month='+str(prev_month)+'&year='+str(prev_year),
         'next_date_link': reverse('view_user_timesheet', args=(user_id,))+'?month='+str(next_month)+'&year='+str(next_year),
@@ -389,6 +375,8 @@ def change_user_timesheet(request, user_id, action):
         }
 #         entries.update(status=update_status[action])
         simple_entries.update(status=update_status[action])
+        TimesheetPeriod.objects.advance([(user.pk, from_date)],
+                update_status[action])
         messages.info(request,
             'Your entries have been %s' % update_status[action])
         return redirect(return_url)
@@ -421,6 +409,7 @@ def change_user_timesheet(request, user_id, action):
 class ListBusinesses(PermissionsRequiredMixin, SearchListView):
     model = Business
     permissions = ('crm.view_business',)
+    keyset_ordering = ('name',)
     redirect_if_one_result = True
     search_fields = ['name__icontains', 'description__icontains']
     template_name = 'timepiece/business/list.html'
@@ -461,6 +450,7 @@ class EditBusiness(PermissionsRequiredMixin, UpdateView):
 
 class ListUsers(PermissionsRequiredMixin, SearchListView):
     model = User
+    keyset_ordering = ('last_name', 'first_name')
     permissions = ('auth.view_user',)
     redirect_if_one_result = True
     search_fields = ['first_name__icontains', 'last_name__icontains',
@@ -515,6 +505,7 @@ class EditUser(PermissionsRequiredMixin, UpdateView):
 class ListProjects(PermissionsRequiredMixin, SearchListView):
     model = Project
     form_class = ProjectSearchForm
+    keyset_ordering = ('business__name', 'name')
     permissions = ['crm.view_project']
     redirect_if_one_result = True
     search_fields = ['name__icontains', 'description__icontains']
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from timepiece.entries.models import Activity, ActivityGroup, Entry, Location,\
-        ProjectHours, SimpleEntry
+        ProjectHours, SimpleEntry, TimesheetPeriod
 
 
 class ActivityAdmin(admin.ModelAdmin):
@@ -76,6 +76,14 @@ class SimpleEntryAdmin(admin.ModelAdmin):
     _project.short_description = 'Project'
 
 
+class TimesheetPeriodAdmin(admin.ModelAdmin):
+    model = TimesheetPeriod
+    list_display = ('user', 'month', 'state')
+    list_filter = ['state', 'user']
+    date_hierarchy = 'month'
+    ordering = ('-month',)
+
+
 
 admin.site.register(Activity, ActivityAdmin)
 admin.site.register(ActivityGroup, ActivityGroupAdmin)
@@ -83,3 +91,4 @@ admin.site.register(Entry, EntryAdmin)
 admin.site.register(Location, LocationAdmin)
 admin.site.register(ProjectHours, ProjectHoursAdmin)
 admin.site.register(SimpleEntry, SimpleEntryAdmin)
+admin.site.register(TimesheetPeriod, TimesheetPeriodAdmin)
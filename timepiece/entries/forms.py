@@ -5,7 +5,8 @@ from django import forms
 
 from timepiece import utils
 from timepiece.crm.models import Project
-from timepiece.entries.models import Entry, Location, ProjectHours, SimpleEntry
+from timepiece.entries.models import Entry, ProjectHours, SimpleEntry, \
+        get_clock_in_defaults
 from timepiece.crm.models import Business
 from timepiece.forms import INPUT_FORMATS, TimepieceSplitDateTimeWidget,\
         TimepieceDateInput
@@ -26,30 +27,27 @@ class ClockInForm(forms.ModelForm):
         self.active = kwargs.pop('active', None)
 
         initial = kwargs.get('initial', {})
-        default_loc = utils.get_setting('TIMEPIECE_DEFAULT_LOCATION_SLUG')
-        if default_loc:
-            try:
-                loc = Location.objects.get(slug=default_loc)
-            except Location.DoesNotExist:
-                loc = None
-            if loc:
-                initial['location'] = loc.pk
-        project = initial.get('project', None)
+        defaults = get_clock_in_defaults(self.user.pk)
+        if defaults['location']:
+            initial['location'] = defaults['location']
         try:
-            last_project_entry = Entry.objects.filter(
-                user=self.user, project=project).order_by('-end_time')[0]
-        except IndexError:
-            initial['activity'] = None
-        else:
-            initial['activity'] = last_project_entry.activity.pk
+            project = int(initial.get('project'))
+        except (TypeError, ValueError):
+            project = None
+        initial['activity'] = defaults['activities'].get(project)
 
         super(ClockInForm, self).__init__(*args, **kwargs)
 
         self.fields['start_time'].required = False
         self.fields['start_time'].initial = datetime.datetime.now()
         self.fields['start_time'].widget = TimepieceSplitDateTimeWidget()
-        self.fields['project'].queryset = Project.trackable.filter(
-                users=self.user)
+        # The choices are rendered from the cache; the queryset is only
+        # used to validate the choice.
+        projects = defaults['projects']
+        field = self.fields['project']
+        field.queryset = Project.objects.filter(
+                pk__in=[pk for pk, name in projects])
+        field.choices = [(u'', field.empty_label)] + projects
         if not self.active:
             self.fields.pop('active_comment')
         else:
@@ -87,10 +85,10 @@ class ClockInForm(forms.ModelForm):
 
     def save(self, commit=True):
         self.instance.hours = 0
-        entry = super(ClockInForm, self).save(commit=commit)
+        # Close the active entry first, as only one entry may be active.
         if self.active and commit:
             self.active.save()
-        return entry
+        return super(ClockInForm, self).save(commit=commit)
 
 
 class ClockOutForm(forms.ModelForm):
@@ -0,0 +1,303 @@
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+import json
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db.models import Sum
+from django.utils.dateparse import parse_date, parse_datetime
+
+from timepiece import utils
+from timepiece.utils import cache
+
+from timepiece.crm.models import Project
+from timepiece.entries.models import Activity, Entry, Location, \
+        SimpleEntry, TimesheetPeriod, CLOCK_IN_DEFAULTS, RECENT_PROJECTS, \
+        get_period_month
+
+
+def read_records(stream, format):
+    """
+    Yields a dictionary for each record of a CSV file with a header row,
+    or of a file with one JSON object per line, without reading the whole
+    file into memory. A record which cannot be read is yielded as a
+    ValidationError instead, so that it can be reported and skipped.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield ValidationError(u'Invalid CSV: {0}'.format(e))
+                continue
+            if None in row:
+                yield ValidationError('More fields than in the header row')
+                continue
+            try:
+                yield dict((key, value.decode('utf-8'))
+                        for key, value in row.iteritems()
+                        if value is not None)
+            except UnicodeDecodeError:
+                yield ValidationError('Invalid UTF-8 text')
+    elif format == 'jsonl':
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield ValidationError(u'Invalid JSON: {0}'.format(e))
+                continue
+            if isinstance(record, dict):
+                yield record
+            else:
+                yield ValidationError('Not a JSON object')
+    else:
+        raise ValueError('Unknown format: {0}'.format(format))
+
+
+class Importer(object):
+    """
+    Builds unsaved entries from import records, validated against maps of
+    users and projects which are loaded once, and saves them in batches
+    with bulk_create.
+
+    Records identify users by username, and projects by name or id. Entries
+    may not be added to approved or invoiced timesheets.
+    """
+    model = None
+    # The field which gives the timesheet month of an entry.
+    date_field = None
+
+    def __init__(self):
+        self.users = dict(User.objects.values_list('username', 'pk'))
+        projects = Project.objects.values_list('name', 'pk')
+        self.projects = dict(projects)
+        self.projects.update((str(pk), pk) for name, pk in projects)
+
+    def build(self, record):
+        """Returns an unsaved entry, or raises ValidationError."""
+        raise NotImplementedError
+
+    def check_batch(self, entries):
+        """
+        Returns a (valid entries, errors) pair for a batch of entries, where
+        errors is a list of (index, message) tuples. Entries are checked in
+        order by check_entry(), after prepare_batch() has loaded what the
+        checks need for the whole batch.
+        """
+        self.prepare_batch(entries)
+        valid, errors = [], []
+        for index, entry in enumerate(entries):
+            error = self.check_entry(entry)
+            if error:
+                errors.append((index, error))
+            else:
+                valid.append(entry)
+        return valid, errors
+
+    def prepare_batch(self, entries):
+        """Loads the locked timesheet periods of the batch with one query."""
+        periods = set(self.get_period(entry) for entry in entries)
+        self.locked = set()
+        if periods:
+            self.locked.update(TimesheetPeriod.objects.filter(
+                    TimesheetPeriod.objects.periods_q(periods),
+                    state__in=TimesheetPeriod.LOCKED,
+            ).values_list('user', 'month'))
+
+    def check_entry(self, entry):
+        """
+        Returns the reason why the entry cannot be saved, or None if it can.
+        """
+        user_id, month = self.get_period(entry)
+        if (user_id, month) in self.locked:
+            return u'The timesheet for {0} has been approved or ' \
+                    'invoiced'.format(month.strftime('%B %Y'))
+        return None
+
+    def get_period(self, entry):
+        """Returns the (user id, month) timesheet period of the entry."""
+        return (entry.user_id,
+                get_period_month(getattr(entry, self.date_field)))
+
+    def save_batch(self, entries):
+        self.model.objects.bulk_create(entries)
+        # bulk_create does not send post_save, which locks the timesheets of
+        # approved and invoiced entries.
+        for state in TimesheetPeriod.LOCKED:
+            TimesheetPeriod.objects.advance([self.get_period(entry)
+                    for entry in entries if entry.status == state], state)
+
+    def lookup(self, mapping, record, key):
+        value = record.get(key)
+        try:
+            return mapping[unicode(value).strip()]
+        except KeyError:
+            raise ValidationError(u'Unknown {0}: {1}'.format(key, value))
+
+    def parse(self, parser, record, key, required=True):
+        value = record.get(key)
+        value = u'' if value is None else unicode(value).strip()
+        if not value and not required:
+            return None
+        try:
+            parsed = parser(value)
+        except (ValueError, InvalidOperation):
+            parsed = None
+        if parsed is None:
+            raise ValidationError(u'Invalid {0}: {1}'.format(key, value))
+        return parsed
+
+    def parse_datetime(self, record, key, required=True):
+        value = self.parse(parse_datetime, record, key, required)
+        return utils.add_timezone(value) if value else value
+
+
+class SimpleEntryImporter(Importer):
+    """
+    Imports simple entries, which may not exceed the limits of a single
+    entry nor SimpleEntry.MAXIMUM_HOURS_PER_DAY per user and day.
+    """
+    model = SimpleEntry
+    date_field = 'date'
+    minimum_hours = Decimal('0.25')
+    maximum_hours = Decimal('13')
+
+    def build(self, record):
+        entry = SimpleEntry(
+            user_id=self.lookup(self.users, record, 'user'),
+            project_id=self.lookup(self.projects, record, 'project'),
+            date=self.parse(parse_date, record, 'date'),
+            hours=self.parse(Decimal, record, 'hours'),
+            minutes=self.parse(Decimal, record, 'minutes', False) or 0,
+            comments=record.get('comments') or u'',
+            status=record.get('status') or SimpleEntry.UNVERIFIED,
+        )
+        if entry.status not in SimpleEntry.STATUSES:
+            raise ValidationError(u'Invalid status: {0}'.format(entry.status))
+        if entry.hours != entry.hours.to_integral_value():
+            raise ValidationError(u'Invalid hours: {0}'.format(entry.hours))
+        if entry.minutes not in dict(SimpleEntry.MINUTES):
+            raise ValidationError(u'Invalid minutes: {0}'.format(
+                    entry.minutes))
+        hours = entry.total_hours()
+        if not self.minimum_hours <= hours <= self.maximum_hours:
+            raise ValidationError(u'Invalid time: {0} hours'.format(hours))
+        return entry
+
+    def prepare_batch(self, entries):
+        """
+        Also loads the hours already logged by the users on the days of the
+        batch, with one grouped query.
+        """
+        super(SimpleEntryImporter, self).prepare_batch(entries)
+        self.totals = {}
+        if not entries:
+            return
+        logged = SimpleEntry.no_join.filter(
+            user__in=set(e.user_id for e in entries),
+            date__in=set(e.date for e in entries),
+        ).values('user', 'date').annotate(hours=Sum('hours'),
+                minutes=Sum('minutes')).order_by()
+        self.totals.update(((day['user'], day['date']),
+                day['hours'] + day['minutes'] / 60) for day in logged)
+
+    def check_entry(self, entry):
+        """Rejects entries which would take a user over the daily limit."""
+        error = super(SimpleEntryImporter, self).check_entry(entry)
+        if error:
+            return error
+        key = (entry.user_id, entry.date)
+        total = self.totals.get(key, 0) + entry.total_hours()
+        if total > SimpleEntry.MAXIMUM_HOURS_PER_DAY:
+            return u'More than {0} hours on {1}'.format(
+                    SimpleEntry.MAXIMUM_HOURS_PER_DAY, entry.date)
+        self.totals[key] = total
+        return None
+
+
+class EntryImporter(Importer):
+    """
+    Imports closed entries. Activities are identified by code or name and
+    locations by slug or name.
+    """
+    model = Entry
+    date_field = 'start_time'
+    maximum_seconds = 12 * 60 * 60
+
+    def __init__(self):
+        super(EntryImporter, self).__init__()
+        self.activities = dict(Activity.objects.values_list('name', 'pk'))
+        self.activities.update(Activity.objects.values_list('code', 'pk'))
+        self.locations = dict(Location.objects.values_list('name', 'pk'))
+        self.locations.update(Location.objects.values_list('slug', 'pk'))
+        self.billable_activities = set(Activity.objects.filter(
+                billable=True).values_list('pk', flat=True))
+        self.billable_projects = set(Project.objects.filter(
+                type__billable=True).values_list('pk', flat=True))
+
+    def build(self, record):
+        entry = Entry(
+            user_id=self.lookup(self.users, record, 'user'),
+            project_id=self.lookup(self.projects, record, 'project'),
+            activity_id=self.lookup(self.activities, record, 'activity'),
+            location_id=self.lookup(self.locations, record, 'location'),
+            start_time=self.parse_datetime(record, 'start_time'),
+            end_time=self.parse_datetime(record, 'end_time'),
+            seconds_paused=self.parse(int, record, 'seconds_paused',
+                    False) or 0,
+            comments=record.get('comments') or u'',
+            status=record.get('status') or Entry.UNVERIFIED,
+        )
+        if entry.status not in Entry.STATUSES:
+            raise ValidationError(u'Invalid status: {0}'.format(entry.status))
+        if entry.end_time <= entry.start_time:
+            raise ValidationError('Ending time must exceed the starting time')
+        if (entry.end_time - entry.start_time > datetime.timedelta(
+                seconds=self.maximum_seconds)
+                or entry.seconds_paused > self.maximum_seconds):
+            raise ValidationError('Ending time exceeds starting time by 12 '
+                    'hours or more')
+        # Entry.save() is bypassed by bulk_create.
+        entry.hours = Decimal('%.2f' % round(entry.total_hours, 2))
+        entry.billable = (entry.activity_id in self.billable_activities
+                and entry.project_id in self.billable_projects)
+        entry.work_date = utils.get_local_date(entry.end_time)
+        return entry
+
+    def prepare_batch(self, entries):
+        super(EntryImporter, self).prepare_batch(entries)
+        # The times of the entries accepted so far, by user.
+        self.times = {}
+
+    def check_entry(self, entry):
+        """
+        Rejects entries which overlap another entry of their user, whether
+        saved or earlier in the batch. Saved entries are found with a probe
+        of the overlap constraint's index.
+        """
+        error = super(EntryImporter, self).check_entry(entry)
+        if error:
+            return error
+        times = self.times.setdefault(entry.user_id, [])
+        for start, end in times:
+            if entry.start_time <= end and start <= entry.end_time:
+                return u'Overlaps the entry from {0:%m/%d/%Y %H:%M} to ' \
+                        '{1:%m/%d/%Y %H:%M} in the same file'.format(start, end)
+        error = entry.get_overlap_error(entry.start_time, entry.end_time)
+        if error:
+            return error
+        times.append((entry.start_time, entry.end_time))
+        return None
+
+    def save_batch(self, entries):
+        super(EntryImporter, self).save_batch(entries)
+        # bulk_create does not send post_save.
+        for user_id in set(entry.user_id for entry in entries):
+            cache.bump_version(RECENT_PROJECTS.format(user_id))
+            cache.bump_version(CLOCK_IN_DEFAULTS.format(user_id))
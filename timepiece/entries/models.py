@@ -1,16 +1,81 @@
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal
-from datetime import date
+import datetime
 
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.core import validators
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q, Sum, Max, Min
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Q, Sum, Max
+from django.db.models.signals import m2m_changed, post_delete, post_init, \
+        post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from timepiece import utils
-from timepiece.crm.models import Project
+from timepiece.crm.models import Attribute, Project, ProjectRelationship
+from timepiece.utils import cache
+from timepiece.utils.aggregates import SumIf, sql_in
+
+
+# The unique index which allows a single active entry per user; see
+# sql/entry.postgresql_psycopg2.sql.
+SINGLE_ACTIVE_INDEX = 'timepiece_entry_single_active'
+
+# The exclusion constraint which prevents the closed entries of a user from
+# overlapping, and the expressions it compares, which queries must repeat
+# to use its index.
+NO_OVERLAP_CONSTRAINT = 'timepiece_entry_no_overlap'
+OVERLAP_SQL = [
+    "timepiece_entry.end_time IS NOT NULL",
+    "int4range(timepiece_entry.user_id, timepiece_entry.user_id, '[]') && "
+        "int4range(%s, %s, '[]')",
+    "tstzrange(timepiece_entry.start_time, timepiece_entry.end_time, '[]') "
+        "&& tstzrange(%s, %s, '[]')",
+]
+
+# The hours of an entry ending at {end} after {paused} seconds of pauses, as
+# computed by Entry.save().
+HOURS_SQL = """GREATEST(0, ROUND(CAST(
+    (EXTRACT(EPOCH FROM {end} - start_time) - ({paused})) / 3600
+    AS numeric), 2))"""
+
+# Whether an active entry could be closed at a time without overlapping
+# another entry of its user.
+NO_CONFLICT_SQL = """NOT EXISTS (
+    SELECT 1 FROM timepiece_entry other
+    WHERE other.end_time IS NOT NULL
+    AND int4range(other.user_id, other.user_id, '[]') &&
+        int4range(timepiece_entry.user_id, timepiece_entry.user_id, '[]')
+    AND tstzrange(other.start_time, other.end_time, '[]') &&
+        tstzrange(timepiece_entry.start_time, %s, '[]')
+)"""
+
+# The first day of the month of an entry's start, in the time zone %s, as
+# TimesheetPeriod months are computed by get_period_month().
+PERIOD_MONTH_SQL = """DATE_TRUNC('month',
+    timepiece_entry.start_time AT TIME ZONE %s)"""
+
+# Cache namespace for the projects and users offered by the schedule editor,
+# and the user fields they depend on.
+SCHEDULE_REFERENCES = 'schedule-references'
+SCHEDULE_USER_FIELDS = ('first_name', 'last_name', 'is_superuser')
+
+# Cache namespace for the projects a user most recently clocked in to.
+RECENT_PROJECTS = 'recent-projects:{0}'
+RECENT_PROJECTS_SIZE = 20
+
+# Cache namespaces for the clock in form: one for the trackable projects and
+# the default location, and one per user for the defaults built from them.
+CLOCK_IN_REFERENCES = 'clock-in-references'
+CLOCK_IN_DEFAULTS = 'clock-in-defaults:{0}'
+
+# Cache namespace for the activities allowed by each activity group.
+ACTIVITY_GROUPS = 'activity-groups'
+
+# Cache namespace for the users who are clocked in. Its version changes
+# whenever someone clocks in, clocks out or pauses.
+PRESENCE = 'presence'
 
 
 class Activity(models.Model):
@@ -56,14 +121,30 @@ class Location(models.Model):
         return self.name
 
 
+def end_time_q(lookup, value):
+    """
+    Returns a Q object which compares end_time to the value with the 'gte'
+    or 'lt' lookup. Dates and local midnights are compared to the indexed
+    work_date column instead.
+    """
+    if isinstance(value, datetime.datetime):
+        local = timezone.localtime(value) if timezone.is_aware(value) \
+                else value
+        if local.time() != datetime.time():
+            return Q(**{'end_time__' + lookup: value})
+        value = local.date()
+    return Q(**{'work_date__' + lookup: value})
+
+
 class EntryQuerySet(models.query.QuerySet):
     """QuerySet extension to provide filtering by billable status"""
 
     def date_trunc(self, key='month', extra_values=None):
-        select = {"day": {"date": """DATE_TRUNC('day', end_time)"""},
-                  "week": {"date": """DATE_TRUNC('week', end_time)"""},
-                  "month": {"date": """DATE_TRUNC('month', end_time)"""},
-                  "year": {"date": """DATE_TRUNC('year', end_time)"""},
+        trunc = "DATE_TRUNC('{0}', timepiece_entry.work_date)"
+        select = {"day": {"date": "timepiece_entry.work_date"},
+                  "week": {"date": trunc.format('week')},
+                  "month": {"date": trunc.format('month')},
+                  "year": {"date": trunc.format('year')},
         }
         basic_values = (
             'user', 'date', 'user__first_name', 'user__last_name', 'billable',
@@ -91,27 +172,179 @@ class EntryQuerySet(models.query.QuerySet):
                 diff = relativedelta(days=1)
             if diff is not None:
                 to_date = from_date + diff
-        datesQ = Q(end_time__gte=from_date)
-        datesQ &= Q(end_time__lt=to_date) if to_date else Q()
+        datesQ = end_time_q('gte', from_date)
+        datesQ &= end_time_q('lt', to_date) if to_date else Q()
         datesQ |= Q(end_time__isnull=True) if current else Q()
         return self.filter(datesQ)
 
+    def overlapping(self, user_id, start, end):
+        """
+        Narrows to the user's closed entries which overlap the times from
+        start to end, inclusive, with one probe of the overlap constraint's
+        index.
+        """
+        return self.extra(where=OVERLAP_SQL,
+                params=[user_id, user_id, start, end])
+
+    def pause(self, when=None):
+        """
+        Pauses the active entries which are not paused yet at the given
+        time, or now, with a single UPDATE. Returns the number of entries
+        paused.
+        """
+        when = when or timezone.now()
+        entries = self.filter(end_time__isnull=True, pause_time__isnull=True,
+                start_time__lte=when)
+        count = entries._update_sql("""
+            pause_time = %s,
+            hours = {hours},
+            date_updated = %s
+        """.format(hours=HOURS_SQL.format(end='%s', paused='seconds_paused')),
+                [when, when, when])
+        if count:
+            cache.bump_version(PRESENCE)
+        return count
+
+    def close(self, when=None):
+        """
+        Closes the active entries which started before the given time, or
+        now, at that time with a single UPDATE, adding the time which paused
+        entries have been paused for. Entries which would then overlap an
+        entry of their user are left active. Returns the number of entries
+        closed.
+        """
+        when = when or timezone.now()
+        entries = self.filter(end_time__isnull=True, start_time__lt=when)
+        paused = """seconds_paused + CASE WHEN pause_time IS NULL THEN 0
+            ELSE GREATEST(0, FLOOR(EXTRACT(EPOCH FROM %s - pause_time))) END"""
+        count = entries._update_sql("""
+            end_time = %s,
+            seconds_paused = {paused},
+            pause_time = NULL,
+            hours = {hours},
+            work_date = %s,
+            date_updated = %s
+        """.format(paused=paused, hours=HOURS_SQL.format(end='%s',
+                paused=paused)), [when, when, when, when,
+                utils.get_local_date(when), when],
+                where=NO_CONFLICT_SQL, where_params=[when])
+        if count:
+            cache.bump_version(PRESENCE)
+        return count
+
+    def _update_sql(self, assignments, params, where='TRUE',
+            where_params=()):
+        """
+        Updates the entries with the given SQL assignments in a single
+        statement, and returns the number of entries updated. Should be run
+        within a transaction.
+        """
+        ids, ids_params = self.order_by().values('pk').query \
+                .sql_with_params()
+        sql = """
+            UPDATE timepiece_entry SET {assignments}
+            WHERE id IN ({ids}) AND {where}
+        """.format(assignments=assignments, ids=ids, where=where)
+        cursor = connection.cursor()
+        cursor.execute(sql, list(params) + list(ids_params) +
+                list(where_params))
+        transaction.commit_unless_managed()
+        return cursor.rowcount
+
+    def project_totals(self):
+        """
+        Returns a list of dictionaries with the total hours per project,
+        split into billable and non-billable hours by activity. The list is
+        ordered by project type, status, business and name, and contains one
+        item per project regardless of the number of entries.
+        """
+        values = ('project', 'project__name', 'project__type__label',
+                'project__status__label', 'project__business__name',
+                'project__business__short_name', 'activity__billable')
+        ordering = ('project__type__label', 'project__status__label',
+                'project__business__name', 'project__name')
+        rows = self.values(*values).annotate(hours=Sum('hours'))
+        rows = rows.order_by(*ordering)
+        totals = []
+        projects = {}
+        for row in rows:
+            pk = row['project']
+            if pk not in projects:
+                projects[pk] = {
+                    'pk': pk,
+                    'name': row['project__name'],
+                    'type': row['project__type__label'],
+                    'status': row['project__status__label'],
+                    'business': row['project__business__short_name'] or
+                            row['project__business__name'],
+                    'billable': Decimal('0'),
+                    'non_billable': Decimal('0'),
+                }
+                totals.append(projects[pk])
+            key = 'billable' if row['activity__billable'] else 'non_billable'
+            projects[pk][key] += row['hours'] or 0
+        return totals
+
+    def summary(self):
+        """
+        Returns the billable, non-billable, invoiced, uninvoiced and total
+        hours of the entries, computed with a single conditional aggregate
+        query. Hours on the projects in TIMEPIECE_PAID_LEAVE_PROJECTS are
+        not counted as worked; they are listed under 'paid_leave' by the
+        key set in that setting instead, or None if there are none.
+        """
+        projects = utils.get_setting('TIMEPIECE_PAID_LEAVE_PROJECTS')
+        leave = sql_in('timepiece_entry.project_id', projects.values())
+        worked = 'NOT ({0}) AND '.format(leave)
+        aggregates = {
+            'total': Sum('hours'),
+            'invoiced': SumIf('hours',
+                    "timepiece_entry.status = '{0}'".format(Entry.INVOICED)),
+            'billable': SumIf('hours', worked + 'timepiece_entry.billable'),
+            'non_billable': SumIf('hours',
+                    worked + 'NOT timepiece_entry.billable'),
+        }
+        leave_aliases = {}
+        for index, (name, pk) in enumerate(projects.iteritems()):
+            alias = 'paid_leave_{0}'.format(index)
+            aggregates[alias] = SumIf('hours', sql_in(
+                    'timepiece_entry.project_id', [pk]))
+            leave_aliases[name] = alias
+        totals = self.aggregate(**aggregates)
+
+        data = {}
+        for key in ('billable', 'non_billable', 'invoiced', 'total'):
+            data[key] = totals[key] or Decimal('0')
+        data['uninvoiced'] = data['total'] - data['invoiced']
+        data['total_worked'] = data['billable'] + data['non_billable']
+        data['paid_leave'] = dict((name, totals[alias])
+                for name, alias in leave_aliases.iteritems())
+        return data
+
+    def blocking_users(self):
+        """
+        Returns a pair of lists of (pk, first name, last name) tuples for
+        the users who have unverified and verified (but unapproved) entries,
+        respectively, using a single query.
+        """
+        statuses = (Entry.UNVERIFIED, Entry.VERIFIED)
+        rows = self.filter(status__in=statuses).values_list('status',
+                'user__pk', 'user__first_name', 'user__last_name')
+        rows = rows.order_by('user__first_name', 'user__pk').distinct()
+        unverified, unapproved = [], []
+        for row in rows:
+            if row[0] == Entry.UNVERIFIED:
+                unverified.append(row[1:])
+            else:
+                unapproved.append(row[1:])
+        return unverified, unapproved
+
 
 class EntryManager(models.Manager):
 
     def get_query_set(self):
         qs = EntryQuerySet(self.model)
-        qs = qs.select_related('activity', 'project__type')
-
-        # ensure our select_related are added.  Without this line later calls
-        # to select_related will void ours (not sure why - probably a bug
-        # in Django)
-        # in other words: do not remove!
-        str(qs.query)
-
-        qs = qs.extra({'billable': 'timepiece_activity.billable AND '
-                                   'timepiece_attribute.billable'})
-        return qs
+        return qs.select_related('activity', 'project__type')
 
     def date_trunc(self, key='month', extra_values=()):
         return self.get_query_set().date_trunc(key, extra_values)
@@ -119,6 +352,15 @@ class EntryManager(models.Manager):
     def timespan(self, from_date, to_date=None, span='month'):
         return self.get_query_set().timespan(from_date, to_date, span)
 
+    def overlapping(self, user_id, start, end):
+        return self.get_query_set().overlapping(user_id, start, end)
+
+    def pause(self, when=None):
+        return self.get_query_set().pause(when)
+
+    def close(self, when=None):
+        return self.get_query_set().close(when)
+
 
 class EntryWorkedManager(models.Manager):
 
@@ -162,6 +404,12 @@ class Entry(models.Model):
     date_updated = models.DateTimeField(auto_now=True)
 
     hours = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    # Whether both the activity and the project type are billable. Kept up
+    # to date by save() and when either flag changes.
+    billable = models.BooleanField(default=True, db_index=True)
+    # The date of end_time in the local time zone, set by save(). Entries
+    # are filtered and grouped by day on this column.
+    work_date = models.DateField(blank=True, null=True, db_index=True)
 
     objects = EntryManager()
     worked = EntryWorkedManager()
@@ -216,29 +464,41 @@ class Entry(models.Model):
 
     def is_overlapping(self):
         if self.start_time and self.end_time:
-            entries = self.user.timepiece_entries.filter(
-            Q(end_time__range=(self.start_time, self.end_time)) |
-            Q(start_time__range=(self.start_time, self.end_time)) |
-            Q(start_time__lte=self.start_time, end_time__gte=self.end_time))
-
-            totals = entries.aggregate(
-            max=Max('end_time'), min=Min('start_time'))
-
-            totals['total'] = 0
-            for entry in entries:
-                totals['total'] = totals['total'] + entry.get_total_seconds()
-
-            totals['diff'] = totals['max'] - totals['min']
-            totals['diff'] = totals['diff'].seconds + \
-                totals['diff'].days * 86400
-
-            if totals['total'] > totals['diff']:
-                return True
-            else:
+            entries = EntryQuerySet(Entry).overlapping(self.user_id,
+                    self.start_time, self.end_time)
+            entries = list(entries) + ([] if self.id else [self])
+            if not entries:
                 return False
+            diff = max(e.end_time for e in entries) - \
+                    min(e.start_time for e in entries)
+            diff = diff.seconds + diff.days * 86400
+            total = sum(entry.get_total_seconds() for entry in entries)
+            return total > diff
         else:
             return None
 
+    def get_overlap_error(self, start, end):
+        """
+        Returns a message describing the first entry which overlaps the
+        times from start to end, or None.
+        """
+        if end < start:
+            return None  # Reported by clean().
+        entries = Entry.objects.overlapping(self.user_id, start, end)
+        if self.id:
+            entries = entries.exclude(pk=self.id)
+        for entry in entries[:1]:
+            if entry.start_time.date() == start.date() \
+                    and entry.end_time.date() == end.date():
+                time_format = '%H:%M:%S'
+            else:
+                time_format = '%H:%M:%S on %m\%d\%Y'
+            return 'Start time overlaps with {activity} on {project} from ' \
+                    '{start_time} to {end_time}.'.format(
+                        activity=entry.activity, project=entry.project,
+                        start_time=entry.start_time.strftime(time_format),
+                        end_time=entry.end_time.strftime(time_format))
+
     def clean(self):
         if not self.user_id:
             raise ValidationError('An unexpected error has occured')
@@ -250,60 +510,21 @@ class Entry(models.Model):
         #Current entries have no end_time
         else:
             end = start + relativedelta(seconds=1)
-        entries = self.user.timepiece_entries.filter(
-            Q(end_time__range=(start, end)) |
-            Q(start_time__range=(start, end)) |
-            Q(start_time__lte=start, end_time__gte=end))
-        #An entry can not conflict with itself so remove it from the list
-        if self.id:
-            entries = entries.exclude(pk=self.id)
-        for entry in entries:
-            entry_data = {
-                'project': entry.project,
-                'activity': entry.activity,
-                'start_time': entry.start_time,
-                'end_time': entry.end_time
-            }
-            #Conflicting saved entries
-            if entry.end_time:
-                if entry.start_time.date() == start.date() \
-                and entry.end_time.date() == end.date():
-                    entry_data['start_time'] = entry.start_time.strftime(
-                        '%H:%M:%S')
-                    entry_data['end_time'] = entry.end_time.strftime(
-                        '%H:%M:%S')
-                    raise ValidationError('Start time overlaps with '
-                            '{activity} on {project} from {start_time} to '
-                            '{end_time}.'.format(**entry_data))
-                else:
-                    entry_data['start_time'] = entry.start_time.strftime(
-                        '%H:%M:%S on %m\%d\%Y')
-                    entry_data['end_time'] = entry.end_time.strftime(
-                        '%H:%M:%S on %m\%d\%Y')
-                    raise ValidationError('Start time overlaps with '
-                            '{activity} on {project} from {start_time} to '
-                            '{end_time}.'.format(**entry_data))
+        overlap_error = self.get_overlap_error(start, end)
+        if overlap_error:
+            raise ValidationError(overlap_error)
         try:
-            act_group = self.project.activity_group
-            if act_group:
-                activity = self.activity
-                if not act_group.activities.filter(pk=activity.pk).exists():
-                    name = activity.name
-                    err_msg = '%s is not allowed for this project. ' % name
-                    allowed = act_group.activities.filter()
-                    allowed = allowed.values_list('name', flat=True)
-                    allowed_names = ['among ']
-                    if len(allowed) > 1:
-                        for index, activity in enumerate(allowed):
-                            allowed_names += activity
-                            if index < len(allowed) - 2:
-                                allowed_names += ', '
-                            elif index < len(allowed) - 1:
-                                allowed_names += ', and '
-                        allowed_activities = ''.join(allowed_names)
-                    else:
-                        allowed_activities = allowed[0]
-                    err_msg += 'Please choose %s' % allowed_activities
+            group_id = self.project.activity_group_id
+            if group_id:
+                ids, names = get_activity_groups().get(group_id, ((), ()))
+                if self.activity_id not in ids:
+                    err_msg = '%s is not allowed for this project. ' % \
+                            self.activity.name
+                    if len(names) > 1:
+                        err_msg += 'Please choose among %s, and %s' % (
+                                ', '.join(names[:-1]), names[-1])
+                    elif names:
+                        err_msg += 'Please choose %s' % names[0]
                     raise ValidationError(err_msg)
         except (Project.DoesNotExist, Activity.DoesNotExist):
             # Will be caught by field requirements
@@ -323,15 +544,8 @@ class Entry(models.Model):
                     end.strftime('%H:%M:%S')
                 )
             raise ValidationError(err_msg)
-        month_start = utils.get_month_start(start)
-        next_month = month_start + relativedelta(months=1)
-        entries = self.user.timepiece_entries.filter(
-            Q(status=Entry.APPROVED) | Q(status=Entry.INVOICED),
-            start_time__gte=month_start,
-            end_time__lt=next_month
-        )
-        if (entries.exists() and not self.id
-                or self.id and self.status == Entry.INVOICED):
+        if (self.id and self.status == Entry.INVOICED or not self.id
+                and TimesheetPeriod.objects.is_locked(self.user_id, start)):
             msg = 'You cannot add/edit entries after a timesheet has been ' \
                 'approved or invoiced. Please correct the start and end times.'
             raise ValidationError(msg)
@@ -339,7 +553,25 @@ class Entry(models.Model):
 
     def save(self, *args, **kwargs):
         self.hours = Decimal('%.2f' % round(self.total_hours, 2))
-        super(Entry, self).save(*args, **kwargs)
+        self.billable = self.activity.billable and self.project.billable
+        self.work_date = utils.get_local_date(self.end_time)
+        # The database refuses a second active entry and overlapping
+        # entries. A savepoint keeps the surrounding transaction usable if
+        # it does, so that the error can be reported.
+        sid = transaction.savepoint()
+        try:
+            super(Entry, self).save(*args, **kwargs)
+        except IntegrityError as e:
+            transaction.savepoint_rollback(sid)
+            if SINGLE_ACTIVE_INDEX in str(e):
+                raise utils.ActiveEntryError(
+                        'Only one active entry is allowed.')
+            if NO_OVERLAP_CONSTRAINT in str(e):
+                raise ValidationError(self.get_overlap_error(
+                        self.start_time, self.end_time) or str(e))
+            raise
+        transaction.savepoint_commit(sid)
+        remember_entry_fields(Entry, self)
 
     def get_total_seconds(self):
         """
@@ -399,11 +631,7 @@ class Entry(models.Model):
         """
         Pause all open entries
         """
-        entries = self.user.timepiece_entries.filter(
-        end_time__isnull=True).all()
-        for entry in entries:
-            entry.pause()
-            entry.save()
+        EntryQuerySet(Entry).filter(user=self.user_id).pause()
 
     def unpause(self, date=None):
         if self.is_paused:
@@ -460,40 +688,9 @@ class Entry(models.Model):
         be added to the summary separately using the dictionary key set in
         TIMEPIECE_PAID_LEAVE_PROJECTS.
         """
-        projects = utils.get_setting('TIMEPIECE_PAID_LEAVE_PROJECTS')
         entries = user.timepiece_entries.filter(
             end_time__gt=date, end_time__lt=end_date)
-        data = {
-            'billable': Decimal('0'), 'non_billable': Decimal('0'),
-            'invoiced': Decimal('0'), 'uninvoiced': Decimal('0'),
-            'total': Decimal('0')
-            }
-        invoiced = entries.filter(
-            status=Entry.INVOICED).aggregate(i=Sum('hours'))['i']
-        uninvoiced = entries.exclude(
-            status=Entry.INVOICED).aggregate(uninv=Sum('hours'))['uninv']
-        total = entries.aggregate(s=Sum('hours'))['s']
-        if invoiced:
-            data['invoiced'] = invoiced
-        if uninvoiced:
-            data['uninvoiced'] = uninvoiced
-        if total:
-            data['total'] = total
-        billable = entries.exclude(project__in=projects.values())
-        billable = billable.values(
-            'billable',
-        ).annotate(s=Sum('hours'))
-        for row in billable:
-            if row['billable']:
-                data['billable'] += row['s']
-            else:
-                data['non_billable'] += row['s']
-        data['total_worked'] = data['billable'] + data['non_billable']
-        data['paid_leave'] = {}
-        for name, pk in projects.iteritems():
-            qs = entries.filter(project=projects[name])
-            data['paid_leave'][name] = qs.aggregate(s=Sum('hours'))['s']
-        return data
+        return entries.summary()
 
 
 class ProjectHours(models.Model):
@@ -505,6 +702,7 @@ class ProjectHours(models.Model):
         validators=[validators.MinValueValidator(Decimal("0.01"))]
     )
     published = models.BooleanField(default=False)
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def __unicode__(self):
         return "{0} on {1} for Week of {2}".format(
@@ -523,8 +721,101 @@ class ProjectHours(models.Model):
         unique_together = ('week_start', 'project', 'user')
 
 
+class SimpleEntryRow(object):
+    """
+    A read-only simple entry for listings, with the names of its user,
+    project and business instead of the related objects.
+    """
+    FIELDS = ('id', 'date', 'status', 'comments', 'hours', 'minutes',
+            'user__first_name', 'user__last_name', 'project__name',
+            'project__business__name')
+    __slots__ = ('id', 'date', 'status', 'comments', 'hours', 'minutes',
+            'user_name', 'project_name', 'business_name', 'day_seconds')
+
+    def __init__(self, values, day_seconds=None):
+        self.id = values['id']
+        self.date = values['date']
+        self.status = values['status']
+        self.comments = values['comments']
+        self.hours = values['hours']
+        self.minutes = values['minutes']
+        self.user_name = u'{0} {1}'.format(values['user__first_name'],
+                values['user__last_name'])
+        self.project_name = values['project__name']
+        self.business_name = values['project__business__name']
+        self.day_seconds = day_seconds
+
+    def get_total_seconds(self):
+        return self.hours * 3600 + self.minutes * 60
+
+
+class SimpleEntryRows(object):
+    """
+    A lazy sequence of SimpleEntryRow objects, which only fetches the rows
+    it is sliced or iterated over, so that it can be paginated.
+
+    If day_totals is True, each row also has the total seconds logged on
+    its date, which are loaded with one grouped query.
+    """
+
+    def __init__(self, queryset, day_totals=False):
+        self.values = queryset.values(*SimpleEntryRow.FIELDS)
+        self.queryset = queryset
+        self.day_totals = day_totals
+        self._day_seconds = None
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.values.count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __nonzero__(self):
+        if self._count is not None:
+            return self._count > 0
+        return self.values.exists()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += self.count()
+            if index < 0:
+                raise IndexError('SimpleEntryRows index out of range')
+            rows = self[index:index + 1]
+            if not rows:
+                raise IndexError('SimpleEntryRows index out of range')
+            return rows[0]
+        # Querysets cannot be sliced from the end, so count the rows first.
+        if any(i is not None and i < 0 for i in (index.start, index.stop)):
+            index = slice(*index.indices(self.count()))
+        day_seconds = self.get_day_seconds()
+        return [SimpleEntryRow(values, day_seconds.get(values['date']))
+                for values in self.values[index]]
+
+    def get_day_seconds(self):
+        if not self.day_totals:
+            return {}
+        if self._day_seconds is None:
+            days = self.queryset.order_by().values('date').annotate(
+                    hours=Sum('hours'), minutes=Sum('minutes'))
+            self._day_seconds = dict((day['date'],
+                    day['hours'] * 3600 + day['minutes'] * 60)
+                    for day in days)
+        return self._day_seconds
+
+
 class SimpleEntryQuerySet(models.query.QuerySet):
 
+    def rows(self, day_totals=False):
+        """Returns the simple entries as a lazy SimpleEntryRows sequence."""
+        return SimpleEntryRows(self, day_totals)
+
     def date_trunc(self, key='month', extra_values=None):
         select = {"day": {"date": """DATE_TRUNC('day', date)"""},
                   "week": {"date": """DATE_TRUNC('week', date)"""},
@@ -569,15 +860,7 @@ class SimpleEntryManager(models.Manager):
 
     def get_query_set(self):
         qs = SimpleEntryQuerySet(self.model)
-        qs = qs.select_related('activity', 'project__type')
-
-        # ensure our select_related are added.  Without this line later calls
-        # to select_related will void ours (not sure why - probably a bug
-        # in Django)
-        # in other words: do not remove!
-        str(qs.query)
-
-        return qs
+        return qs.select_related('project__type')
 
     def date_trunc(self, key='month', extra_values=()):
         return self.get_query_set().date_trunc(key, extra_values)
@@ -674,3 +957,419 @@ class SimpleEntry(models.Model):
             raise ValidationError('Minimum time per entry is 15 minutes')
         if (self.total_hours() > 13.0):
             raise ValidationError('Maximum time per entry is 13 hours')
+        if (not self.id and self.user_id and self.date and
+                TimesheetPeriod.objects.is_locked(self.user_id, self.date)):
+            raise ValidationError('You cannot add entries after a timesheet '
+                    'has been approved or invoiced.')
+
+
+def get_period_month(value):
+    """Returns the first day of the local month of a date or datetime."""
+    return utils.get_local_date(value).replace(day=1)
+
+
+class TimesheetPeriodManager(models.Manager):
+
+    def is_locked(self, user, value):
+        """
+        Returns whether the user's timesheet for the month of the date or
+        datetime has been approved or invoiced, with an indexed lookup.
+        """
+        return self.filter(user=user, month=get_period_month(value),
+                state__in=TimesheetPeriod.LOCKED).exists()
+
+    def periods_q(self, periods):
+        """
+        Returns a Q object which matches the (user id, month) pairs, which
+        must not be empty.
+        """
+        by_month = {}
+        for user_id, month in periods:
+            by_month.setdefault(month, set()).add(user_id)
+        q = Q()
+        for month, user_ids in by_month.items():
+            q |= Q(month=month, user__in=user_ids)
+        return q
+
+    def advance(self, periods, state):
+        """
+        Moves the (user id, month) periods forward to the given state,
+        creating missing periods. Periods which have already reached the
+        state, or gone beyond it, are left as they are.
+        """
+        periods = set((user_id, get_period_month(month))
+                for user_id, month in periods)
+        if not periods:
+            return
+        q = self.periods_q(periods)
+        earlier = TimesheetPeriod.ORDER[:TimesheetPeriod.ORDER.index(state)]
+        # Another transaction may create some of the missing periods
+        # meanwhile. If it does, they are advanced on a second pass.
+        for attempt in range(2):
+            self.filter(q, state__in=earlier).update(state=state)
+            existing = set(self.filter(q).values_list('user', 'month'))
+            if not periods - existing:
+                return
+            sid = transaction.savepoint()
+            try:
+                self.bulk_create([TimesheetPeriod(user_id=user_id,
+                        month=month, state=state)
+                        for user_id, month in periods - existing])
+            except IntegrityError as e:
+                transaction.savepoint_rollback(sid)
+                if attempt:
+                    raise e
+            else:
+                transaction.savepoint_commit(sid)
+                return
+
+    def entry_periods(self, entries):
+        """
+        Returns the distinct (user id, month) periods of the entries, which
+        are computed by the database in the current time zone.
+        """
+        return entries.extra(select={'month': PERIOD_MONTH_SQL},
+                select_params=[timezone.get_current_timezone_name()]) \
+                .order_by().values_list('user', 'month').distinct()
+
+
+class TimesheetPeriod(models.Model):
+    """
+    The state of a user's timesheet for a month, which is moved forward as
+    the timesheet is verified, approved and invoiced. No entries may be
+    added to an approved or invoiced period.
+    """
+    OPEN = 'open'
+    VERIFIED = 'verified'
+    APPROVED = 'approved'
+    INVOICED = 'invoiced'
+    STATES = {
+        OPEN: 'Open',
+        VERIFIED: 'Verified',
+        APPROVED: 'Approved',
+        INVOICED: 'Invoiced',
+    }
+    ORDER = [OPEN, VERIFIED, APPROVED, INVOICED]
+    LOCKED = (APPROVED, INVOICED)
+
+    user = models.ForeignKey(User, related_name='timesheet_periods')
+    month = models.DateField(help_text='The first day of the month.')
+    state = models.CharField(max_length=24, choices=STATES.items(),
+            default=OPEN)
+
+    objects = TimesheetPeriodManager()
+
+    class Meta:
+        db_table = 'timepiece_timesheetperiod'
+        unique_together = ('user', 'month')
+
+    def __unicode__(self):
+        return u'{0} for {1}'.format(self.user, self.month.strftime('%B %Y'))
+
+
+class ImportProgress(models.Model):
+    """
+    The number of records of an import which have been processed. It is
+    saved in the same transaction as each batch of records, so that a
+    resumed import neither skips nor repeats a batch.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    records = models.PositiveIntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'timepiece_importprogress'
+
+    def __unicode__(self):
+        return u'{0}: {1} records'.format(self.name, self.records)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_schedule_references(sender, **kwargs):
+    """Projects, users or their permissions changed."""
+    cache.bump_version(SCHEDULE_REFERENCES)
+
+
+@receiver(post_init, sender=User)
+def remember_user_references(sender, instance, **kwargs):
+    instance._references = [getattr(instance, name)
+            for name in SCHEDULE_USER_FIELDS]
+
+
+@receiver(post_save, sender=User)
+def update_user_references(sender, instance, created=False, **kwargs):
+    """
+    A user was added or changed. Saves which leave the listed fields as
+    they were, such as the update of last_login, keep the references.
+    """
+    current = [getattr(instance, name) for name in SCHEDULE_USER_FIELDS]
+    if created or current != getattr(instance, '_references', None):
+        cache.bump_version(SCHEDULE_REFERENCES)
+    instance._references = current
+
+
+@receiver(post_init, sender=Entry)
+def remember_entry_fields(sender, instance, **kwargs):
+    """
+    Remembers the project and start time of the entry as they were loaded
+    or last saved, so that the receivers below can tell what changed.
+    Times are compared as aware since entries may be saved with naive ones.
+    """
+    start = instance.start_time
+    instance._original = (instance.project_id,
+            start and utils.add_timezone(start))
+
+
+def get_entry_changed(instance):
+    """Whether the project or start time of a saved entry changed."""
+    start = instance.start_time
+    current = (instance.project_id, start and utils.add_timezone(start))
+    return current != getattr(instance, '_original', None)
+
+
+def get_recent_projects(user_id, version=None):
+    """
+    Returns (project id, start time) pairs for the projects which the user
+    most recently clocked in to, newest first. The list is cached per user
+    and kept up to date as entries are saved.
+    """
+    def build():
+        rows = Entry.no_join.filter(user=user_id).values('project') \
+                .annotate(last_start=Max('start_time')) \
+                .order_by('-last_start')[:RECENT_PROJECTS_SIZE]
+        return [(row['project'], row['last_start']) for row in rows]
+    return cache.get_or_set(RECENT_PROJECTS.format(user_id), 'projects',
+            build, version)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def update_recent_projects(sender, instance, signal, created=False,
+        **kwargs):
+    """
+    Moves the project of a new entry to the front of the user's recent
+    projects. Entries whose project or start time was edited, and deleted
+    entries, may push a project back, so the list is rebuilt instead. Other
+    edits, such as clocking out, leave the list as it is.
+    """
+    namespace = RECENT_PROJECTS.format(instance.user_id)
+    if signal is post_delete or not created and get_entry_changed(instance):
+        cache.bump_version(namespace)
+        return
+    if not created:
+        return
+    # The list is stored under the version it was read from, so that it is
+    # dropped rather than overwritten if another process bumped it meanwhile.
+    version = cache.get_version(namespace)
+    recent = dict((project, utils.add_timezone(start)) for project, start
+            in get_recent_projects(instance.user_id, version))
+    start = recent.get(instance.project_id)
+    if start is None or start < utils.add_timezone(instance.start_time):
+        recent[instance.project_id] = utils.add_timezone(instance.start_time)
+        recent = sorted(recent.items(), key=lambda pair: pair[1],
+                reverse=True)
+        cache.set_value(namespace, 'projects', recent[:RECENT_PROJECTS_SIZE],
+                version)
+
+
+def get_clock_in_defaults(user_id):
+    """
+    Returns the default location, the projects the user can clock in to, as
+    (pk, name) pairs, and the activity of the user's last entry on each
+    project, by project id. The three are loaded with light queries and
+    cached until the projects, locations or the user's entries change.
+    """
+    def build():
+        slug = utils.get_setting('TIMEPIECE_DEFAULT_LOCATION_SLUG')
+        locations = Location.objects.filter(slug=slug).values_list('pk',
+                flat=True) if slug else []
+        projects = Project.trackable.filter(users=user_id).values_list('pk',
+                'name')
+        # PostgreSQL sorts nulls first in descending order, so an active
+        # entry counts as the last one.
+        activities = Entry.no_join.filter(user=user_id).order_by(
+                'project__id', '-end_time').distinct('project__id') \
+                .values_list('project', 'activity')
+        return {
+            'location': locations[0] if locations else None,
+            'projects': list(projects),
+            'activities': dict(activities),
+        }
+    name = 'defaults:{0}'.format(cache.get_version(CLOCK_IN_REFERENCES))
+    return cache.get_or_set(CLOCK_IN_DEFAULTS.format(user_id), name, build)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=Attribute)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=ProjectRelationship)
+@receiver(post_delete, sender=ProjectRelationship)
+def invalidate_clock_in_references(sender, **kwargs):
+    """Projects, their users or locations changed."""
+    cache.bump_version(CLOCK_IN_REFERENCES)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def update_clock_in_defaults(sender, instance, signal, created=False,
+        **kwargs):
+    """
+    Records the activity of an active entry as the last one used on its
+    project. Saving another entry keeps the defaults only if it has the
+    activity already recorded for its project. Deleting an entry, or
+    moving it to another project, may change the last activity of a
+    project, so the defaults are rebuilt.
+    """
+    namespace = CLOCK_IN_DEFAULTS.format(instance.user_id)
+    version = cache.get_version(namespace)
+    name = 'defaults:{0}'.format(cache.get_version(CLOCK_IN_REFERENCES))
+    defaults = cache.get_value(namespace, name, version)
+    if defaults is None:
+        return
+    activities = defaults['activities']
+    original_project = getattr(instance, '_original', (None, None))[0]
+    if signal is post_delete or not created and \
+            instance.project_id != original_project:
+        cache.bump_version(namespace)
+    elif instance.end_time is None:
+        # Stored under the version it was read from, so that a concurrent
+        # bump is not overwritten.
+        activities[instance.project_id] = instance.activity_id
+        cache.set_value(namespace, name, defaults, version)
+    elif activities.get(instance.project_id) != instance.activity_id:
+        cache.bump_version(namespace)
+
+
+def get_activity_groups():
+    """
+    Returns the activities allowed by each activity group, by group id, as
+    a (frozenset of activity ids, tuple of activity names) pair. It is
+    built with one query and cached until an activity or group changes.
+    """
+    def build():
+        rows = ActivityGroup.activities.through.objects.values_list(
+                'activitygroup', 'activity', 'activity__name').order_by(
+                'activity__name')
+        groups = {}
+        for group_id, activity_id, name in rows:
+            ids, names = groups.setdefault(group_id, ([], []))
+            ids.append(activity_id)
+            names.append(name)
+        return dict((group_id, (frozenset(ids), tuple(names)))
+                for group_id, (ids, names) in groups.iteritems())
+    return cache.get_or_set(ACTIVITY_GROUPS, 'groups', build)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=ActivityGroup)
+@receiver(m2m_changed, sender=ActivityGroup.activities.through)
+def invalidate_activity_groups(sender, **kwargs):
+    """Activities or the groups they belong to changed."""
+    cache.bump_version(ACTIVITY_GROUPS)
+
+
+def get_presence_version():
+    """Returns a version which changes whenever get_presence() changes."""
+    return cache.get_version(PRESENCE)
+
+
+def get_presence(version=None):
+    """
+    Returns a dictionary with the active entry of each user who is clocked
+    in, by user id. It is built with one query over the active entries and
+    cached until an active entry is saved or closed.
+    """
+    def build():
+        rows = Entry.no_join.filter(end_time__isnull=True).values('id',
+                'user', 'user__first_name', 'user__last_name',
+                'project__name', 'activity__name', 'start_time',
+                'pause_time')
+        return dict((row['user'], {
+            'entry': row['id'],
+            'user': row['user'],
+            'first_name': row['user__first_name'],
+            'last_name': row['user__last_name'],
+            'project': row['project__name'],
+            'activity': row['activity__name'],
+            'start_time': row['start_time'],
+            'is_paused': row['pause_time'] is not None,
+        }) for row in rows)
+    return cache.get_or_set(PRESENCE, 'entries', build, version)
+
+
+# Whether the user has an active entry.
+User.clocked_in = property(lambda user: user.pk in get_presence())
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def update_presence(sender, instance, **kwargs):
+    """
+    An active entry was saved or deleted, or an entry was closed. Saving
+    other entries leaves the presence as it is.
+    """
+    if instance.end_time is None:
+        cache.bump_version(PRESENCE)
+        return
+    present = cache.get_value(PRESENCE, 'entries') or {}
+    if present.get(instance.user_id, {}).get('entry') == instance.pk:
+        cache.bump_version(PRESENCE)
+
+
+@receiver(post_save, sender=Entry)
+def lock_period(sender, instance, **kwargs):
+    """An entry was approved or invoiced, for example by an admin."""
+    if instance.status in TimesheetPeriod.LOCKED:
+        TimesheetPeriod.objects.advance([(instance.user_id,
+                instance.start_time)], instance.status)
+
+
+def update_billable(entries):
+    """
+    Sets the billable flag of the entries from their activities and project
+    types, with a bulk update for each value which changed.
+    """
+    is_billable = Q(activity__billable=True, project__type__billable=True)
+    entries.filter(is_billable, billable=False).update(billable=True)
+    entries.exclude(is_billable).filter(billable=True).update(billable=False)
+
+
+# The field of each model which the billable flag of entries depends on,
+# and the entry lookup of the model.
+BILLABLE_FIELDS = {
+    Activity: ('billable', 'activity'),
+    Attribute: ('billable', 'project__type'),
+    Project: ('type_id', 'project'),
+}
+
+
+@receiver(post_init, sender=Activity)
+@receiver(post_init, sender=Attribute)
+@receiver(post_init, sender=Project)
+def remember_billable(sender, instance, **kwargs):
+    instance._billable = getattr(instance, BILLABLE_FIELDS[sender][0])
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=Attribute)
+@receiver(post_save, sender=Project)
+def propagate_billable(sender, instance, created=False, **kwargs):
+    """
+    A billable flag or the type of a project changed. Other changes, such
+    as renaming a project, do not touch the entries.
+    """
+    field, lookup = BILLABLE_FIELDS[sender]
+    current = getattr(instance, field)
+    changed = current != getattr(instance, '_billable', current)
+    instance._billable = current
+    if not created and changed:
+        update_billable(Entry.no_join.filter(**{lookup: instance}))
@@ -0,0 +1,272 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.contrib.auth.models import User, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from timepiece import utils
+from timepiece.utils import cache
+
+from timepiece.crm.models import Project
+from timepiece.entries.models import Entry, ProjectHours, \
+        SCHEDULE_REFERENCES
+
+
+CENTS = Decimal('0.01')
+MAX_HOURS = Decimal('1000000')  # ProjectHours.hours has 6 integer digits.
+
+# Versions of the schedule count microseconds from this time.
+VERSION_EPOCH = datetime.datetime(1970, 1, 1)
+# How long before a version the changes view still looks for changes.
+CHANGES_OVERLAP = datetime.timedelta(seconds=30)
+
+
+def get_references_version():
+    """Returns the version of the schedule editor's reference lists."""
+    return cache.get_version(SCHEDULE_REFERENCES)
+
+
+def get_references(version=None):
+    """
+    Returns a dictionary with all projects and all users who can clock in,
+    as used for autocompletion by the schedule editor. The lists are cached
+    until a project, user, group or permission changes.
+    """
+    def build():
+        perm = Permission.objects.filter(
+            content_type=ContentType.objects.get_for_model(Entry),
+            codename='can_clock_in'
+        )
+        all_projects = Project.objects.values('id', 'name')
+        user_q = Q(groups__permissions=perm) | Q(user_permissions=perm)
+        user_q |= Q(is_superuser=True)
+        all_users = User.objects.filter(user_q) \
+            .values('id', 'first_name', 'last_name').distinct()
+        return {
+            'all_projects': list(all_projects),
+            'all_users': list(all_users),
+        }
+    return cache.get_or_set(SCHEDULE_REFERENCES, 'references', build,
+            version)
+
+
+def to_version(value):
+    """Returns the update time of project hours as an integer version."""
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    delta = value - VERSION_EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def from_version(version):
+    """Returns the update time marked by a version."""
+    value = VERSION_EPOCH + datetime.timedelta(microseconds=version)
+    if settings.USE_TZ:
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def get_changes(project_hours, since=0):
+    """
+    Returns the project hours values, without their date_updated, and the
+    version of the schedule they show, which is that of the latest update
+    among them, or since if none is later. The version is read along with
+    the rows, but date_updated is set by the app server which saved each
+    row, so clock skew between servers can still hide a change from a
+    client; CHANGES_OVERLAP only makes that less likely.
+    """
+    rows = list(project_hours)
+    for row in rows:
+        since = max(since, to_version(row.pop('date_updated')))
+    return rows, since
+
+
+def get_changed_hours(project_hours, version):
+    """
+    Narrows the project hours to those which were created or updated at or
+    after the time marked by the given version, less CHANGES_OVERLAP, so
+    that rows written by transactions which committed late are still
+    returned. Clients may thus receive some rows twice.
+    """
+    since = from_version(version) - CHANGES_OVERLAP
+    return project_hours.filter(date_updated__gte=since)
+
+
+def update_week(week_start, cells):
+    """
+    Applies a batch of (user, project, hours) cell changes to the schedule
+    for the week, creating, updating or deleting project hours as needed.
+    A cell with zero or empty hours removes the assignment.
+
+    Users and projects are validated against sets loaded with one query
+    each, and the changes are written with at most one query per distinct
+    number of hours. Returns a list with a result dictionary for each
+    cell, in the order given.
+    """
+    week_start = utils.get_week_start(week_start).date()
+    results = [{'user': c.get('user'), 'project': c.get('project')}
+            for c in cells]
+    user_ids = set(r['user'] for r in results)
+    project_ids = set(r['project'] for r in results)
+    valid_users = set(User.objects.filter(pk__in=_ids(user_ids))
+            .values_list('pk', flat=True))
+    valid_projects = set(Project.objects.filter(pk__in=_ids(project_ids))
+            .values_list('pk', flat=True))
+
+    changes = {}
+    for cell, result in zip(cells, results):
+        try:
+            user, project = int(result['user']), int(result['project'])
+        except (TypeError, ValueError):
+            user = project = None
+        if user not in valid_users or project not in valid_projects:
+            result.update(status='error', error='Unknown user or project')
+            continue
+        try:
+            hours = Decimal(str(cell.get('hours') or 0)).quantize(CENTS)
+            if not hours.is_finite() or not 0 <= hours < MAX_HOURS:
+                hours = None
+        except InvalidOperation:
+            hours = None
+        if hours is None:
+            result.update(status='error', error='Invalid number of hours')
+            continue
+        result.update(user=user, project=project, hours=hours)
+        # The last change to a cell wins.
+        changes[(user, project)] = result
+
+    existing = ProjectHours.objects.filter(week_start=week_start,
+            user__in=[k[0] for k in changes],
+            project__in=[k[1] for k in changes])
+    existing = dict(((ph.user_id, ph.project_id), ph) for ph in existing)
+
+    now = timezone.now()
+    created, updated, deleted = [], {}, []
+    for key, result in changes.items():
+        ph = existing.get(key)
+        hours = result.pop('hours')
+        if ph is None:
+            if hours:
+                created.append(ProjectHours(week_start=week_start,
+                        user_id=key[0], project_id=key[1], hours=hours))
+                result['status'] = 'created'
+            else:
+                result.update(status='unchanged', id=None)
+        elif not hours:
+            deleted.append(ph.pk)
+            result.update(status='deleted', id=None)
+        elif ph.hours != hours:
+            updated.setdefault(hours, []).append(ph.pk)
+            result.update(status='updated', id=ph.pk)
+        else:
+            result.update(status='unchanged', id=ph.pk)
+
+    if deleted:
+        ProjectHours.objects.filter(pk__in=deleted).delete()
+    for hours, pks in updated.items():
+        ProjectHours.objects.filter(pk__in=pks).update(hours=hours,
+                published=False, date_updated=now)
+    if created:
+        ProjectHours.objects.bulk_create(created)
+        # bulk_create does not set primary keys, so look them up.
+        new = ProjectHours.objects.filter(week_start=week_start,
+                user__in=[ph.user_id for ph in created],
+                project__in=[ph.project_id for ph in created])
+        new = dict(((ph.user_id, ph.project_id), ph.pk) for ph in new)
+        for ph in created:
+            changes[(ph.user_id, ph.project_id)]['id'] = \
+                    new[(ph.user_id, ph.project_id)]
+    return results
+
+
+def _ids(values):
+    """Returns the values which can be used as primary keys."""
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
+def copy_week(source_week, target_weeks, overwrite=True):
+    """
+    Copies the project hours of the source week onto each of the target
+    weeks with a single INSERT ... SELECT, as unpublished hours.
+
+    If overwrite is True, all existing hours in the target weeks are
+    replaced. Otherwise, cells which already exist in a target week are
+    kept and only the missing ones are copied. Returns the number of
+    project hours created. Should be run within a transaction.
+    """
+    source_week = utils.get_week_start(source_week).date()
+    target_weeks = sorted(set(utils.get_week_start(week).date()
+            for week in target_weeks) - set([source_week]))
+    if not target_weeks:
+        return 0
+    if overwrite:
+        ProjectHours.objects.filter(week_start__in=target_weeks).delete()
+
+    table = connection.ops.quote_name(ProjectHours._meta.db_table)
+    weeks = ' UNION ALL '.join(
+            ['SELECT CAST(%s AS date) AS week_start'] * len(target_weeks))
+    sql = """
+        INSERT INTO {table}
+            (week_start, project_id, user_id, hours, published, date_updated)
+        SELECT weeks.week_start, source.project_id, source.user_id,
+            source.hours, %s, %s
+        FROM {table} source, ({weeks}) weeks
+        WHERE source.week_start = %s AND NOT EXISTS (
+            SELECT 1 FROM {table} target
+            WHERE target.week_start = weeks.week_start
+            AND target.project_id = source.project_id
+            AND target.user_id = source.user_id)
+    """.format(table=table, weeks=weeks)
+    params = [False, timezone.now()] + target_weeks + [source_week]
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+    return cursor.rowcount
+
+
+def build_grid(project_hours):
+    """
+    Builds the project x user grid for a week from project hours values in
+    a single pass. Each value must have project, project__name, user,
+    user__first_name, user__last_name, hours and published keys, and
+    projects are listed in the order they are first seen.
+
+    Returns a (users, projects) tuple. users is a list of (id, first name,
+    last name) tuples ordered by name. projects is a list of (id, name, row)
+    tuples, where row holds a cell dictionary for each user in users; cells
+    without hours are empty.
+    """
+    users = {}
+    projects = []
+    cells = {}
+    for ph in project_hours:
+        user_id, project_id = ph['user'], ph['project']
+        if user_id not in users:
+            users[user_id] = (user_id, ph['user__first_name'],
+                    ph['user__last_name'])
+        if project_id not in cells:
+            cells[project_id] = {}
+            projects.append((project_id, ph['project__name']))
+        cell = cells[project_id].setdefault(user_id, {})
+        cell['hours'] = cell.get('hours', 0) + ph['hours']
+        cell['published'] = ph['published']
+
+    users = sorted(users.values(), key=lambda u: (u[1], u[2], u[0]))
+    columns = dict((user[0], index) for index, user in enumerate(users))
+    grid = []
+    for project_id, name in projects:
+        row = [{} for user in users]
+        for user_id, cell in cells[project_id].iteritems():
+            row[columns[user_id]] = cell
+        grid.append((project_id, name, row))
+    return users, grid
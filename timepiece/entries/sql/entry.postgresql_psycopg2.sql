@@ -0,0 +1,7 @@
+-- A user may have only one active entry. Entry.save() reports violations
+-- as ActiveEntryError.
+CREATE UNIQUE INDEX timepiece_entry_single_active ON timepiece_entry (user_id) WHERE end_time IS NULL;
+-- The closed entries of a user may not overlap, end points included.
+-- Entry.save() reports violations as ValidationError, and
+-- EntryQuerySet.overlapping() repeats these expressions to use the index.
+ALTER TABLE timepiece_entry ADD CONSTRAINT timepiece_entry_no_overlap EXCLUDE USING gist (int4range(user_id, user_id, '[]') WITH &&, tstzrange(start_time, end_time, '[]') WITH &&) WHERE (end_time IS NOT NULL);
@@ -1,5 +1,6 @@
 import datetime
 from dateutil.relativedelta import relativedelta
+import json
 from urllib import urlencode
 
 from django.contrib.auth.models import Permission
@@ -7,10 +8,12 @@ from django.core.urlresolvers import reverse
 from django.test import TestCase
 
 from timepiece import utils
+from timepiece.utils import cache
 from timepiece.tests.base import ViewTestMixin
 from timepiece.tests import factories
 
-from timepiece.entries.models import Entry, ProjectHours
+from timepiece.entries.models import Entry, ProjectHours, PRESENCE, \
+        get_presence_version
 from timepiece.entries.views import Dashboard
 
 
@@ -34,6 +37,8 @@ class DashboardViewTestCase(ViewTestMixin, TestCase):
         self.activity = factories.Activity()
         self.location = factories.Location()
         self.status = Entry.UNVERIFIED
+        # Entries from other tests are rolled back without signals.
+        cache.bump_version(PRESENCE)
 
     def _create_entry(self, start_time, end_time=None, user=None):
         """
@@ -132,7 +137,8 @@ class DashboardViewTestCase(ViewTestMixin, TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
         others_active_entries = response.context['others_active_entries']
-        self.assertFalse(active_entry in others_active_entries)
+        self.assertFalse(active_entry.pk in
+                [e['entry'] for e in others_active_entries])
         self.assertEqual(len(others_active_entries), entry_count)
 
     def test_no_other_active_entries(self):
@@ -141,6 +147,69 @@ class DashboardViewTestCase(ViewTestMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['others_active_entries']), 0)
 
+    def test_presence(self):
+        """Clocking in, pausing and clocking out update the presence."""
+        other = factories.User()
+        self.assertFalse(other.clocked_in)
+        entry = self._create_entry(datetime.datetime(2012, 11, 6, 12),
+                user=other)
+        self.assertTrue(other.clocked_in)
+        with self.assertNumQueries(0):
+            self.assertTrue(other.clocked_in)
+            self.assertFalse(self.user.clocked_in)
+
+        version = get_presence_version()
+        entry.toggle_paused()
+        entry.save()
+        self.assertNotEqual(get_presence_version(), version)
+        response = self.client.get(self.url)
+        others = response.context['others_active_entries']
+        self.assertEqual([e['entry'] for e in others], [entry.pk])
+        self.assertTrue(others[0]['is_paused'])
+
+        entry.unpause()
+        entry.end_time = entry.start_time + relativedelta(hours=1)
+        entry.save()
+        self.assertFalse(other.clocked_in)
+
+    def test_closed_entries_keep_presence(self):
+        """Saving closed entries does not invalidate the presence."""
+        self._create_others_entries()
+        version = get_presence_version()
+        self._create_entries()
+        self.assertEqual(get_presence_version(), version)
+
+    def test_online_users(self):
+        """The online users are returned with the current version."""
+        self._create_others_entries()
+        cache.bump_committed()  # As when the entries are committed.
+        response = self.client.get(reverse('online_users'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['version'], get_presence_version())
+        self.assertEqual(len(data['entries']), 5)
+
+    def test_online_users_unchanged(self):
+        """Requests for the current version only get the version back."""
+        version = get_presence_version()
+        url = reverse('online_users') + '?since={0}'.format(version)
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content), {'version': version})
+
+    def test_online_users_changed(self):
+        """Requests for an older version get the entries at once."""
+        version = get_presence_version()
+        url = reverse('online_users') + '?since={0}'.format(version)
+        user = factories.User()
+        self._create_entry(datetime.datetime(2012, 11, 6, 12), user=user)
+        data = json.loads(self.client.get(url).content)
+        self.assertNotEqual(data['version'], version)
+        self.assertEqual(data['entries'][0]['user'], user.pk)
+
+    def test_online_users_bad_version(self):
+        response = self.client.get(reverse('online_users') + '?since=x')
+        self.assertEqual(response.status_code, 400)
+
 
 class ProcessProgressTestCase(TestCase):
     """Tests for process_progress."""
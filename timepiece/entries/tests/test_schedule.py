@@ -12,8 +12,10 @@ from timepiece import utils
 from timepiece.tests import factories
 from timepiece.tests.base import ViewTestMixin
 
+from timepiece.entries import schedule
 from timepiece.entries.models import Entry, ProjectHours
 from timepiece.entries.views import ScheduleView
+from timepiece.utils import cache
 
 
 class ProjectHoursTestCase(ViewTestMixin, TestCase):
@@ -81,6 +83,29 @@ class ProjectHoursModelTestCase(ProjectHoursTestCase):
             ProjectHours.objects.all().delete()
 
 
+class BuildGridTestCase(TestCase):
+
+    def test_build_grid(self):
+        """Cells should be placed in the column of their user."""
+        def value(project, user, hours, published=True):
+            return {
+                'project': project, 'project__name': 'p%s' % project,
+                'user': user, 'user__first_name': 'u%s' % user,
+                'user__last_name': '', 'hours': hours,
+                'published': published,
+            }
+        users, projects = schedule.build_grid([
+            value(1, 3, 5), value(1, 2, 10, False), value(2, 3, 1),
+            value(2, 3, 2),
+        ])
+        self.assertEquals(users, [(2, 'u2', ''), (3, 'u3', '')])
+        self.assertEquals(projects, [
+            (1, 'p1', [{'hours': 10, 'published': False},
+                    {'hours': 5, 'published': True}]),
+            (2, 'p2', [{}, {'hours': 3, 'published': True}]),
+        ])
+
+
 class ProjectHoursListViewTestCase(ProjectHoursTestCase):
 
     def setUp(self):
@@ -329,7 +354,7 @@ class ProjectHoursEditTestCase(ProjectHoursTestCase):
         super_user = self.superuser
 
         self.login_user(self.manager)
-        response = self.client.get(self.ajax_url)
+        response = self.client.get(reverse('ajax_schedule_references'))
         self.assertEquals(response.status_code, 200)
         users = [u['id'] for u in json.loads(response.content)['all_users']]
         self.assertEquals(len(users), 3)
@@ -337,6 +362,144 @@ class ProjectHoursEditTestCase(ProjectHoursTestCase):
         self.assertTrue(perm_user.id in users)
         self.assertTrue(super_user.id in users)
 
+    def test_references_not_modified(self):
+        """References should not be resent while they are unchanged."""
+        self.login_user(self.manager)
+        cache.bump_committed()  # As when the setup is committed.
+        url = reverse('ajax_schedule_references')
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals(len(data['all_projects']), 2)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        factories.Project()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals(len(data['all_projects']), 3)
+
+    def test_changes(self):
+        """Only hours changed since the given version should be returned."""
+        self.login_user(self.manager)
+        self.create_project_hours()
+        response = self.client.get(self.ajax_url)
+        version = json.loads(response.content)['version']
+
+        ph = ProjectHours.objects.get(week_start=self.week_start,
+                user=self.user)
+        ph.date_updated = ph.date_updated + relativedelta(days=1)
+        ProjectHours.objects.filter(pk=ph.pk).update(
+                date_updated=ph.date_updated)
+        ProjectHours.objects.filter(week_start=self.week_start,
+                user=self.manager).delete()
+
+        response = self.client.get(reverse('ajax_schedule_changes'),
+                data={'since': version})
+        self.assertEquals(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEquals([p['id'] for p in data['project_hours']], [ph.pk])
+        self.assertEquals(data['ids'], [ph.pk])
+
+    def test_changes_version(self):
+        """
+        Versions come from the update times of the rows, and rows updated
+        shortly before a version are sent again.
+        """
+        self.login_user(self.manager)
+        self.create_project_hours()
+        response = self.client.get(self.ajax_url)
+        version = json.loads(response.content)['version']
+        week = ProjectHours.objects.filter(week_start=self.week_start)
+        latest = max(ph.date_updated for ph in week)
+        self.assertEquals(schedule.from_version(version), latest)
+
+        response = self.client.get(reverse('ajax_schedule_changes'),
+                data={'since': version})
+        data = json.loads(response.content)
+        self.assertEquals(len(data['project_hours']), 2)
+        self.assertEquals(data['version'], version)
+
+        week.update(date_updated=latest - relativedelta(minutes=1))
+        response = self.client.get(reverse('ajax_schedule_changes'),
+                data={'since': version})
+        self.assertEquals(json.loads(response.content)['project_hours'], [])
+
+    def test_login_keeps_references(self):
+        version = schedule.get_references_version()
+        self.login_user(self.manager)
+        self.assertEquals(schedule.get_references_version(), version)
+        self.manager.first_name = 'Renamed'
+        self.manager.save()
+        self.assertNotEquals(schedule.get_references_version(), version)
+
+    def test_bulk_update(self):
+        """Many cells can be created, updated and deleted at once."""
+        self.login_user(self.manager)
+        self.create_project_hours()
+        cells = [
+            {'user': self.user.pk, 'project': self.tracked_project.pk,
+                'hours': 30},
+            {'user': self.manager.pk, 'project': self.tracked_project.pk,
+                'hours': 0},
+            {'user': self.manager.pk, 'project': self.untracked_project.pk,
+                'hours': 10},
+            {'user': 0, 'project': self.tracked_project.pk, 'hours': 10},
+            {'user': self.user.pk, 'project': self.untracked_project.pk,
+                'hours': 'many'},
+        ]
+        response = self.client.post(reverse('ajax_schedule_bulk'), data={
+            'week_start': self.week_start.strftime('%Y-%m-%d'),
+            'cells': json.dumps(cells),
+        })
+        self.assertEquals(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        statuses = [r['status'] for r in results]
+        self.assertEquals(statuses,
+                ['updated', 'deleted', 'created', 'error', 'error'])
+
+        week = ProjectHours.objects.filter(week_start=self.week_start)
+        self.assertEquals(week.count(), 2)
+        updated = week.get(user=self.user)
+        self.assertEquals(updated.hours, Decimal('30'))
+        self.assertEquals(results[0]['id'], updated.pk)
+        created = week.get(user=self.manager)
+        self.assertEquals(created.hours, Decimal('10'))
+        self.assertEquals(results[2]['id'], created.pk)
+        # Other weeks are untouched.
+        self.assertEquals(ProjectHours.objects.filter(
+                week_start=self.next_week).count(), 2)
+
+    def test_bulk_update_not_a_number(self):
+        """Hours which are not finite numbers are reported as errors."""
+        self.login_user(self.manager)
+        cells = [{'user': self.user.pk, 'project': self.tracked_project.pk,
+                'hours': hours} for hours in ('NaN', float('nan'), 'Infinity')]
+        response = self.client.post(reverse('ajax_schedule_bulk'), data={
+            'week_start': self.week_start.strftime('%Y-%m-%d'),
+            'cells': json.dumps(cells),
+        })
+        self.assertEquals(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEquals([r['status'] for r in results], ['error'] * 3)
+
+    def test_bulk_update_bad_cells(self):
+        self.login_user(self.manager)
+        response = self.client.post(reverse('ajax_schedule_bulk'), data={
+            'week_start': self.week_start.strftime('%Y-%m-%d'),
+            'cells': 'user=1',
+        })
+        self.assertEquals(response.status_code, 400)
+
+    def test_changes_bad_version(self):
+        self.login_user(self.manager)
+        response = self.client.get(reverse('ajax_schedule_changes'),
+                data={'since': 'yesterday'})
+        self.assertEquals(response.status_code, 400)
+
     def test_default_ajax_call(self):
         """
         An ajax call without any parameters should return the current
@@ -563,7 +726,45 @@ class ProjectHoursEditTestCase(ProjectHoursTestCase):
         self.assertEquals(ProjectHours.objects.count(), 4)
         self.assertEquals(ProjectHours.objects.filter(
             published=False).count(), 4)
-        self.assertEquals(this_week_qs, next_week_qs)
+        self.assertEquals(sorted(this_week_qs), sorted(next_week_qs))
+
+    def test_duplicate_many_weeks(self):
+        """The previous week can be copied onto several weeks at once."""
+        self.login_user(self.manager)
+        self.create_project_hours()
+
+        response = self.client.post(self.ajax_url, data={
+            'week_update': self.next_week.strftime('%Y-%m-%d'),
+            'duplicate': 'duplicate',
+            'weeks': 3,
+        })
+        self.assertEquals(response.status_code, 302)
+
+        for i in range(1, 4):
+            week = self.week_start + relativedelta(weeks=i)
+            hours = ProjectHours.objects.filter(week_start=week)
+            self.assertEquals(sorted(hours.values_list('hours', flat=True)),
+                    [Decimal('5.0'), Decimal('25.0')])
+            self.assertFalse(hours.filter(published=True).exists())
+        self.assertEquals(ProjectHours.objects.count(), 8)
+
+    def test_duplicate_bad_weeks(self):
+        self.login_user(self.manager)
+        response = self.client.post(self.ajax_url, data={
+            'week_update': self.next_week.strftime('%Y-%m-%d'),
+            'duplicate': 'duplicate',
+            'weeks': 100,
+        })
+        self.assertEquals(response.status_code, 500)
+
+    def test_copy_week_keep_existing(self):
+        """Existing cells are kept when not overwriting."""
+        self.create_project_hours()
+        copied = schedule.copy_week(self.week_start, [self.next_week],
+                overwrite=False)
+        self.assertEquals(copied, 0)
+        self.assertEquals(ProjectHours.objects.get(week_start=self.next_week,
+                user=self.user).hours, Decimal('15.0'))
 
     def test_no_hours_to_copy(self):
         """
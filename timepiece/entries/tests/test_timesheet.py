@@ -1,22 +1,34 @@
 import datetime
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal
+import mock
+import pytz
 import random
 import urllib
 
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache as django_cache
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError
+from django.db.models.sql.compiler import SQLCompiler
 from django.utils import timezone
 from django.test import TestCase
 
 from timepiece import utils
-from timepiece.tests.base import ViewTestMixin, LogTimeMixin
+from timepiece.utils import cache
+from timepiece.tests.base import ViewTestMixin, LogTimeMixin, \
+        allow_overlapping_entries
 from timepiece.tests import factories
 
-from timepiece.crm.utils import grouped_totals
-from timepiece.entries.models import Activity, Entry, SimpleEntry
-from timepiece.entries.forms import ClockInForm
+from timepiece.crm.models import Project
+from timepiece.crm.utils import grouped_totals, simple_entry_summary, \
+        timesheet_summary
+from timepiece.entries.models import Activity, Entry, SimpleEntry, \
+        TimesheetPeriod, ACTIVITY_GROUPS, get_activity_groups, get_presence
+from timepiece.entries.forms import ClockInForm, ClockOutForm
+from timepiece.entries.views import save_entry_form
 
 
 class EditableTest(TestCase):
@@ -293,32 +305,20 @@ class ClockInTest(ViewTestMixin, TestCase):
 
     def testClockInManyActive(self):
         """
-        There should never be more than one active entry. If this happens,
-        a 500 error should be raised so that we are notified of the situation.
+        There should never be more than one active entry. The database
+        refuses to save a second one, which is reported as ActiveEntryError.
         """
-        self.login_user(self.user)
         entry1 = factories.Entry(**{
             'user': self.user,
             'start_time': self.ten_min_ago,
         })
-        entry2 = factories.Entry(**{
-            'user': self.user,
-            'start_time': self.now - relativedelta(minutes=20),
-        })
-        data = self.clock_in_form
-        data.update({
-            'start_time_0': self.now.strftime('%m/%d/%Y'),
-            'start_time_1': self.now.strftime('%H:%M:%S'),
-        })
-        try:
-            response = self.client.post(self.url, data)
-        except utils.ActiveEntryError as e:
-            self.assertEqual(str(e), "Only one active entry is allowed.")
-        else:
-            self.fail("Only one active entry should be allowed.")
-        self.assertEqual(Entry.objects.count(), 2)
+        with self.assertRaises(utils.ActiveEntryError):
+            factories.Entry(**{
+                'user': self.user,
+                'start_time': self.now - relativedelta(minutes=20),
+            })
+        self.assertEqual(Entry.objects.count(), 1)
         self.assertEqual(Entry.objects.get(pk=entry1.pk), entry1)
-        self.assertEqual(Entry.objects.get(pk=entry2.pk), entry2)
 
     def testClockInCurrentStatus(self):
         """Verify the status of the current entry shows what is expected"""
@@ -589,6 +589,8 @@ class AutoActivityTest(ViewTestMixin, LogTimeMixin, TestCase):
 
     def setUp(self):
         super(AutoActivityTest, self).setUp()
+        # Keep the local memory cache from culling the cached defaults.
+        django_cache.clear()
         self.user = factories.User()
         self.user2 = factories.User()
         self.superuser = factories.Superuser()
@@ -639,6 +641,45 @@ class AutoActivityTest(ViewTestMixin, LogTimeMixin, TestCase):
         form = ClockInForm(user=self.user, initial=initial)
         return form.initial['activity']
 
+    def test_defaults_cached(self):
+        """The form is built from the cached defaults without queries."""
+        self.log_time(project=self.project, activity=self.devl_activity)
+        self.get_activity()
+        with self.assertNumQueries(0):
+            form = ClockInForm(user=self.user,
+                    initial={'project': str(self.project.id)})
+            self.assertEqual(list(form.fields['project'].choices)[1:],
+                    [(self.project.pk, self.project.name)])
+        self.assertEqual(form.initial['activity'], self.devl_activity.id)
+
+    def test_defaults_updated(self):
+        """New active entries update the cached defaults in place."""
+        self.get_activity()
+        factories.Entry(user=self.user, project=self.project,
+                activity=self.sick_activity, location=self.location,
+                start_time=timezone.now() - relativedelta(hours=1))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_activity(), self.sick_activity.id)
+        factories.ProjectRelationship(user=self.user, project=self.project2)
+        form = ClockInForm(user=self.user)
+        self.assertEqual(len(form.fields['project'].choices), 3)
+
+    def test_defaults_entry_moved(self):
+        """Moving an entry to another project rebuilds the defaults."""
+        start = timezone.now() - relativedelta(hours=6)
+        for project in (self.project2, self.project):
+            start += relativedelta(hours=2)
+            entry = factories.Entry(user=self.user, project=project,
+                    activity=self.sick_activity, location=self.location,
+                    start_time=start, end_time=start + relativedelta(hours=1))
+        self.assertEqual(self.get_activity(), self.sick_activity.id)
+        entry = Entry.objects.get(pk=entry.pk)
+        entry.project = self.project2
+        entry.save()
+        self.assertEqual(self.get_activity(), None)
+        self.assertEqual(self.get_activity(self.project2),
+                self.sick_activity.id)
+
     def testNewWorker(self):
         """The worker has 0 entries on this project. Activity should = None"""
         self.login_user(self.user)
@@ -876,11 +917,13 @@ class ClockOutTest(ViewTestMixin, TestCase):
         # Create a form with times that overlap with entry1
         bad_start = entry1.start_time - relativedelta(hours=1)
         bad_end = entry1.end_time + relativedelta(hours=1)
-        bad_entry = factories.Entry(**{
-            'user': self.user,
-            'start_time': bad_start,
-            'end_time': bad_end,
-        })
+        # The database refuses to save such an entry.
+        with self.assertRaises(ValidationError):
+            factories.Entry(**{
+                'user': self.user,
+                'start_time': bad_start,
+                'end_time': bad_end,
+            })
         data = {
             'start_time_0': bad_start.strftime('%m/%d/%Y'),
             'start_time_1': bad_start.strftime('%H:%M:%S'),
@@ -895,6 +938,28 @@ class ClockOutTest(ViewTestMixin, TestCase):
         self.assertEquals(len(form.errors), 1, form.errors.keys)
         self.assertTrue('__all__' in form.errors, form.errors)
 
+    def testClockOutRace(self):
+        """
+        An entry saved after the clock out form was validated, for example
+        from another tab, is reported as a form error.
+        """
+        data = {
+            'start_time_0': self.entry.start_time.strftime('%m/%d/%Y'),
+            'start_time_1': self.entry.start_time.strftime('%H:%M:%S'),
+            'end_time_0': self.default_end_time.strftime('%m/%d/%Y'),
+            'end_time_1': self.default_end_time.strftime('%H:%M:%S'),
+            'location': self.location.pk,
+        }
+        form = ClockOutForm(data, instance=self.entry)
+        self.assertTrue(form.is_valid(), form.errors)
+        other = factories.Entry(user=self.user,
+                start_time=self.entry.start_time + relativedelta(hours=1),
+                end_time=self.entry.start_time + relativedelta(hours=2))
+        self.assertFalse(save_entry_form(form))
+        self.assertTrue(form.non_field_errors()[0].startswith(
+                'Start time overlaps with'))
+        self.assertEqual(Entry.no_join.get(pk=self.entry.pk).end_time, None)
+
     def test_clocking_out_inactive(self):
         # If clock out when not active, redirect to dashboard
         # (e.g. double-clicked clock out button or clicked it on an old page)
@@ -974,6 +1039,7 @@ class CheckOverlap(ViewTestMixin, LogTimeMixin, TestCase):
         self.location = factories.Location()
 
         self.login_user(self.user)
+        allow_overlapping_entries()
         self.now = timezone.now()
         #define start and end times to create valid entries
         self.start = self.now - relativedelta(days=0, hours=8)
@@ -2188,7 +2254,8 @@ class MonthlyRejectTestCase(ViewTestMixin, TestCase):
         """Entries that are approved invoiced should not be rejected"""
         self.login_user(self.superuser)
         self.create_entries(timezone.now(), Entry.APPROVED)
-        self.create_entries(timezone.now(), Entry.INVOICED)
+        self.create_entries(timezone.now() - relativedelta(hours=4),
+                Entry.INVOICED)
 
         response = self.client.post(self.url, data=self.data)
 
@@ -2313,3 +2380,527 @@ class CreateEditSimpleEntry(ViewTestMixin, TestCase):
             status_code=302, target_status_code=200)
         self.assertContains(response,
             'The simple entry has been updated successfully', count=1)
+
+
+class TimesheetSummaryTest(LogTimeMixin, TestCase):
+
+    def setUp(self):
+        super(TimesheetSummaryTest, self).setUp()
+        self.user = factories.User()
+        self.devl_activity = factories.BillableActivityFactory()
+        self.activity = factories.Activity(billable=False)
+        self.p1 = factories.BillableProject()
+        self.p2 = factories.NonbillableProject()
+        self.leave = factories.BillableProject()
+        self.from_date = utils.add_timezone(datetime.datetime(2011, 1, 1))
+        self.to_date = self.from_date + relativedelta(months=1)
+
+    def test_matches_separate_queries(self):
+        """The summary has the same figures as the individual queries."""
+        days = [datetime.datetime(2010, 12, 27), datetime.datetime(2011, 1, 3),
+                datetime.datetime(2011, 1, 4), datetime.datetime(2011, 1, 31),
+                datetime.datetime(2011, 2, 1)]
+        for day in days:
+            day = utils.add_timezone(day)
+            self.log_time(project=self.p1, start=day, delta=(1, 0))
+            self.log_time(project=self.p2, start=day + relativedelta(hours=2),
+                    delta=(2, 0), billable=False, status=Entry.INVOICED)
+            self.log_time(project=self.leave,
+                    start=day + relativedelta(hours=5), delta=(3, 0))
+        entries = Entry.objects.filter(user=self.user)
+        leave = {'sick': self.leave.pk}
+        with self.settings(TIMEPIECE_PAID_LEAVE_PROJECTS=leave):
+            with self.assertNumQueries(1):
+                totals = timesheet_summary(entries, self.from_date,
+                        self.to_date)
+            summary = Entry.summary(self.user, self.from_date, self.to_date)
+        self.assertEquals(totals['summary'], summary)
+        self.assertEquals(summary['paid_leave'], {'sick': Decimal('9.00')})
+        self.assertEquals(totals['project_entries'], [
+            {'project__name': self.leave.name, 'sum': Decimal('9.00')},
+            {'project__name': self.p2.name, 'sum': Decimal('6.00')},
+            {'project__name': self.p1.name, 'sum': Decimal('3.00')},
+        ])
+        first_week = utils.get_week_start(self.from_date)
+        expected = grouped_totals(entries.timespan(first_week,
+                to_date=self.to_date))
+        self.assertEquals(totals['grouped_totals'], list(expected))
+        self.assertEquals(len(totals['grouped_totals']), 3)
+
+    def test_entry_summary(self):
+        """Entry.summary computes all of its figures with one query."""
+        day = utils.add_timezone(datetime.datetime(2011, 1, 3))
+        self.log_time(project=self.p1, start=day, delta=(1, 0))
+        self.log_time(project=self.p2, start=day + relativedelta(hours=2),
+                delta=(2, 0), billable=False, status=Entry.INVOICED)
+        self.log_time(project=self.leave, start=day + relativedelta(hours=5),
+                delta=(3, 0))
+        leave = {'sick': self.leave.pk, 'vacation': self.p1.pk + 1000}
+        with self.settings(TIMEPIECE_PAID_LEAVE_PROJECTS=leave):
+            with self.assertNumQueries(1):
+                summary = Entry.summary(self.user, self.from_date,
+                        self.to_date)
+        self.assertEquals(summary, {
+            'billable': Decimal('1.00'), 'non_billable': Decimal('2.00'),
+            'invoiced': Decimal('2.00'), 'uninvoiced': Decimal('4.00'),
+            'total': Decimal('6.00'), 'total_worked': Decimal('3.00'),
+            'paid_leave': {'sick': Decimal('3.00'), 'vacation': None},
+        })
+
+    def test_first_week_in_previous_month(self):
+        """The first week starts with the month if it has no entries."""
+        from_date = utils.add_timezone(datetime.datetime(2011, 3, 1))
+        self.log_time(project=self.p1, delta=(1, 0), start=utils.add_timezone(
+                datetime.datetime(2011, 2, 28)))
+        self.log_time(project=self.p1, delta=(1, 0), start=utils.add_timezone(
+                datetime.datetime(2011, 3, 15)))
+        totals = timesheet_summary(Entry.objects.filter(user=self.user),
+                from_date, from_date + relativedelta(months=1))
+        self.assertEquals(len(totals['grouped_totals']), 1)
+
+    def test_no_entries(self):
+        totals = timesheet_summary(Entry.objects.filter(user=self.user),
+                self.from_date, self.to_date)
+        self.assertEquals(totals['grouped_totals'], '')
+        self.assertEquals(totals['project_entries'], [])
+        self.assertEquals(totals['summary']['total'], 0)
+
+    def test_simple_entry_summary(self):
+        day = datetime.date(2011, 1, 3)
+        self.log_simple_time(project=self.p1, date=day, delta=(1, 30))
+        self.log_simple_time(project=self.p1, date=day, delta=(2, 45),
+                status=SimpleEntry.VERIFIED)
+        entries = SimpleEntry.objects.filter(user=self.user)
+        summary = simple_entry_summary(entries.timespan(self.from_date,
+                span='month'))
+        self.assertEquals(summary['total'], SimpleEntry.summary(self.user,
+                self.from_date, self.to_date)['total'])
+        self.assertEquals(summary['statuses'], {
+            SimpleEntry.UNVERIFIED: 1,
+            SimpleEntry.VERIFIED: 1,
+            SimpleEntry.APPROVED: 0,
+        })
+
+
+class SimpleEntryRowsTest(ViewTestMixin, LogTimeMixin, TestCase):
+
+    def setUp(self):
+        super(SimpleEntryRowsTest, self).setUp()
+        self.user = factories.User()
+        self.user.user_permissions.add(
+                Permission.objects.get(codename='can_clock_in'))
+        self.login_user(self.user)
+        self.project = factories.BillableProject()
+        self.day = datetime.date(2011, 1, 3)
+
+    def test_rows(self):
+        """Rows are loaded with one query, and day totals with another."""
+        self.log_simple_time(project=self.project, date=self.day,
+                delta=(1, 30))
+        self.log_simple_time(project=self.project, date=self.day,
+                delta=(2, 15))
+        rows = SimpleEntry.objects.filter(user=self.user).order_by('pk') \
+                .rows(day_totals=True)
+        with self.assertNumQueries(2):
+            rows = rows[:]
+        self.assertEquals([row.get_total_seconds() for row in rows],
+                [5400, 8100])
+        self.assertEquals(rows[0].day_seconds, 13500)
+        self.assertEquals(rows[0].project_name, self.project.name)
+        self.assertEquals(rows[0].business_name, self.project.business.name)
+        self.assertEquals(rows[0].user_name, u'{0} {1}'.format(
+                self.user.first_name, self.user.last_name))
+
+    def test_sequence(self):
+        """Rows can be counted, tested and indexed from the end."""
+        rows = SimpleEntry.objects.filter(user=self.user).rows()
+        self.assertFalse(rows)
+        self.assertEquals(len(rows), 0)
+        self.assertRaises(IndexError, lambda: rows[0])
+        for delta in [(1, 0), (2, 0), (3, 0)]:
+            self.log_simple_time(project=self.project, date=self.day,
+                    delta=delta)
+        rows = SimpleEntry.objects.filter(user=self.user).order_by('pk') \
+                .rows()
+        self.assertTrue(rows)
+        self.assertEquals(len(rows), 3)
+        self.assertEquals(rows[-1].get_total_seconds(), 10800)
+        self.assertEquals([row.get_total_seconds() for row in rows[-2:]],
+                [7200, 10800])
+        self.assertEquals([row.get_total_seconds() for row in rows[:-2]],
+                [3600])
+        self.assertRaises(IndexError, lambda: rows[-4])
+
+    def test_timesheet_paginated(self):
+        """Only a page of simple entries is listed on the time sheet."""
+        for i in range(101):
+            self.log_simple_time(project=self.project, date=self.day)
+        url_args = (self.user.pk,)
+        data = {'year': 2011, 'month': 1}
+        response = self._get('view_user_timesheet', url_args, get_kwargs=data)
+        self.assertContains(response, 'icon-pencil', count=100)
+        data['page'] = 2
+        response = self._get('view_user_timesheet', url_args, get_kwargs=data)
+        self.assertContains(response, 'icon-pencil', count=1)
+
+
+class EntryManagerTest(TestCase):
+
+    def test_querysets_not_compiled(self):
+        """The managers do not compile SQL to set up their querysets."""
+        with mock.patch.object(SQLCompiler, 'as_sql') as as_sql:
+            Entry.objects.all()
+            SimpleEntry.objects.all()
+        self.assertFalse(as_sql.called)
+
+    def test_billable_with_select_related(self):
+        """The billable column still works after select_related()."""
+        start = timezone.now() - relativedelta(hours=2)
+        entry = factories.Entry(activity__billable=False, start_time=start,
+                end_time=start + relativedelta(hours=1))
+        entries = Entry.objects.select_related('user')
+        self.assertEquals(list(entries.values_list('pk', 'billable')),
+                [(entry.pk, False)])
+        self.assertEquals(entries.filter(activity__billable=False).count(), 1)
+
+
+class EntryBillableTest(TestCase):
+
+    def setUp(self):
+        self.activity = factories.Activity(billable=True)
+        self.project = factories.BillableProject()
+        start = timezone.now() - relativedelta(hours=2)
+        self.entry = factories.Entry(activity=self.activity,
+                project=self.project, start_time=start,
+                end_time=start + relativedelta(hours=1))
+
+    def assertBillable(self, billable):
+        self.assertEquals(Entry.no_join.get(pk=self.entry.pk).billable,
+                billable)
+
+    def test_set_on_save(self):
+        self.assertBillable(True)
+        self.entry.activity = factories.Activity(billable=False)
+        self.entry.save()
+        self.assertBillable(False)
+
+    def test_activity_changed(self):
+        self.activity.billable = False
+        self.activity.save()
+        self.assertBillable(False)
+        self.activity.billable = True
+        self.activity.save()
+        self.assertBillable(True)
+
+    def test_project_type_changed(self):
+        self.project.type.billable = False
+        self.project.type.save()
+        self.assertBillable(False)
+
+    def test_project_changed(self):
+        self.project.type = factories.TypeAttribute(billable=False)
+        self.project.save()
+        self.assertBillable(False)
+
+    def test_unchanged(self):
+        """Saves which keep the flags and project type do not update."""
+        project = Project.objects.get(pk=self.project.pk)
+        project.name = 'Renamed'
+        activity = Activity.objects.get(pk=self.activity.pk)
+        with mock.patch('timepiece.entries.models.update_billable') as \
+                update:
+            project.save()
+            activity.save()
+        self.assertFalse(update.called)
+
+
+class EntryWorkDateTest(TestCase):
+
+    def setUp(self):
+        self.tz = pytz.timezone('America/New_York')
+        self.user = factories.User()
+
+    def make_entry(self, end):
+        end = self.tz.localize(end)
+        return factories.Entry(user=self.user, end_time=end,
+                start_time=end - relativedelta(hours=1))
+
+    def test_local_date(self):
+        """The work date is the date of the end time in the local zone."""
+        with timezone.override(self.tz):
+            entry = self.make_entry(datetime.datetime(2013, 1, 3, 23, 30))
+        self.assertEquals(entry.work_date, datetime.date(2013, 1, 3))
+
+    def test_timespan_and_date_trunc(self):
+        with timezone.override(self.tz):
+            self.make_entry(datetime.datetime(2013, 1, 2, 23, 30))
+            self.make_entry(datetime.datetime(2013, 1, 3, 23, 30))
+            day = self.tz.localize(datetime.datetime(2013, 1, 3))
+            entries = Entry.objects.timespan(day, span='day')
+            self.assertEquals(entries.count(), 1)
+            rows = list(Entry.objects.date_trunc('day'))
+        self.assertEquals([row['date'] for row in rows],
+                [datetime.date(2013, 1, 2), datetime.date(2013, 1, 3)])
+
+    def test_timespan_within_day(self):
+        """Times other than midnight are still compared to the end time."""
+        with timezone.override(self.tz):
+            self.make_entry(datetime.datetime(2013, 1, 3, 10))
+            self.make_entry(datetime.datetime(2013, 1, 3, 14))
+            noon = self.tz.localize(datetime.datetime(2013, 1, 3, 12))
+            self.assertEquals(Entry.objects.timespan(noon, span='day')
+                    .count(), 1)
+
+
+class TimesheetPeriodTest(ViewTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = factories.User()
+        self.month = datetime.date(2013, 1, 1)
+        self.start = utils.add_timezone(datetime.datetime(2013, 1, 15, 9))
+
+    def get_state(self):
+        return TimesheetPeriod.objects.get(user=self.user,
+                month=self.month).state
+
+    def change_url(self, action):
+        url = reverse('change_user_timesheet', args=(self.user.pk, action))
+        return url + '?' + urllib.urlencode({'from_date': '2013-01-01'})
+
+    def test_advance(self):
+        """Periods are created and moved forward, but never back."""
+        periods = [(self.user.pk, self.start)]
+        TimesheetPeriod.objects.advance(periods, TimesheetPeriod.VERIFIED)
+        self.assertEqual(self.get_state(), TimesheetPeriod.VERIFIED)
+        TimesheetPeriod.objects.advance(periods, TimesheetPeriod.APPROVED)
+        self.assertEqual(self.get_state(), TimesheetPeriod.APPROVED)
+        TimesheetPeriod.objects.advance(periods, TimesheetPeriod.VERIFIED)
+        self.assertEqual(self.get_state(), TimesheetPeriod.APPROVED)
+        self.assertEqual(TimesheetPeriod.objects.count(), 1)
+
+    def test_advance_concurrent_insert(self):
+        """Advancing again after another transaction created a period."""
+        bulk_create = TimesheetPeriod.objects.bulk_create
+        errors = [IntegrityError('duplicate key value')]
+        def conflict_once(periods):
+            if errors:
+                raise errors.pop()
+            return bulk_create(periods)
+        with mock.patch.object(TimesheetPeriod.objects, 'bulk_create',
+                side_effect=conflict_once) as create:
+            TimesheetPeriod.objects.advance([(self.user.pk, self.start)],
+                    TimesheetPeriod.APPROVED)
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(self.get_state(), TimesheetPeriod.APPROVED)
+
+    def test_entry_periods(self):
+        """Entries give their distinct periods by local month."""
+        other = factories.User()
+        for user, day in [(self.user, 3), (self.user, 20), (other, 3)]:
+            start = datetime.datetime(2013, 1, day, 9)
+            factories.Entry(user=user, start_time=start,
+                    end_time=start + relativedelta(hours=1))
+        periods = TimesheetPeriod.objects.entry_periods(Entry.no_join.all())
+        self.assertEqual(sorted((user_id, month.date())
+                for user_id, month in periods),
+                sorted([(self.user.pk, self.month), (other.pk, self.month)]))
+
+    def test_is_locked(self):
+        TimesheetPeriod.objects.create(user=self.user, month=self.month,
+                state=TimesheetPeriod.VERIFIED)
+        with self.assertNumQueries(1):
+            self.assertFalse(TimesheetPeriod.objects.is_locked(self.user.pk,
+                    self.start))
+        TimesheetPeriod.objects.advance([(self.user.pk, self.month)],
+                TimesheetPeriod.APPROVED)
+        self.assertTrue(TimesheetPeriod.objects.is_locked(self.user.pk,
+                self.start))
+        self.assertFalse(TimesheetPeriod.objects.is_locked(self.user.pk,
+                self.start + relativedelta(months=1)))
+
+    def test_approved_entry_locks_period(self):
+        factories.Entry(user=self.user, start_time=self.start,
+                end_time=self.start + relativedelta(hours=1),
+                status=Entry.APPROVED)
+        self.assertEqual(self.get_state(), TimesheetPeriod.APPROVED)
+        entry = Entry(user=self.user, start_time=self.start +
+                relativedelta(hours=2), end_time=self.start +
+                relativedelta(hours=3))
+        self.assertRaises(ValidationError, entry.clean)
+
+    def test_verify_and_approve(self):
+        """The timesheet flows move the period forward."""
+        self.login_user(factories.Superuser())
+        factories.SimpleEntry(user=self.user, date=self.start.date(),
+                hours=2, minutes=0)
+        self.client.post(self.change_url('verify'), {'do_action': 'Yes'})
+        self.assertEqual(self.get_state(), TimesheetPeriod.VERIFIED)
+        self.client.post(self.change_url('approve'), {'do_action': 'Yes'})
+        self.assertEqual(self.get_state(), TimesheetPeriod.APPROVED)
+
+        simple_entry = SimpleEntry(user=self.user, project=factories.Project(),
+                date=self.start.date(), hours=1, minutes=0)
+        self.assertRaises(ValidationError, simple_entry.clean)
+
+    def test_reject_reopens(self):
+        self.login_user(factories.Superuser())
+        TimesheetPeriod.objects.create(user=self.user, month=self.month,
+                state=TimesheetPeriod.VERIFIED)
+        # The form offers the years which have simple entries.
+        factories.SimpleEntry(user=self.user, date=self.start.date())
+        url = reverse('reject_user_timesheet', args=(self.user.pk,))
+        self.client.post(url, {'month': 1, 'year': 2013, 'yes': 'Yes'})
+        self.assertEqual(self.get_state(), TimesheetPeriod.OPEN)
+
+
+class EntryOverlapTest(TestCase):
+
+    def setUp(self):
+        self.user = factories.User()
+        self.start = datetime.datetime(2013, 1, 3, 9)
+        self.end = self.start + relativedelta(hours=2)
+        self.entry = factories.Entry(user=self.user, start_time=self.start,
+                end_time=self.end)
+
+    def make_entry(self, start, end, **kwargs):
+        return factories.Entry(user=kwargs.pop('user', self.user),
+                start_time=self.start + start, end_time=self.end + end,
+                **kwargs)
+
+    def test_overlap_refused(self):
+        """The database refuses overlapping entries, end points included."""
+        for start, end in [(relativedelta(hours=1), relativedelta(hours=1)),
+                (relativedelta(hours=-3), relativedelta(hours=-2))]:
+            with self.assertRaises(ValidationError) as cm:
+                self.make_entry(start, end)
+            self.assertTrue(cm.exception.messages[0].startswith(
+                    'Start time overlaps with'))
+        self.assertEqual(Entry.no_join.count(), 1)
+
+    def test_no_overlap(self):
+        self.make_entry(relativedelta(hours=2, seconds=1),
+                relativedelta(hours=3))
+        self.make_entry(relativedelta(), relativedelta(),
+                user=factories.User())
+        # Active entries are checked by clean() only.
+        factories.Entry(user=self.user,
+                start_time=self.start + relativedelta(hours=1))
+        self.assertEqual(Entry.no_join.count(), 4)
+
+    def test_overlap_error(self):
+        """Conflicts are found with one query."""
+        entry = Entry(user=self.user)
+        with self.assertNumQueries(1):
+            error = entry.get_overlap_error(self.end,
+                    self.end + relativedelta(hours=1))
+        self.assertEqual(error, 'Start time overlaps with {0} on {1} from '
+                '09:00:00 to 11:00:00.'.format(self.entry.activity,
+                self.entry.project))
+        self.assertEqual(self.entry.get_overlap_error(self.start, self.end),
+                None)
+        self.assertEqual(entry.get_overlap_error(self.end + relativedelta(
+                seconds=1), self.end + relativedelta(hours=1)), None)
+
+
+class ActivityGroupCacheTest(TestCase):
+
+    def setUp(self):
+        cache.bump_version(ACTIVITY_GROUPS)
+        self.group = factories.ActivityGroup()
+        self.activity = factories.Activity(name='b')
+        self.other = factories.Activity(name='a')
+        self.group.activities.add(self.activity)
+        self.project = factories.Project(activity_group=self.group)
+
+    def test_groups(self):
+        """The allowed activities are loaded once."""
+        get_activity_groups()
+        with self.assertNumQueries(0):
+            groups = get_activity_groups()
+        self.assertEqual(groups, {self.group.pk: (
+                frozenset([self.activity.pk]), ('b',))})
+
+    def test_m2m_changed(self):
+        self.other.activity_group.add(self.group)
+        self.assertEqual(get_activity_groups()[self.group.pk], (
+                frozenset([self.activity.pk, self.other.pk]), ('a', 'b')))
+        self.group.activities.remove(self.activity)
+        self.assertEqual(get_activity_groups()[self.group.pk], (
+                frozenset([self.other.pk]), ('a',)))
+        self.group.activities.clear()
+        self.assertFalse(get_activity_groups())
+
+    def test_activity_renamed(self):
+        get_activity_groups()
+        self.activity.name = 'c'
+        self.activity.save()
+        self.assertEqual(get_activity_groups()[self.group.pk][1], ('c',))
+
+    def test_clean(self):
+        """Entry.clean() checks the activity without further queries."""
+        entry = Entry(user=factories.User(), project=self.project,
+                activity=self.other, start_time=timezone.now())
+        get_activity_groups()
+        # The query looks for overlapping entries.
+        with self.assertNumQueries(1):
+            with self.assertRaises(ValidationError) as cm:
+                entry.clean()
+        self.assertEqual(cm.exception.messages, ['a is not allowed for this '
+                'project. Please choose b'])
+        self.group.activities.add(self.other)
+        entry.clean()
+
+
+class BulkPauseCloseTest(TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2013, 1, 7, 9)
+        self.user = factories.User()
+        self.entry = factories.Entry(user=self.user, start_time=self.start,
+                seconds_paused=600)
+        self.closed = factories.Entry(start_time=self.start - relativedelta(
+                hours=2), end_time=self.start - relativedelta(hours=1))
+
+    def at(self, **kwargs):
+        return self.start + relativedelta(**kwargs)
+
+    def get_entry(self):
+        return Entry.no_join.get(pk=self.entry.pk)
+
+    def test_pause(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Entry.objects.pause(self.at(hours=2)), 1)
+        entry = self.get_entry()
+        self.assertEqual(entry.pause_time, self.at(hours=2))
+        self.assertEqual(entry.hours, Decimal('1.83'))
+        # Paused entries keep their pause time.
+        self.assertEqual(Entry.objects.pause(self.at(hours=3)), 0)
+
+    def test_pause_all(self):
+        self.entry.pause_all()
+        self.assertTrue(self.get_entry().is_paused)
+
+    def test_close(self):
+        Entry.objects.pause(self.at(hours=2))
+        with self.assertNumQueries(1):
+            self.assertEqual(Entry.objects.close(self.at(hours=3)), 1)
+        entry = self.get_entry()
+        self.assertEqual(entry.end_time, self.at(hours=3))
+        self.assertEqual(entry.pause_time, None)
+        self.assertEqual(entry.seconds_paused, 600 + 3600)
+        self.assertEqual(entry.hours, Decimal('1.83'))
+        self.assertEqual(entry.work_date, datetime.date(2013, 1, 7))
+        self.assertEqual(Entry.no_join.get(pk=self.closed.pk).end_time,
+                self.closed.end_time)
+
+    def test_close_before_start(self):
+        self.assertEqual(Entry.objects.close(self.start), 0)
+        self.assertEqual(self.get_entry().end_time, None)
+
+    def test_presence(self):
+        """Bulk updates send no signals, so the presence is updated."""
+        self.assertFalse(get_presence()[self.user.pk]['is_paused'])
+        Entry.objects.pause(self.at(hours=1))
+        self.assertTrue(get_presence()[self.user.pk]['is_paused'])
+        Entry.objects.close(self.at(hours=1))
+        self.assertFalse(self.user.pk in get_presence())
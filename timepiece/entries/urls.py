@@ -18,6 +18,9 @@ urlpatterns = patterns('',
     url(r'^entry/toggle_pause/$',
         views.toggle_pause,
         name='toggle_pause'),
+    url(r'^entry/online_users/$',
+        views.online_users,
+        name='online_users'),
 
     # Entries
     url(r'^entry/add/$',
@@ -43,6 +46,15 @@ urlpatterns = patterns('',
     url(r'^schedule/ajax/$',
         views.ScheduleAjaxView.as_view(),
         name='ajax_schedule'),
+    url(r'^schedule/ajax/references/$',
+        views.ScheduleReferencesView.as_view(),
+        name='ajax_schedule_references'),
+    url(r'^schedule/ajax/bulk/$',
+        views.ScheduleBulkView.as_view(),
+        name='ajax_schedule_bulk'),
+    url(r'^schedule/ajax/changes/$',
+        views.ScheduleChangesView.as_view(),
+        name='ajax_schedule_changes'),
     url(r'^schedule/ajax/(?P<assignment_id>\d+)/$',
         views.ScheduleDetailView.as_view(),
         name='ajax_schedule_detail'),
@@ -1,22 +1,21 @@
-from copy import deepcopy
 import datetime
 from dateutil.relativedelta import relativedelta
 from decimal import Decimal
-from itertools import groupby
 import json
 import urllib
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
-from django.contrib.auth.models import User, Permission
-from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import User
 from django.core import exceptions
 from django.core.urlresolvers import reverse
-from django.db import transaction
-from django.db.models import Q
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import redirect, render
+from django.utils import timezone
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView, View
 from django import forms
 
@@ -25,14 +24,28 @@ from timepiece.forms import DATE_FORM_FORMAT
 from timepiece.utils.csv import DecimalEncoder
 
 from timepiece.crm.models import Project, UserProfile, Business
+from timepiece.entries import schedule
 from timepiece.entries.forms import ClockInForm, ClockOutForm, \
         AddUpdateEntryForm, ProjectHoursForm, ProjectHoursSearchForm, \
         AddUpdateSimpleEntryForm, BusinessSelectionForm, \
         SimpleDateForm, make_simple_entries_formset
-from timepiece.entries.models import Entry, ProjectHours, SimpleEntry
+from timepiece.entries.models import Entry, ProjectHours, SimpleEntry, \
+        get_presence, get_presence_version
 from timepiece.templatetags.timepiece_tags import humanize_hours
 
 
+# The most weeks that the previous week's schedule can be copied onto.
+MAX_COPY_WEEKS = 53
+
+def get_others_present(user, version=None):
+    """Returns the active entries of the other users, ordered by name."""
+    present = get_presence(version)
+    present = [row for user_id, row in present.iteritems()
+            if user_id != user.pk]
+    return sorted(present, key=lambda row: (row['first_name'],
+            row['last_name'], row['user']))
+
+
 class Dashboard(TemplateView):
     template_name = 'timepiece/dashboard.html'
 
@@ -83,7 +96,7 @@ class Dashboard(TemplateView):
         
         week_simple_entries = SimpleEntry.objects.filter(user=self.user) \
                 .timespan(week_start, span='week') \
-                .select_related('project')
+                .order_by('date', 'pk').rows(day_totals=True)
 
 
         assignments = ProjectHours.objects.filter(user=self.user,
@@ -95,9 +108,9 @@ class Dashboard(TemplateView):
         total_worked = sum([p['worked'] for p in project_progress])
 
         # Others' active entries.
-        others_active_entries = Entry.objects.filter(end_time__isnull=True) \
-                .exclude(user=self.user).select_related('user', 'project',
-                'activity')
+        presence_version = get_presence_version()
+        others_active_entries = get_others_present(self.user,
+                presence_version)
 
         summary = SimpleEntry.summary(self.user, week_start, week_end+datetime.timedelta(days=1))
 
@@ -113,6 +126,7 @@ class Dashboard(TemplateView):
             'week_entries': week_entries,
             'week_simple_entries': week_simple_entries,
             'others_active_entries': others_active_entries,
+            'presence_version': presence_version,
             'next_date_link': reverse('dashboard')+'?week_start='+str(next_date.date()),
             'prev_date_link': reverse('dashboard')+'?week_start='+str(prev_date.date()),
             'date_form': date_form,
@@ -155,6 +169,21 @@ class Dashboard(TemplateView):
         return project_progress
 
 
+def save_entry_form(form):
+    """
+    Saves a valid entry form. Returns False, with the error added to the
+    form, if the database refuses the entry because another one was saved
+    since the form was validated, for example from another tab.
+    """
+    try:
+        form.save()
+    except exceptions.ValidationError as e:
+        form._errors[forms.forms.NON_FIELD_ERRORS] = form.error_class(
+                e.messages)
+        return False
+    return True
+
+
 @permission_required('entries.can_clock_in')
 @transaction.commit_on_success
 def clock_in(request):
@@ -167,8 +196,8 @@ def clock_in(request):
     initial = dict([(k, v) for k, v in request.GET.items()])
     data = request.POST or None
     form = ClockInForm(data, initial=initial, user=user, active=active_entry)
-    if form.is_valid():
-        entry = form.save()
+    if form.is_valid() and save_entry_form(form):
+        entry = form.instance
         message = 'You have clocked into {0} on {1}.'.format(
                 entry.activity.name, entry.project)
         messages.info(request, message)
@@ -189,8 +218,8 @@ def clock_out(request):
         return HttpResponseRedirect(reverse('dashboard'))
     if request.POST:
         form = ClockOutForm(request.POST, instance=entry)
-        if form.is_valid():
-            entry = form.save()
+        if form.is_valid() and save_entry_form(form):
+            entry = form.instance
             message = 'You have clocked out of {0} on {1}.'.format(
                     entry.activity.name, entry.project)
             messages.info(request, message)
@@ -227,6 +256,37 @@ def toggle_pause(request):
     return HttpResponseRedirect(reverse('dashboard'))
 
 
+@login_required
+def online_users(request):
+    """
+    Returns the active entries of the other users as JSON, with the version
+    to pass as the 'since' parameter of the next request.
+
+    If since is the current version, only the version is returned, so that
+    clients can poll often while nobody clocks in, clocks out or pauses.
+    Answering such a request only reads the cached version.
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return HttpResponse('Parameter since must be a version returned by '
+                'a previous request', status=400)
+    version = get_presence_version()
+    if version == since:
+        return HttpResponse(json.dumps({'version': version}),
+                mimetype='application/json')
+
+    entries = []
+    for row in get_others_present(request.user, version):
+        row = dict(row, start_time=row['start_time'].isoformat())
+        entries.append(row)
+    data = {
+        'entries': entries,
+        'version': version,
+    }
+    return HttpResponse(json.dumps(data), mimetype='application/json')
+
+
 @permission_required('entries.change_entry')
 def create_edit_entry(request, entry_id=None):
     if entry_id:
@@ -244,8 +304,8 @@ def create_edit_entry(request, entry_id=None):
     if request.method == 'POST':
         form = AddUpdateEntryForm(data=request.POST, instance=entry,
                 user=entry_user)
-        if form.is_valid():
-            entry = form.save()
+        if form.is_valid() and save_entry_form(form):
+            entry = form.instance
             if entry_id:
                 message = 'The entry has been updated successfully.'
             else:
@@ -372,16 +432,6 @@ class ScheduleView(ScheduleMixin, TemplateView):
 
         return super(ScheduleView, self).dispatch(request, *args, **kwargs)
 
-    def get_users_from_project_hours(self, project_hours):
-        """
-        Gets a list of the distinct users included in the project hours
-        entries, ordered by name.
-        """
-        name = ('user__first_name', 'user__last_name')
-        users = project_hours.values_list('user__id', *name).distinct()\
-                             .order_by(*name)
-        return users
-
     def get_context_data(self, **kwargs):
         context = super(ScheduleView, self).get_context_data(**kwargs)
 
@@ -389,29 +439,14 @@ class ScheduleView(ScheduleMixin, TemplateView):
         form = ProjectHoursSearchForm(initial=initial)
 
         project_hours = self.get_hours_for_week()
-        project_hours = project_hours.values('project__id', 'project__name',
-                'user__id', 'user__first_name', 'user__last_name', 'hours',
+        project_hours = project_hours.values('project', 'project__name',
+                'user', 'user__first_name', 'user__last_name', 'hours',
                 'published')
         project_hours = project_hours.order_by('-project__type__billable',
                 'project__name')
         if not self.request.user.has_perm('entries.add_projecthours'):
             project_hours = project_hours.filter(published=True)
-        users = self.get_users_from_project_hours(project_hours)
-        id_list = [user[0] for user in users]
-        projects = []
-
-        func = lambda o: o['project__id']
-        for project, entries in groupby(project_hours, func):
-            entries = list(entries)
-            proj_id = entries[0]['project__id']
-            name = entries[0]['project__name']
-            row = [{} for i in range(len(id_list))]
-            for entry in entries:
-                index = id_list.index(entry['user__id'])
-                hours = entry['hours']
-                row[index]['hours'] = row[index].get('hours', 0) + hours
-                row[index]['published'] = entry['published']
-            projects.append((proj_id, name, row))
+        users, projects = schedule.build_grid(project_hours)
 
         context.update({
             'form': form,
@@ -445,7 +480,9 @@ class EditScheduleView(ScheduleMixin, TemplateView):
         context.update({
             'form': form,
             'week': self.week_start,
-            'ajax_url': reverse('ajax_schedule')
+            'ajax_url': reverse('ajax_schedule'),
+            'references_url': reverse('ajax_schedule_references'),
+            'changes_url': reverse('ajax_schedule_changes'),
         })
         return context
 
@@ -453,7 +490,7 @@ class EditScheduleView(ScheduleMixin, TemplateView):
         ph = self.get_hours_for_week(self.week_start).filter(published=False)
 
         if ph.exists():
-            ph.update(published=True)
+            ph.update(published=True, date_updated=timezone.now())
             msg = 'Unpublished project hours are now published'
         else:
             msg = 'There were no hours to publish'
@@ -500,62 +537,45 @@ class ScheduleAjaxView(ScheduleMixin, View):
         pairs:
             project_hours: the current project hours for the week
             projects: the projects that have hours for the week
-            all_projects: all of the projects; used for autocomplete
-            all_users: all users that can clock in; used for completion
+            version: pass as 'since' to the changes view to fetch updates
+            references_version: the version of the lists of all projects and
+                users, which are served by the references view
         """
-        perm = Permission.objects.filter(
-            content_type=ContentType.objects.get_for_model(Entry),
-            codename='can_clock_in'
-        )
-        project_hours = self.get_hours_for_week().values(
-            'id', 'user', 'user__first_name', 'user__last_name',
-            'project', 'hours', 'published'
-        ).order_by('-project__type__billable', 'project__name',
-            'user__first_name', 'user__last_name')
-        inner_qs = project_hours.values_list('project', flat=True)
-        projects = Project.objects.filter(pk__in=inner_qs).values() \
-            .order_by('name')
-        all_projects = Project.objects.values('id', 'name')
-        user_q = Q(groups__permissions=perm) | Q(user_permissions=perm)
-        user_q |= Q(is_superuser=True)
-        all_users = User.objects.filter(user_q) \
-            .values('id', 'first_name', 'last_name')
+        project_hours, version = schedule.get_changes(
+                self.get_project_hours())
+        users, grid = schedule.build_grid(project_hours)
+        projects = [{'id': project_id, 'name': name}
+                for project_id, name, row in grid]
+        projects.sort(key=lambda p: p['name'])
+        references_version = schedule.get_references_version()
 
         data = {
-            'project_hours': list(project_hours),
-            'projects': list(projects),
-            'all_projects': list(all_projects),
-            'all_users': list(all_users),
+            'project_hours': project_hours,
+            'projects': projects,
             'ajax_url': reverse('ajax_schedule'),
+            'version': version,
+            'references_version': references_version,
         }
         return HttpResponse(json.dumps(data, cls=DecimalEncoder),
             mimetype='application/json')
 
-    def duplicate_entries(self, duplicate, week_update):
-        def duplicate_builder(queryset, new_date):
-            for instance in queryset:
-                duplicate = deepcopy(instance)
-                duplicate.id = None
-                duplicate.published = False
-                duplicate.week_start = new_date
-                yield duplicate
-
-        def duplicate_helper(queryset, new_date):
-            try:
-                ProjectHours.objects.bulk_create(
-                    duplicate_builder(queryset, new_date)
-                )
-            except AttributeError:
-                for entry in duplicate_builder(queryset, new_date):
-                    entry.save()
-            msg = 'Project hours were copied'
-            messages.info(self.request, msg)
+    def get_project_hours(self, week_start=None):
+        return self.get_hours_for_week(week_start).values(
+            'id', 'user', 'user__first_name', 'user__last_name', 'project',
+            'project__name', 'hours', 'published', 'date_updated'
+        ).order_by('-project__type__billable', 'project__name',
+            'user__first_name', 'user__last_name')
 
+    def duplicate_entries(self, duplicate, week_update, weeks=1):
+        """
+        Copies the hours of the week before week_update onto week_update
+        and the following weeks, replacing any hours already there.
+        """
         this_week = datetime.datetime.strptime(week_update,
                 DATE_FORM_FORMAT).date()
         prev_week = this_week - relativedelta(days=7)
-        prev_week_qs = self.get_hours_for_week(prev_week)
-        this_week_qs = self.get_hours_for_week(this_week)
+        target_weeks = [this_week + relativedelta(weeks=i)
+                for i in range(weeks)]
 
         param = {
             'week_start': week_update
@@ -563,12 +583,14 @@ class ScheduleAjaxView(ScheduleMixin, View):
         url = '?'.join((reverse('edit_schedule'),
             urllib.urlencode(param),))
 
-        if not prev_week_qs.exists():
+        if not self.get_hours_for_week(prev_week).exists():
             msg = 'There are no hours to copy'
             messages.warning(self.request, msg)
         else:
-            this_week_qs.delete()
-            duplicate_helper(prev_week_qs, this_week)
+            with transaction.commit_on_success():
+                schedule.copy_week(prev_week, target_weeks)
+            msg = 'Project hours were copied'
+            messages.info(self.request, msg)
         return HttpResponseRedirect(url)
 
     def update_week(self, week_start):
@@ -598,18 +620,121 @@ class ScheduleAjaxView(ScheduleMixin, View):
             week_start: the start of the week for the hours
 
         If the duplicate key is present along with week_update, then items
-        will be duplicated from week_update to the current week
+        will be duplicated from the week before week_update to week_update,
+        and to as many following weeks as given by the optional weeks value
         """
         duplicate = request.POST.get('duplicate', None)
         week_update = request.POST.get('week_update', None)
         week_start = request.POST.get('week_start', None)
 
         if duplicate and week_update:
-            return self.duplicate_entries(duplicate, week_update)
+            try:
+                weeks = int(request.POST.get('weeks', 1))
+            except ValueError:
+                weeks = 0
+            if not 0 < weeks <= MAX_COPY_WEEKS:
+                msg = 'Parameter weeks must be a number from 1 to ' \
+                    '{0}'.format(MAX_COPY_WEEKS)
+                return HttpResponse(msg, status=500)
+            return self.duplicate_entries(duplicate, week_update, weeks)
 
         return self.update_week(week_start)
 
 
+class ScheduleBulkView(ScheduleAjaxView):
+    """
+    Applies many schedule cell changes for a week in one request. Expects
+    week_start and cells, a JSON list of objects with user, project and
+    hours keys, and returns a JSON list with the result of each cell.
+    """
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        try:
+            cells = json.loads(request.POST.get('cells', ''))
+        except ValueError:
+            cells = None
+        if not isinstance(cells, list) or \
+                not all(isinstance(cell, dict) for cell in cells):
+            msg = 'Parameter cells must be a JSON list of objects with ' \
+                'user, project, and hours'
+            return HttpResponse(msg, status=400)
+
+        try:
+            with transaction.commit_on_success():
+                results = schedule.update_week(self.week_start, cells)
+        except IntegrityError:
+            msg = 'The schedule was changed by another request; please retry'
+            return HttpResponse(msg, status=409)
+        latest = self.get_hours_for_week(self.week_start).aggregate(
+                latest=Max('date_updated'))['latest']
+        version = schedule.to_version(latest) if latest else 0
+
+        data = {
+            'results': results,
+            'version': version,
+        }
+        return HttpResponse(json.dumps(data, cls=DecimalEncoder),
+            mimetype='application/json')
+
+
+def schedule_references_etag(request, *args, **kwargs):
+    return str(schedule.get_references_version())
+
+
+class ScheduleReferencesView(View):
+    """
+    Returns the projects and users used for autocompletion by the schedule
+    editor. The response carries an ETag so that clients which already have
+    the current lists receive a 304 Not Modified.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.has_perm('entries.add_projecthours'):
+            return HttpResponseRedirect(reverse('auth_login'))
+
+        return super(ScheduleReferencesView, self).dispatch(request, *args,
+                **kwargs)
+
+    @method_decorator(condition(etag_func=schedule_references_etag))
+    def get(self, request, *args, **kwargs):
+        data = schedule.get_references()
+        return HttpResponse(json.dumps(data, cls=DecimalEncoder),
+            mimetype='application/json')
+
+
+class ScheduleChangesView(ScheduleAjaxView):
+    """
+    Returns the project hours for the week which were created or updated
+    since the version given by the 'since' parameter, along with the ids of
+    all project hours which still exist for the week so that clients can
+    drop deleted ones.
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        try:
+            since = int(request.GET.get('since', ''))
+        except ValueError:
+            msg = 'Parameter since must be a version returned by a ' \
+                'previous request'
+            return HttpResponse(msg, status=400)
+
+        project_hours = self.get_project_hours()
+        ids = project_hours.values_list('id', flat=True)
+        changed, version = schedule.get_changes(
+                schedule.get_changed_hours(project_hours, since), since)
+
+        data = {
+            'project_hours': changed,
+            'ids': list(ids),
+            'version': version,
+            'references_version': schedule.get_references_version(),
+        }
+        return HttpResponse(json.dumps(data, cls=DecimalEncoder),
+            mimetype='application/json')
+
+
 class ScheduleDetailView(ScheduleMixin, View):
     permissions = ('entries.add_projecthours',)
 
@@ -0,0 +1,66 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from timepiece import utils
+from timepiece.entries.models import Entry
+from timepiece.utils import cache
+
+
+class Command(BaseCommand):
+    """
+    Management command to close, or with --pause to pause, the active
+    entries of all users or of the given users, for example at the end of
+    the day. All entries are updated with a single query.
+
+    Entries which would overlap another entry of their user if they were
+    closed are left active and listed, so that they can be closed by hand.
+    """
+    args = '<username username ...>'
+    help = 'Closes or pauses the active entries of all or the given users.'
+    option_list = BaseCommand.option_list + (
+        make_option('--pause',
+            action='store_true',
+            dest='pause',
+            default=False,
+            help='Pause the entries instead of closing them'),
+        make_option('--time',
+            dest='time',
+            default=None,
+            help='When to close or pause the entries, as YYYY-MM-DD HH:MM; '
+                'defaults to now'),
+    )
+
+    def handle(self, *usernames, **options):
+        self.close_entries(usernames, options)
+        cache.bump_committed()
+
+    @transaction.commit_on_success
+    def close_entries(self, usernames, options):
+        when = timezone.now()
+        if options['time']:
+            try:
+                when = parse_datetime(options['time'])
+            except ValueError:
+                when = None
+            if when is None:
+                raise CommandError('Invalid time: {0}'.format(
+                        options['time']))
+            when = utils.add_timezone(when)
+
+        entries = Entry.objects.filter(end_time__isnull=True)
+        if usernames:
+            entries = entries.filter(user__username__in=usernames)
+        if options['pause']:
+            count = entries.pause(when)
+            self.stdout.write('Paused {0} entries.\n'.format(count))
+            return
+
+        count = entries.close(when)
+        self.stdout.write('Closed {0} entries.\n'.format(count))
+        for entry in entries.filter(start_time__lt=when):
+            self.stderr.write(u'Left {0} active: it would overlap another '
+                    'entry.\n'.format(entry))
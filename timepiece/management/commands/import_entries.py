@@ -0,0 +1,112 @@
+from itertools import islice
+from optparse import make_option
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from timepiece.entries.imports import EntryImporter, SimpleEntryImporter, \
+        read_records
+from timepiece.entries.models import ImportProgress
+from timepiece.utils import cache
+
+
+class Command(BaseCommand):
+    """
+    Management command to import time entries or simple entries from a CSV
+    file with a header row or a file with one JSON object per line.
+
+    Records are read as a stream and saved in batches, each within its own
+    transaction. The number of records processed is recorded in the
+    database within the same transaction, so that an interrupted import can
+    be continued with --resume. Invalid records are reported and skipped.
+    """
+    args = '<file>'
+    help = 'Imports entries or simple entries from a CSV or JSON lines file.'
+    option_list = BaseCommand.option_list + (
+        make_option('--simple',
+            action='store_true',
+            dest='simple',
+            default=False,
+            help='Import simple entries instead of entries'),
+        make_option('--format',
+            dest='format',
+            choices=('csv', 'jsonl'),
+            default=None,
+            help='csv or jsonl; guessed from the file extension by default'),
+        make_option('--batch-size',
+            dest='batch_size',
+            type='int',
+            default=1000,
+            help='Number of records to save per transaction'),
+        make_option('--resume',
+            action='store_true',
+            dest='resume',
+            default=False,
+            help='Skip the records processed by a previous run'),
+        make_option('--import-name',
+            dest='import_name',
+            default=None,
+            help='The name under which progress is recorded; defaults to '
+                'the absolute path of the file'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Please give the file to import.')
+        path = args[0]
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.')
+        if format not in ('csv', 'jsonl'):
+            raise CommandError('Unknown format: {0}'.format(format))
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('The batch size must be positive.')
+        name = options['import_name'] or os.path.abspath(path)
+
+        progress = ImportProgress.objects.get_or_create(name=name)[0]
+        done = progress.records if options['resume'] else 0
+
+        importer = SimpleEntryImporter() if options['simple'] \
+                else EntryImporter()
+        imported = rejected = 0
+        with open(path, 'rb') as stream:
+            records = islice(read_records(stream, format), done, None)
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                count, errors = self.import_batch(importer, batch, progress,
+                        done + len(batch))
+                cache.bump_committed()
+                for index, message in errors:
+                    self.stderr.write(u'Record {0}: {1}\n'.format(
+                            done + index + 1, message))
+                imported += count
+                rejected += len(errors)
+                done += len(batch)
+        self.stdout.write('Imported {0} records, skipped {1}.\n'.format(
+                imported, rejected))
+
+    @transaction.commit_on_success
+    def import_batch(self, importer, records, progress, done):
+        """
+        Saves the valid records of the batch, and records that the first
+        done records have been processed. Returns the number of saved
+        records and a list of (index, message) tuples for the others.
+        """
+        entries, indexes, errors = [], [], []
+        for index, record in enumerate(records):
+            try:
+                if isinstance(record, ValidationError):
+                    raise record  # The record could not be read.
+                entries.append(importer.build(record))
+                indexes.append(index)
+            except ValidationError as e:
+                errors.append((index, u'; '.join(e.messages)))
+        valid, rejected = importer.check_batch(entries)
+        errors.extend((indexes[i], message) for i, message in rejected)
+        importer.save_batch(valid)
+        progress.records = done
+        progress.save()
+        return len(valid), sorted(errors)
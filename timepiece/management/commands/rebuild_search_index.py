@@ -0,0 +1,18 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from timepiece.crm.models import SearchIndex
+
+
+class Command(NoArgsCommand):
+    """
+    Management command to recreate the quick search index from all users,
+    projects and businesses.
+    """
+    help = 'Recreates the quick search index.'
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        SearchIndex.objects.rebuild()
+        count = SearchIndex.objects.count()
+        self.stdout.write('Indexed {0} objects.\n'.format(count))
@@ -0,0 +1,16 @@
+from timepiece.utils.permissions import load_permissions
+
+
+class PermissionSnapshotMiddleware(object):
+    """
+    Loads the direct and group permissions of the logged in user with one
+    query before the view runs, so that permission checks made while
+    handling the request do not query the database again.
+
+    Must be placed after django.contrib.auth's AuthenticationMiddleware.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated():
+            load_permissions(user)
@@ -1,4 +1,5 @@
 import datetime
+from dateutil.relativedelta import relativedelta
 
 from django.conf import settings
 from django.test import TestCase
@@ -62,9 +63,11 @@ class ReportsTestBase(TestCase):
             projects = self.default_projects
         if not dates:
             dates = self.default_dates
-        for project in projects:
+        # Entries on the same day follow each other, as they cannot overlap.
+        for index, project in enumerate(projects):
+            offset = relativedelta(minutes=(hours * 60 + minutes + 1) * index)
             for day in dates:
-                self.log_time(project=project, start=day,
+                self.log_time(project=project, start=day + offset,
                               delta=(hours, minutes), user=user)
 
     def bulk_entries(self, start=datetime.datetime(2011, 1, 2),
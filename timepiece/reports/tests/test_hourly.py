@@ -1,4 +1,5 @@
 import datetime
+from dateutil.relativedelta import relativedelta
 from decimal import Decimal
 from random import randint
 
@@ -80,7 +81,8 @@ class TestHourlyReport(ViewTestMixin, LogTimeMixin, ReportsTestBase):
     def log_daily(self, start, day2, end):
         self.log_time(project=self.p1, start=start, delta=(1, 0))
         self.log_time(project=self.p1, start=day2, delta=(0, 30))
-        self.log_time(project=self.p3, start=day2, delta=(1, 0))
+        self.log_time(project=self.p3, start=day2 + relativedelta(hours=1),
+                      delta=(1, 0))
         self.log_time(project=self.p1, start=day2, delta=(3, 0),
                       user=self.user2)
         self.log_time(project=self.sick, start=end, delta=(2, 0),
@@ -17,6 +17,7 @@ from django.views.generic import TemplateView
 
 from timepiece import utils
 from timepiece.utils.csv import CSVViewMixin, DecimalEncoder
+from timepiece.utils.permissions import load_permissions
 
 from timepiece.entries.models import Entry, ProjectHours, SimpleEntry
 from timepiece.crm.models import Project
@@ -338,6 +339,10 @@ class OshaBaseReport(ReportMixin, CSVViewMixin, TemplateView):
         curr_report_class = get_report_class_naming(curr_report_type) # users_and_activities > UsersAndActivities
         curr_report_class = 'UsersAndActivities'
 
+        # Visibility is checked once per report class, so make sure the
+        # checks are answered from the permission snapshot.
+        load_permissions(self.request.user)
+
         filters = []
         for class_obj in get_report_classes(that_contain=curr_report_class):
             report_filter, report_type = split_report_class(class_obj)
@@ -0,0 +1,54 @@
+// Keeps the online users tab up to date by polling for changes. The entries
+// are only sent when someone clocked in, clocked out or paused since the
+// last request.
+
+var ONLINE_USERS_POLL_INTERVAL = 15000;
+
+function formatSince(isoTime) {
+    var date = new Date(isoTime),
+        text = date.toLocaleTimeString();
+    if (date.toDateString() !== new Date().toDateString()) {
+        text += ' on ' + date.toDateString();
+    }
+    return text;
+}
+
+function renderOnlineUsers(entries) {
+    var pane = $('#online-users'),
+        tbody = pane.find('tbody').empty();
+
+    $.each(entries, function(i, entry) {
+        var project = $('<td />')
+            .append($('<span class="hidden-phone" />').text(entry.activity + ' for '))
+            .append(document.createTextNode(entry.project + (entry.is_paused ? ' (paused)' : '')));
+        $('<tr />')
+            .append($('<td />').text(' ' + entry.first_name + ' ' + entry.last_name)
+                .prepend('<i class="icon-user"></i>'))
+            .append(project)
+            .append($('<td class="hidden-phone nowrap" />').text(formatSince(entry.start_time)))
+            .appendTo(tbody);
+    });
+    pane.find('table').toggleClass('hide', entries.length === 0);
+    pane.find('p').toggleClass('hide', entries.length !== 0);
+}
+
+function pollOnlineUsers(version) {
+    $.getJSON(onlineUsersUrl, {since: version})
+        .done(function(data) {
+            if (data.entries) {
+                renderOnlineUsers(data.entries);
+            }
+            version = data.version;
+        })
+        .always(function() {
+            setTimeout(function() { pollOnlineUsers(version); },
+                ONLINE_USERS_POLL_INTERVAL);
+        });
+}
+
+$(function() {
+    if ($('#online-users').length) {
+        setTimeout(function() { pollOnlineUsers(presenceVersion); },
+            ONLINE_USERS_POLL_INTERVAL);
+    }
+});
@@ -6,6 +6,15 @@ var all_users = new UserCollection();
 
 var project_hours = new ProjectHoursCollection();
 
+// The project hours of the week as sent by the server, and the versions
+// of the schedule and of the project and user lists shown
+var week_hours = [],
+    changes_version = 0,
+    references_version = null;
+
+// How often to look for changes made by others, in milliseconds
+var POLL_INTERVAL = 30000;
+
 function showError(msg) {
     var html = '<div class="alert alert-error">' + msg +
         '<a class="close" data-dismiss="alert" href="#">&times;</a></div>';
@@ -14,42 +23,64 @@ function showError(msg) {
     $('.alert').alert();
 }
 
-function processData(data) {
-    var projects = data.projects,
-        project_hours = data.project_hours,
-        all_projects = data.all_projects,
-        all_users = data.all_users,
-        dataTable = [['']];
-
-    if(typeof ajax_url === 'undefined') {
-        ajax_url = data.ajax_url;
-    }
+// Stores the lists of all projects and users for autocomplete
+function storeReferences(data) {
+    all_projects.collection = [];
+    all_users.collection = [];
 
-    // Store all projects for autocomplete
-    for(var i = 0; i < all_projects.length; i++) {
-        var p = all_projects[i];
+    for(var i = 0; i < data.all_projects.length; i++) {
+        var p = data.all_projects[i];
 
-        this.all_projects.add(new Project(p.id, p.name));
+        all_projects.add(new Project(p.id, p.name));
     }
 
-    // Store all users for autocomplete
-    for(i = 0; i < all_users.length; i++) {
-        var u = all_users[i],
+    for(i = 0; i < data.all_users.length; i++) {
+        var u = data.all_users[i],
             name = u.first_name + ' ' + u.last_name,
             display_name = u.first_name + ' ' + u.last_name[0] + '.';
 
-        this.all_users.add(new User(u.id, name, display_name));
+        all_users.add(new User(u.id, name, display_name));
+    }
+}
+
+// Loads the lists of all projects and users. They are only sent again
+// when they have changed since the last request.
+function loadReferences(version, callback) {
+    $.ajax({
+        url: references_url,
+        dataType: 'json',
+        ifModified: true,
+        success: function(data, status, xhr) {
+            if(status !== 'notmodified') {
+                storeReferences(data);
+            }
+            references_version = version;
+            callback();
+        }
+    });
+}
+
+// Builds the table from the project hours of the week
+function render() {
+    var dataTable = [['']], i;
+
+    projects.collection = [];
+    users.collection = [];
+    project_hours.collection = [];
+
+    for(i = 0; i < all_projects.collection.length; i++) {
+        all_projects.collection[i].row = 0;
     }
 
     // Process all project hours to add to the table
-    for(i = 0; i < project_hours.length; i++) {
-        var ph = project_hours[i],
-            project = this.all_projects.get_by_id(ph.project);
+    for(i = 0; i < week_hours.length; i++) {
+        var ph = week_hours[i],
+            project = all_projects.get_by_id(ph.project);
 
         project.row = project.row || dataTable.length;
 
         // Add project to table if it doesnt already exist
-        if(this.projects.add(project)) {
+        if(projects.add(project)) {
             dataTable.push([project.name]);
         }
 
@@ -58,7 +89,7 @@ function processData(data) {
 
         // Get from global users and add to datatable and adjust column
         // if the user isnt already in the table
-        var user = this.all_users.get_by_id(ph.user);
+        var user = all_users.get_by_id(ph.user);
         if(users.add(user)) {
             dataTable[0].push(user.display_name);
             user.col = dataTable[0].length - 1;
@@ -76,7 +107,7 @@ function processData(data) {
         dataTable[hours.row][hours.col] = hours.hours;
 
 
-        this.project_hours.add(hours);
+        project_hours.add(hours);
     }
 
     // Populate the totals row after weve gone through all the data
@@ -101,6 +132,79 @@ function processData(data) {
     $('.dataTable').handsontable('loadData', dataTable);
 }
 
+// Renders the table, first loading the references if they changed
+function refresh(version) {
+    if(version !== references_version) {
+        loadReferences(version, render);
+    } else {
+        render();
+    }
+}
+
+function processData(data) {
+    if(typeof ajax_url === 'undefined') {
+        ajax_url = data.ajax_url;
+    }
+
+    week_hours = data.project_hours;
+    changes_version = data.version;
+    refresh(data.references_version);
+}
+
+// Merges the changes made since the last request into the project hours
+// of the week. Returns whether the table shows something else.
+function applyChanges(data) {
+    var ids = {}, changed = false, i, j, ph, shown;
+
+    for(i = 0; i < data.ids.length; i++) {
+        ids[data.ids[i]] = true;
+    }
+
+    week_hours = $.grep(week_hours, function(ph) {
+        return ids[ph.id];
+    });
+
+    for(i = 0; i < data.project_hours.length; i++) {
+        ph = data.project_hours[i];
+
+        for(j = 0; j < week_hours.length; j++) {
+            if(week_hours[j].id === ph.id) {
+                break;
+            }
+        }
+        week_hours[j] = ph;
+
+        shown = project_hours.get_by_id(ph.id);
+        if(!shown || shown.hours !== ph.hours || shown.published !== ph.published) {
+            changed = true;
+        }
+    }
+
+    for(i = 0; i < project_hours.collection.length; i++) {
+        if(!ids[project_hours.collection[i].id]) {
+            changed = true;
+        }
+    }
+
+    return changed;
+}
+
+// Fetches the changes made by others, and shows them if there are any
+function pollChanges() {
+    var params = {
+        week_start: $('h2[data-date]').data('date'),
+        since: changes_version
+    };
+
+    $.getJSON(changes_url, params, function(data, status, xhr) {
+        changes_version = data.version;
+
+        if(applyChanges(data) || data.references_version !== references_version) {
+            refresh(data.references_version);
+        }
+    });
+}
+
 // Helper for updating totals after any change
 function updateTotals(col, data) {
     var dataTable = $('.dataTable').handsontable('getData'),
@@ -378,8 +482,9 @@ $(function() {
         }
     });
 
-    // Load initial data
+    // Load initial data, then keep it up to date
     getData($('h2[data-date]').data('date'));
+    setInterval(pollChanges, POLL_INTERVAL);
 
     // Make sure the datepicker uses the correct format we expect
     $('.hasDatepicker').datepicker('setDate', $('h2[data-date]').data('date'));
@@ -1,3 +1,5 @@
+from .test_context_processors import *
+from .test_ldap_sync import *
 from .test_management import *
 from .test_templatetags import *
 from .test_utils import *
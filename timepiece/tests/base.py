@@ -6,13 +6,29 @@ from dateutil.relativedelta import relativedelta
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.conf import settings
 from django.contrib.auth import login
+from django.db import connection
 from django.http import HttpRequest
 from django.utils import timezone
 from django.utils.encoding import force_unicode
 
+from timepiece.entries.models import NO_OVERLAP_CONSTRAINT
+
 from . import factories
 
 
+def allow_overlapping_entries():
+    """
+    Drops the constraint which prevents overlapping entries until the test's
+    transaction is rolled back, to test code which handles older data.
+    """
+    cursor = connection.cursor()
+    # Tables cannot be altered while deferred foreign key checks are pending.
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute('ALTER TABLE timepiece_entry DROP CONSTRAINT '
+            '{0}'.format(NO_OVERLAP_CONSTRAINT))
+    cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
 class ViewTestMixin(object):
     """Utilities for more easily testing views."""
     url_name = ''  # Must be defined by implementing class.
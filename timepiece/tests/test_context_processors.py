@@ -0,0 +1,102 @@
+import datetime
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from timepiece import utils
+from timepiece.context_processors import quick_clock_in
+from timepiece.entries.models import Entry, get_recent_projects
+
+from . import factories
+
+
+class QuickClockInTest(TestCase):
+
+    def setUp(self):
+        self.user = factories.User()
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.start = utils.add_timezone(datetime.datetime(2013, 1, 7, 9))
+
+    def project(self, trackable=True):
+        return factories.Project(
+                type__enable_timetracking=trackable,
+                status__enable_timetracking=trackable)
+
+    def log(self, project, days):
+        start = self.start + datetime.timedelta(days=days)
+        return factories.Entry(user=self.user, project=project,
+                start_time=start, end_time=start + datetime.timedelta(hours=1))
+
+    def test_recent_projects(self):
+        """Projects are listed by the last time they were clocked into."""
+        first, second, closed = [self.project() for i in range(2)] + \
+                [self.project(trackable=False)]
+        self.log(first, 0)
+        self.log(closed, 1)
+        self.log(second, 2)
+        self.log(first, 3)
+        context = quick_clock_in(self.request)
+        self.assertEquals(context['work_projects'], [first, second])
+        self.assertEquals(context['leave_projects'], [])
+
+    def test_recent_projects_cached(self):
+        project = self.project()
+        self.log(project, 0)
+        quick_clock_in(self.request)
+        with self.assertNumQueries(1):
+            context = quick_clock_in(self.request)
+        self.assertEquals(context['work_projects'], [project])
+
+    def test_recent_projects_updated(self):
+        """New entries move their project to the front of the list."""
+        first, second = self.project(), self.project()
+        self.log(first, 1)
+        self.assertEquals([p for p, s in get_recent_projects(self.user.pk)],
+                [first.pk])
+        self.log(second, 2)
+        self.log(first, 0)  # An older entry does not move the project.
+        self.assertEquals([p for p, s in get_recent_projects(self.user.pk)],
+                [second.pk, first.pk])
+
+    def test_recent_projects_rebuilt(self):
+        """Deleting an entry can push its project back."""
+        first, second = self.project(), self.project()
+        self.log(first, 0)
+        entry = self.log(second, 1)
+        entry.delete()
+        self.assertEquals([p for p, s in get_recent_projects(self.user.pk)],
+                [first.pk])
+
+    def test_recent_projects_edited(self):
+        """Moving an entry to another project rebuilds the list."""
+        first, second = self.project(), self.project()
+        self.log(first, 0)
+        entry = self.log(second, 1)
+        get_recent_projects(self.user.pk)
+        entry = Entry.objects.get(pk=entry.pk)
+        entry.project = first
+        entry.save()
+        self.assertEquals([p for p, s in get_recent_projects(self.user.pk)],
+                [first.pk])
+
+    def test_recent_projects_kept(self):
+        """Edits which keep the project and start time keep the list."""
+        entry = self.log(self.project(), 0)
+        get_recent_projects(self.user.pk)
+        entry = Entry.objects.get(pk=entry.pk)
+        entry.comments = 'Edited'
+        entry.save()
+        with self.assertNumQueries(0):
+            get_recent_projects(self.user.pk)
+
+    def test_leave_projects(self):
+        """Only assigned paid leave projects are listed."""
+        assigned, unassigned = self.project(), self.project()
+        factories.ProjectRelationship(user=self.user, project=assigned)
+        leave = {'sick': assigned.pk, 'vacation': unassigned.pk}
+        with self.settings(TIMEPIECE_PAID_LEAVE_PROJECTS=leave):
+            self.log(assigned, 0)
+            context = quick_clock_in(self.request)
+        self.assertEquals(context['leave_projects'], [assigned])
+        self.assertEquals(context['work_projects'], [])
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import Group, User
+from django.test import TestCase
+
+from timepiece_project.ldap_sync import Snapshot, sync
+
+from . import factories
+
+
+class FakeDirectory(object):
+    """Answers uSNChanged searches from a list of user objects."""
+
+    def __init__(self):
+        self.objects = []
+        self.usn = 0
+        self.filters = []
+
+    def add(self, username, groups=(), **attributes):
+        self.usn += 1
+        self.objects = [o for o in self.objects
+                if o[1]['sAMAccountName'] != [username]]
+        values = {
+            'sAMAccountName': [username],
+            'uSNChanged': [str(self.usn)],
+            'memberOf': ['CN={0},OU=Agency Groups,DC=agency,DC=dom'.format(g)
+                    for g in groups],
+        }
+        values.update((key, [value]) for key, value in attributes.items())
+        self.objects.append(('CN={0},DC=agency,DC=dom'.format(username),
+                values))
+
+    def search(self, search_filter, attributes=None):
+        self.filters.append(search_filter)
+        since = 0
+        if 'uSNChanged>=' in search_filter:
+            since = int(search_filter.split('uSNChanged>=')[1].rstrip(')'))
+        return [o for o in self.objects
+                if int(o[1]['uSNChanged'][0]) >= since]
+
+
+class LDAPSyncTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot.json')
+        self.directory = FakeDirectory()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sync(self):
+        snapshot = Snapshot(self.path)
+        changed = sync(self.directory, snapshot)
+        snapshot.save()
+        return changed
+
+    def test_create_users_and_groups(self):
+        factories.User(username='existing', first_name='Old')
+        self.directory.add('existing', ['G-UNIT'], givenName='New')
+        self.directory.add('jdoe', ['G-UNIT', 'G-ADMIN'], givenName='John',
+                sn='Doe', mail='jdoe@example.com')
+        self.assertEquals(self.sync(), ['existing', 'jdoe'])
+        user = User.objects.get(username='jdoe')
+        self.assertEquals(user.get_full_name(), 'John Doe')
+        self.assertFalse(user.has_usable_password())
+        self.assertEquals(sorted(user.groups.values_list('name', flat=True)),
+                ['G-ADMIN', 'G-UNIT'])
+        existing = User.objects.get(username='existing')
+        self.assertEquals(existing.first_name, 'New')
+        self.assertEquals(Group.objects.get(name='G-UNIT').user_set.count(),
+                2)
+
+    def test_incremental(self):
+        """Only users changed since the last sync are searched for."""
+        self.directory.add('jdoe', ['G-UNIT'])
+        self.directory.add('asmith', ['G-UNIT'])
+        self.sync()
+        self.directory.add('jdoe', ['G-ADMIN'])
+        self.assertEquals(self.sync(), ['jdoe'])
+        self.assertEquals(self.directory.filters[-1],
+                '(&(objectclass=user)(uSNChanged>=3))')
+        jdoe = User.objects.get(username='jdoe')
+        self.assertEquals(list(jdoe.groups.values_list('name', flat=True)),
+                ['G-ADMIN'])
+        self.assertEquals(self.sync(), [])
+
+    def test_unchanged_users_skipped(self):
+        """Users which match the snapshot are not written again."""
+        self.directory.add('jdoe', ['G-UNIT'])
+        self.sync()
+        os.remove(self.path)
+        snapshot = Snapshot(self.path)
+        snapshot.users = {'jdoe': {'first_name': None, 'last_name': None,
+                'email': None, 'groups': ['G-UNIT']}}
+        with self.assertNumQueries(0):
+            self.assertEquals(sync(self.directory, snapshot), [])
+
+    def test_full_repairs_database(self):
+        """A full sync undoes changes made in the database."""
+        self.directory.add('jdoe', ['G-UNIT'], givenName='John')
+        self.sync()
+        jdoe = User.objects.get(username='jdoe')
+        jdoe.first_name = 'Johnny'
+        jdoe.save()
+        jdoe.groups.clear()
+        self.assertEquals(self.sync(), [])
+        snapshot = Snapshot(self.path)
+        self.assertEquals(sync(self.directory, snapshot, full=True),
+                ['jdoe'])
+        self.assertEquals(self.directory.filters[-1], '(objectclass=user)')
+        jdoe = User.objects.get(username='jdoe')
+        self.assertEquals(jdoe.first_name, 'John')
+        self.assertEquals(list(jdoe.groups.values_list('name', flat=True)),
+                ['G-UNIT'])
+        self.assertEquals(sync(self.directory, snapshot, full=True), [])
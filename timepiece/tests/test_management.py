@@ -1,13 +1,26 @@
+import datetime
 from dateutil.relativedelta import relativedelta
+from decimal import Decimal
+import json
+import mock
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
 
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.utils import timezone
 from django.test import TestCase
 
 from timepiece import utils
 from timepiece.management.commands import check_entries
-from timepiece.entries.models import Entry
+from timepiece.entries.imports import SimpleEntryImporter
+from timepiece.entries.models import Entry, ImportProgress, SimpleEntry, \
+        TimesheetPeriod
 
 from . import factories
+from .base import allow_overlapping_entries
 
 
 class CheckEntries(TestCase):
@@ -183,7 +196,9 @@ class CheckEntries(TestCase):
         all_users = check_entries.Command().find_users()
         entries = check_entries.Command().find_entries(all_users, start)
         total_overlaps = 0
-        #make some bad entries
+        #make some bad entries, as found in data from before the overlap
+        #constraint
+        allow_overlapping_entries()
         num_days = 5
         self.make_entry_bulk(self.all_users, num_days)
         while True:
@@ -196,3 +211,220 @@ class CheckEntries(TestCase):
                 self.assertEqual(
                     total_overlaps, num_days * len(self.all_users))
                 return
+
+
+class ImportEntries(TestCase):
+
+    def setUp(self):
+        super(ImportEntries, self).setUp()
+        self.user = factories.User(username='jdoe')
+        self.project = factories.Project(name='Website')
+        self.activity = factories.Activity(code='DEV', name='Development')
+        self.location = factories.Location(slug='office')
+        self.dir = tempfile.mkdtemp()
+        self.stdout, self.stderr = StringIO(), StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def import_entries(self, path, **options):
+        call_command('import_entries', path, stdout=self.stdout,
+                stderr=self.stderr, **options)
+
+    def test_import_csv(self):
+        path = self.write('entries.csv', '\n'.join([
+            'user,project,activity,location,start_time,end_time',
+            'jdoe,Website,DEV,office,2013-01-07 09:00,2013-01-07 11:30',
+            'jdoe,Website,Development,office,2013-01-08 09:00,'
+                '2013-01-08 17:00',
+            'nobody,Website,DEV,office,2013-01-09 09:00,2013-01-09 10:00',
+            'jdoe,Website,DEV,office,2013-01-10 09:00,2013-01-10 08:00',
+        ]))
+        self.import_entries(path, batch_size=3)
+        entries = Entry.no_join.order_by('start_time')
+        self.assertEquals([e.hours for e in entries],
+                [Decimal('2.50'), Decimal('8.00')])
+        self.assertEquals(entries[0].project, self.project)
+        self.assertEquals(entries[0].activity, self.activity)
+        errors = self.stderr.getvalue()
+        self.assertTrue('Record 3: Unknown user: nobody' in errors)
+        self.assertTrue('Record 4: Ending time' in errors)
+
+    def test_overlapping_entries(self):
+        """Entries which overlap a saved entry or each other are skipped."""
+        start = utils.add_timezone(datetime.datetime(2013, 1, 7, 9))
+        factories.Entry(user=self.user, start_time=start,
+                end_time=start + relativedelta(hours=2))
+        path = self.write('entries.csv', '\n'.join([
+            'user,project,activity,location,start_time,end_time',
+            'jdoe,Website,DEV,office,2013-01-07 10:00,2013-01-07 12:00',
+            'jdoe,Website,DEV,office,2013-01-08 09:00,2013-01-08 12:00',
+            'jdoe,Website,DEV,office,2013-01-08 11:00,2013-01-08 13:00',
+        ]))
+        self.import_entries(path)
+        self.assertEquals(Entry.no_join.count(), 2)
+        errors = self.stderr.getvalue()
+        self.assertTrue('Record 1: Start time overlaps' in errors)
+        self.assertTrue('Record 3: Overlaps the entry' in errors)
+
+    def test_unreadable_records(self):
+        """Records which cannot be read are reported and skipped."""
+        path = self.write('entries.jsonl', '\n'.join([
+            '{"user": "jdoe", "project": "Website", "date": "2013-01-07",',
+            '["jdoe", "Website"]',
+            json.dumps({'user': 'jdoe', 'project': 'Website',
+                'date': '2013-01-08', 'hours': 2}),
+        ]))
+        self.import_entries(path, simple=True)
+        self.assertEquals(SimpleEntry.objects.count(), 1)
+        errors = self.stderr.getvalue()
+        self.assertTrue('Record 1: Invalid JSON' in errors)
+        self.assertTrue('Record 2: Not a JSON object' in errors)
+
+        path = self.write('entries.csv', '\n'.join([
+            'user,project,date,hours',
+            'jdoe,Caf\xe9,2013-01-09,2',
+            'jdoe,Website,2013-01-10,2,extra',
+            'jdoe,Website,2013-01-11,2',
+        ]))
+        self.import_entries(path, simple=True)
+        self.assertEquals(SimpleEntry.objects.count(), 2)
+        errors = self.stderr.getvalue()
+        self.assertTrue('Record 1: Invalid UTF-8 text' in errors)
+        self.assertTrue('Record 2: More fields' in errors)
+
+    def test_simple_entry_daily_limit(self):
+        """Simple entries may not exceed the daily limit in total."""
+        factories.SimpleEntry(user=self.user, project=self.project,
+                date=datetime.date(2013, 1, 7), hours=6, minutes=0)
+        records = [
+            {'user': 'jdoe', 'project': 'Website', 'date': '2013-01-07',
+                'hours': 5, 'minutes': 30},
+            {'user': 'jdoe', 'project': self.project.pk,
+                'date': '2013-01-07', 'hours': 2},
+            {'user': 'jdoe', 'project': 'Website', 'date': '2013-01-08',
+                'hours': 8, 'minutes': 45, 'comments': 'Meetings'},
+        ]
+        path = self.write('entries.jsonl',
+                '\n'.join(json.dumps(record) for record in records))
+        self.import_entries(path, simple=True)
+        self.assertEquals(SimpleEntry.objects.count(), 3)
+        self.assertEquals(SimpleEntry.objects.filter(
+                date=datetime.date(2013, 1, 7)).count(), 2)
+        self.assertTrue('Record 2: More than' in self.stderr.getvalue())
+
+    def test_locked_timesheet(self):
+        """Entries are not added to approved timesheets."""
+        TimesheetPeriod.objects.create(user=self.user,
+                month=datetime.date(2013, 1, 1),
+                state=TimesheetPeriod.APPROVED)
+        records = [
+            {'user': 'jdoe', 'project': 'Website', 'date': '2013-01-07',
+                'hours': 2},
+            {'user': 'jdoe', 'project': 'Website', 'date': '2013-02-07',
+                'hours': 2},
+        ]
+        path = self.write('entries.jsonl',
+                '\n'.join(json.dumps(record) for record in records))
+        self.import_entries(path, simple=True)
+        self.assertEquals([e.date.month for e in SimpleEntry.objects.all()],
+                [2])
+        self.assertTrue('Record 1: The timesheet for January 2013 has been '
+                'approved' in self.stderr.getvalue())
+
+    def test_invoiced_entries_lock(self):
+        """Importing invoiced entries locks their timesheets."""
+        path = self.write('entries.csv', '\n'.join([
+            'user,project,activity,location,start_time,end_time,status',
+            'jdoe,Website,DEV,office,2013-01-07 09:00,2013-01-07 11:30,'
+                'invoiced',
+            'jdoe,Website,DEV,office,2013-02-07 09:00,2013-02-07 11:30,',
+        ]))
+        self.import_entries(path)
+        self.assertEquals(list(TimesheetPeriod.objects.values_list('month',
+                'state')), [(datetime.date(2013, 1, 1),
+                TimesheetPeriod.INVOICED)])
+
+    def test_resume(self):
+        """A resumed import skips the records which were processed."""
+        path = self.write('entries.jsonl', '\n'.join(json.dumps({
+            'user': 'jdoe', 'project': 'Website', 'hours': 1,
+            'date': '2013-01-{0:02d}'.format(day),
+        }) for day in range(1, 6)))
+        ImportProgress.objects.create(name=path, records=3)
+        self.import_entries(path, simple=True, resume=True)
+        self.assertEquals(sorted(e.date.day for e in SimpleEntry.objects.all()),
+                [4, 5])
+        self.assertEquals(ImportProgress.objects.get(name=path).records, 5)
+
+    def test_progress_saved_with_batch(self):
+        """Progress is recorded after each batch, under the given name."""
+        path = self.write('entries.jsonl', '\n'.join(json.dumps({
+            'user': 'jdoe', 'project': 'Website', 'hours': 1,
+            'date': '2013-01-{0:02d}'.format(day),
+        }) for day in range(1, 6)))
+        save_batch = SimpleEntryImporter.save_batch
+        def fail_second(importer, entries):
+            if SimpleEntry.objects.exists():
+                raise DatabaseError('Connection lost')
+            save_batch(importer, entries)
+        with mock.patch.object(SimpleEntryImporter, 'save_batch',
+                fail_second):
+            self.assertRaises(DatabaseError, self.import_entries, path,
+                    simple=True, batch_size=2, import_name='january')
+        self.assertEquals(ImportProgress.objects.get(name='january').records,
+                2)
+
+
+class CloseEntries(TestCase):
+
+    def setUp(self):
+        super(CloseEntries, self).setUp()
+        self.start = datetime.datetime(2013, 1, 7, 9)
+        self.user = factories.User(username='jdoe')
+        self.entry = factories.Entry(user=self.user, start_time=self.start)
+        self.other = factories.Entry(start_time=self.start)
+        self.stdout, self.stderr = StringIO(), StringIO()
+
+    def close_entries(self, *args, **options):
+        call_command('close_entries', *args, stdout=self.stdout,
+                stderr=self.stderr, **options)
+
+    def test_close(self):
+        self.close_entries(time='2013-01-07 17:30')
+        self.assertEquals(self.stdout.getvalue(), 'Closed 2 entries.\n')
+        for entry in Entry.no_join.all():
+            self.assertEquals(entry.end_time,
+                    self.start + relativedelta(hours=8, minutes=30))
+            self.assertEquals(entry.hours, Decimal('8.50'))
+            self.assertEquals(entry.work_date, datetime.date(2013, 1, 7))
+
+    def test_pause_users(self):
+        self.close_entries('jdoe', pause=True, time='2013-01-07 10:00')
+        self.assertEquals(self.stdout.getvalue(), 'Paused 1 entries.\n')
+        entry = Entry.no_join.get(pk=self.entry.pk)
+        self.assertEquals(entry.pause_time, self.start + relativedelta(
+                hours=1))
+        self.assertEquals(entry.hours, Decimal('1.00'))
+        self.assertFalse(Entry.no_join.get(pk=self.other.pk).is_paused)
+
+    def test_overlap(self):
+        """Entries which would overlap are left active and listed."""
+        factories.Entry(user=self.user,
+                start_time=self.start + relativedelta(hours=2),
+                end_time=self.start + relativedelta(hours=3))
+        self.close_entries(time='2013-01-07 17:30')
+        self.assertEquals(self.stdout.getvalue(), 'Closed 1 entries.\n')
+        self.assertTrue('jdoe' in self.stderr.getvalue())
+        self.assertEquals(Entry.no_join.get(pk=self.entry.pk).end_time,
+                None)
+
+    def test_invalid_time(self):
+        self.assertRaises(SystemExit, self.close_entries, time='5pm')
+        self.assertTrue('Invalid time: 5pm' in self.stderr.getvalue())
@@ -1,9 +1,16 @@
 import datetime
 
+from django.contrib.auth.models import Permission, User
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.views.generic import ListView
 from timepiece.utils import get_active_entry, ActiveEntryError
 
 from timepiece import utils
+from timepiece.crm.models import Business
+from timepiece.middleware import PermissionSnapshotMiddleware
+from timepiece.utils import cache, permissions
+from timepiece.utils.search import KeysetPaginationMixin
 
 from . import factories
 
@@ -54,8 +61,100 @@ class GetActiveEntryTest(TestCase):
         self.assertEqual(entry, get_active_entry(self.user))
 
     def test_get_active_entry_multiple(self):
+        """A second active entry for the same user cannot be saved."""
         now = datetime.datetime.now()
-        # two active entries for same user
         factories.Entry(user=self.user, start_time=now)
-        factories.Entry(user=self.user, start_time=now)
-        self.assertRaises(ActiveEntryError, get_active_entry, self.user)
+        with self.assertRaises(ActiveEntryError):
+            factories.Entry(user=self.user, start_time=now)
+        # Other users and closed entries are not affected.
+        factories.Entry(start_time=now)
+        factories.Entry(user=self.user, start_time=now, end_time=now)
+
+    def test_get_active_entry_single_query(self):
+        entry = factories.Entry(user=self.user,
+                start_time=datetime.datetime.now())
+        with self.assertNumQueries(1):
+            self.assertEqual(get_active_entry(self.user), entry)
+
+
+class VersionedCacheTest(TestCase):
+
+    def test_bump_version(self):
+        """Bumping the version should discard the cached values."""
+        calls = []
+        def build():
+            calls.append(1)
+            return len(calls)
+        self.assertEqual(cache.get_or_set('test', 'value', build), 1)
+        self.assertEqual(cache.get_or_set('test', 'value', build), 1)
+        version = cache.get_version('test')
+        self.assertTrue(cache.bump_version('test') > version)
+        self.assertEqual(cache.get_or_set('test', 'value', build), 2)
+
+    def test_bump_committed(self):
+        """Values cached before a transaction commits should be discarded."""
+        cache.bump_version('committed')  # The test runs inside a transaction.
+        cache.set_value('committed', 'value', 'stale')
+        cache.bump_committed()
+        self.assertEqual(cache.get_value('committed', 'value'), None)
+        cache.set_value('committed', 'value', 'fresh')
+        cache.bump_committed()
+        self.assertEqual(cache.get_value('committed', 'value'), 'fresh')
+
+
+class KeysetListView(KeysetPaginationMixin, ListView):
+    model = Business
+    paginate_by = 2
+    keyset_ordering = ('name',)
+
+
+class KeysetPaginationTest(TestCase):
+
+    def test_list_view_paginates_once(self):
+        """
+        Pages are not paginated again when MultipleObjectMixin is reached
+        through super(), as it is by every SearchListView since Django 1.5.
+        """
+        businesses = [factories.Business(name='business{0}'.format(i))
+                for i in range(3)]
+        request = RequestFactory().get('/', {'after': businesses[1].pk})
+        response = KeysetListView.as_view()(request)
+        self.assertEqual(response.context_data['object_list'],
+                businesses[2:])
+        self.assertTrue(response.context_data['page_obj'].has_previous())
+
+
+class PermissionSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.add_entry = Permission.objects.get(codename='add_entry')
+        self.approve = Permission.objects.get(codename='approve_timesheet')
+        self.user = factories.User(permissions=[self.add_entry])
+        group = factories.Group(name='G-INF')
+        group.permissions.add(self.approve)
+        self.user.groups.add(group, factories.Group(name='Empty'))
+        self.user = User.objects.get(pk=self.user.pk)
+
+    def test_single_query(self):
+        """Direct and group permissions are loaded with one query."""
+        with self.assertNumQueries(1):
+            permissions.load_permissions(self.user)
+            self.assertTrue(self.user.has_perm('entries.add_entry'))
+            self.assertTrue(self.user.has_perm('entries.approve_timesheet'))
+            self.assertFalse(self.user.has_perm('entries.change_entry'))
+        self.assertEquals(self.user.get_group_permissions(),
+                set(['entries.approve_timesheet']))
+
+    def test_superuser(self):
+        user = User.objects.get(pk=factories.Superuser().pk)
+        permissions.load_permissions(user)
+        self.assertEquals(user.get_all_permissions(),
+                set(u'{0}.{1}'.format(p.content_type.app_label, p.codename)
+                    for p in Permission.objects.select_related()))
+
+    def test_middleware(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        PermissionSnapshotMiddleware().process_view(request, None, (), {})
+        with self.assertNumQueries(0):
+            self.assertTrue(request.user.has_perm('entries.add_entry'))
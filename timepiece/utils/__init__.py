@@ -28,18 +28,30 @@ def add_timezone(value, tz=None):
     return value
 
 
+def get_local_date(value):
+    """Returns the date of the datetime in the current time zone."""
+    if not isinstance(value, datetime.datetime):
+        return value
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
 def get_active_entry(user, select_for_update=False):
-    """Returns the user's currently-active entry, or None."""
+    """
+    Returns the user's currently-active entry, or None, with a single
+    query. If select_for_update is True, the entry is locked until the end
+    of the transaction.
+    """
     entries = get_model('entries', 'Entry').no_join
     if select_for_update:
         entries = entries.select_for_update()
-    entries = entries.filter(user=user, end_time__isnull=True)
-
-    if not entries.exists():
-        return None
-    if entries.count() > 1:
+    # The database allows one active entry per user, but fetch two in case
+    # the constraint has not been installed.
+    entries = list(entries.filter(user=user, end_time__isnull=True)[:2])
+    if len(entries) > 1:
         raise ActiveEntryError('Only one active entry is allowed.')
-    return entries[0]
+    return entries[0] if entries else None
 
 
 def get_hours_summary(entries):
@@ -0,0 +1,32 @@
+from django.db.models import Sum
+from django.db.models.sql.aggregates import Sum as SQLSum
+
+
+class SQLSumIf(SQLSum):
+    sql_template = '%(function)s(CASE WHEN %(condition)s THEN %(field)s END)'
+
+
+class SumIf(Sum):
+    """Sums the field over the rows which match a raw SQL condition.
+
+    Several conditional totals can be computed with a single aggregate
+    query this way, as SUM(CASE WHEN <condition> THEN <field> END). Like
+    Sum, the total is None if no rows match. The condition cannot take
+    query parameters, so it must only be built from trusted values.
+    """
+    name = 'SumIf'
+
+    def __init__(self, lookup, condition, **extra):
+        super(SumIf, self).__init__(lookup, condition=condition, **extra)
+
+    def add_to_query(self, query, alias, col, source, is_summary):
+        query.aggregates[alias] = SQLSumIf(col, source=source,
+                is_summary=is_summary, **self.extra)
+
+
+def sql_in(column, ids):
+    """Returns a condition which matches rows with one of the given ids."""
+    ids = [int(pk) for pk in ids]
+    if not ids:
+        return 'FALSE'
+    return '{0} IN ({1})'.format(column, ', '.join(str(pk) for pk in ids))
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.db import transaction
+
+
+VERSION_KEY = 'timepiece:version:{0}'
+VALUE_KEY = 'timepiece:{0}:{1}:{2}'
+TIMEOUT = 60 * 60 * 24
+
+# Namespaces bumped inside a transaction, by thread, to bump again once the
+# transaction has been committed.
+_pending = threading.local()
+
+
+def get_version(namespace):
+    """Returns the current version of the cache namespace.
+
+    Versions start from the current time in milliseconds so that a version
+    which has been evicted from the cache is never handed out again.
+    """
+    key = VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(namespace):
+    key = VERSION_KEY.format(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:  # The version has not been set yet or was evicted.
+        return get_version(namespace)
+
+
+def bump_version(namespace):
+    """Invalidates all values cached within the namespace.
+
+    Inside a transaction, another process may cache values built from the
+    uncommitted data under the new version, so the namespace is bumped
+    again by bump_committed().
+    """
+    if transaction.is_managed():
+        if not hasattr(_pending, 'namespaces'):
+            _pending.namespaces = set()
+        _pending.namespaces.add(namespace)
+    return _bump(namespace)
+
+
+def bump_committed(**kwargs):
+    """Bumps the namespaces bumped inside transactions again.
+
+    Called once the transactions have been committed: when each request
+    finishes, and by management commands after each commit.
+    """
+    namespaces = getattr(_pending, 'namespaces', set())
+    while namespaces:
+        _bump(namespaces.pop())
+
+request_finished.connect(bump_committed,
+        dispatch_uid='timepiece.utils.cache.bump_committed')
+
+
+def get_or_set(namespace, name, builder, version=None):
+    """Returns the cached value, calling builder() to create it if missing.
+
+    The value is stored under the current version of the namespace, so it
+    is discarded as soon as bump_version() is called for the namespace.
+    """
+    version = version or get_version(namespace)
+    key = VALUE_KEY.format(namespace, version, name)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, TIMEOUT)
+    return value
+
+
+def get_value(namespace, name, version=None):
+    """Returns the cached value, or None if it is missing."""
+    version = version or get_version(namespace)
+    return cache.get(VALUE_KEY.format(namespace, version, name))
+
+
+def set_value(namespace, name, value, version=None):
+    """Replaces the value cached under the current version of the namespace."""
+    version = version or get_version(namespace)
+    cache.set(VALUE_KEY.format(namespace, version, name), value, TIMEOUT)
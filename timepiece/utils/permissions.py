@@ -0,0 +1,46 @@
+from django.db import connection
+
+
+# One row per permission the user has directly, per permission of each group
+# the user belongs to, and per permission at all if the user is a superuser.
+SNAPSHOT_SQL = """
+    SELECT 'user', ct.app_label, p.codename
+    FROM auth_user_user_permissions up
+    JOIN auth_permission p ON p.id = up.permission_id
+    JOIN django_content_type ct ON ct.id = p.content_type_id
+    WHERE up.user_id = %s
+    UNION ALL
+    SELECT 'group', ct.app_label, p.codename
+    FROM auth_user_groups ug
+    JOIN auth_group_permissions gp ON gp.group_id = ug.group_id
+    JOIN auth_permission p ON p.id = gp.permission_id
+    JOIN django_content_type ct ON ct.id = p.content_type_id
+    WHERE ug.user_id = %s
+    UNION ALL
+    SELECT 'group', ct.app_label, p.codename
+    FROM auth_permission p
+    JOIN django_content_type ct ON ct.id = p.content_type_id
+    WHERE %s
+"""
+
+
+def load_permissions(user):
+    """Loads a snapshot of the user's permissions.
+
+    Everything is read with a single query and stored on the user object,
+    in the attributes where ModelBackend caches permissions, so that every
+    has_perm() check made while handling the request - by views,
+    decorators and templates alike - is answered from memory. Does nothing
+    if the user's permissions have already been loaded.
+    """
+    if user.is_anonymous() or hasattr(user, '_perm_cache'):
+        return
+    user_perms, group_perms = set(), set()
+    cursor = connection.cursor()
+    cursor.execute(SNAPSHOT_SQL, [user.pk, user.pk, user.is_superuser])
+    for source, app_label, codename in cursor.fetchall():
+        perms = user_perms if source == 'user' else group_perms
+        perms.add(u'{0}.{1}'.format(app_label, codename))
+    user._group_perm_cache = group_perms
+    user._perm_cache = user_perms | group_perms
+
@@ -49,9 +49,17 @@ class SearchMixin(GetDataFormMixin, FormMixin):
         self.object_list = self.filter_results(self.form, self.object_list)
 
         allow_empty = self.get_allow_empty()
-        if not allow_empty and len(self.object_list) == 0:
+        if not allow_empty and not self.object_list.exists():
             raise Http404("No results found.")
 
+        # When the user makes a search and there is only one result,
+        # redirect to the result's detail page rather than rendering the
+        # list. Fetching two rows is enough to tell.
+        if self.redirect_if_one_result and self.form.is_bound:
+            results = list(self.object_list[:2])
+            if len(results) == 1:
+                return redirect(results[0].get_absolute_url())
+
         context = self.get_context_data(form=self.form,
                 object_list=self.object_list)
         return self.render_to_response(context)
@@ -59,18 +67,128 @@ class SearchMixin(GetDataFormMixin, FormMixin):
     def post(self, request, *args, **kwargs):
         return self.get(request, *args, **kwargs)
 
-    def render_to_response(self, context):
-        """
-        When the user makes a search and there is only one result, redirect
-        to the result's detail page rather than rendering the list.
-        """
-        if self.redirect_if_one_result:
-            if self.object_list.count() == 1 and self.form.is_bound:
-                return redirect(self.object_list.get().get_absolute_url())
-        return super(SearchMixin, self).render_to_response(context)
+
+class KeysetPage(object):
+    """A page of results found by seeking from the row of a cursor."""
+
+    def __init__(self, object_list, has_previous, has_next, query):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+        self.query = query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_query(self):
+        return self._query('before', self.object_list[0].pk)
+
+    def next_query(self):
+        return self._query('after', self.object_list[-1].pk)
+
+    def _query(self, direction, pk):
+        query = self.query.copy()
+        query[direction] = pk
+        return query.urlencode()
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates a ListView by seeking past the last row of the previous page
+    instead of using OFFSET and COUNT, so that the cost of a page does not
+    grow with the size of the table.
+
+    The cursor is the primary key of the row to seek from, passed as
+    'after' or 'before' in the query string. Rows are ordered by
+    keyset_ordering, followed by the primary key; the ordering fields may
+    not be null.
+    """
+    paginate_by = 20
+    keyset_ordering = ()
+
+    def get_context_data(self, **kwargs):
+        context = super(KeysetPaginationMixin, self).get_context_data(
+                **kwargs)
+        # MultipleObjectMixin paginates through paginate_queryset() when it
+        # is reached, as it is from FormMixin since Django 1.5.
+        if 'page_obj' in context:
+            return context
+        page_size = self.get_paginate_by(context['object_list'])
+        if page_size:
+            paginator, page, object_list, is_paginated = \
+                    self.paginate_queryset(context['object_list'], page_size)
+            context.update({
+                'page_obj': page,
+                'is_paginated': is_paginated,
+                'object_list': object_list,
+            })
+        return context
+
+    def get_keyset_ordering(self, queryset):
+        ordering = list(self.keyset_ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not set(['pk', pk_name]) & set(f.lstrip('-') for f in ordering):
+            ordering.append(pk_name)
+        return ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_keyset_ordering(queryset)
+        query = self.request.GET.copy()
+        for direction in ('after', 'before', 'page'):
+            query.pop(direction, None)
+
+        forward = 'before' not in self.request.GET
+        cursor = self.request.GET.get('after' if forward else 'before')
+        if not forward:
+            ordering = [self._reverse(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = self.seek(queryset, ordering, cursor)
+
+        object_list = list(queryset[:page_size + 1])
+        more = len(object_list) > page_size
+        object_list = object_list[:page_size]
+        if forward:
+            page = KeysetPage(object_list, bool(cursor), more, query)
+        else:
+            object_list.reverse()
+            page = KeysetPage(object_list, more, True, query)
+        return (None, page, object_list, page.has_other_pages())
+
+    def seek(self, queryset, ordering, cursor):
+        """Narrows the queryset to the rows ordered after the cursor's."""
+        fields = [field.lstrip('-') for field in ordering]
+        try:
+            values = queryset.model._default_manager.filter(pk=cursor) \
+                    .values(*fields)[0]
+        except (IndexError, ValueError):
+            raise Http404("Invalid page.")
+        query = Q()
+        for index, field in enumerate(ordering):
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            step = Q(**{fields[index] + lookup: values[fields[index]]})
+            for previous in fields[:index]:
+                step &= Q(**{previous: values[previous]})
+            query |= step
+        return queryset.filter(query)
+
+    def _reverse(self, field):
+        return field[1:] if field.startswith('-') else '-' + field
 
 
-class SearchListView(SearchMixin, ListView):
+class SearchListView(KeysetPaginationMixin, SearchMixin, ListView):
     """Basic implementation which uses text search on specific fields."""
     form_class = SearchForm
     search_fields = []
@@ -0,0 +1,30 @@
+import os, sys
+import argparse
+import timeit
+
+
+def benchmark(label, statement, number):
+    seconds = min(timeit.repeat(statement, repeat=3, number=number))
+    print '%-40s %8.1f us per call' % (label, seconds / number * 1e6)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times access to the entry managers. No queries are run.")
+    parser.add_argument('--settings', required=True)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", args.settings)
+    from timepiece.entries.models import Entry, SimpleEntry
+
+    # The managers used to compile each new queryset to SQL, as in the
+    # "compiled" lines, to keep their select_related joins.
+    benchmark('Entry.objects.all()',
+        lambda: Entry.objects.all(), args.number)
+    benchmark('Entry.objects.all(), compiled',
+        lambda: str(Entry.objects.all().query), args.number)
+    benchmark('SimpleEntry.objects.all()',
+        lambda: SimpleEntry.objects.all(), args.number)
+    benchmark('SimpleEntry.objects.all(), compiled',
+        lambda: str(SimpleEntry.objects.all().query), args.number)
@@ -0,0 +1,221 @@
+"""
+Incremental synchronization of users and their group memberships from an
+Active Directory server.
+
+Only the users changed since the last run are searched for, using the
+highest uSNChanged seen as a watermark. They are compared with a local
+snapshot of the directory, and the users and memberships which differ are
+applied to the database in bulk. A full synchronization compares every user
+in the directory with the database instead, which also repairs changes made
+in the database, for example through the admin.
+"""
+import json
+import os
+
+try:
+    import ldap
+    from ldap.controls import SimplePagedResultsControl
+except ImportError:
+    ldap = None
+
+from django.contrib.auth.models import Group, User
+from django.db.models import Q
+
+from timepiece.crm.models import SearchIndex
+from timepiece.entries.models import SCHEDULE_REFERENCES
+from timepiece.utils import cache
+
+
+USER_ATTRIBUTES = ['sAMAccountName', 'givenName', 'sn', 'mail', 'memberOf',
+        'uSNChanged']
+GROUPS_OU = 'Agency Groups'
+
+
+class LDAPDirectory(object):
+    """Searches the directory with paged results over a single connection."""
+
+    def __init__(self, uri, bind_dn, password, base_dn, page_size=500):
+        if ldap is None:
+            raise ImportError('python-ldap is required to search LDAP.')
+        self.base_dn = base_dn
+        self.page_size = page_size
+        self.connection = ldap.initialize(uri)
+        self.connection.set_option(ldap.OPT_REFERRALS, 0)
+        self.connection.simple_bind_s(bind_dn, password)
+
+    def search(self, search_filter, attributes=None):
+        """Yields a (dn, attributes) pair for each object found."""
+        control = SimplePagedResultsControl(True, size=self.page_size,
+                cookie='')
+        while True:
+            msgid = self.connection.search_ext(self.base_dn,
+                    ldap.SCOPE_SUBTREE, search_filter, attributes,
+                    serverctrls=[control])
+            rtype, rdata, rmsgid, controls = self.connection.result3(msgid)
+            for dn, values in rdata:
+                if dn:  # Skip search references.
+                    yield dn, values
+            cookies = [c.cookie for c in controls
+                    if c.controlType == SimplePagedResultsControl.controlType]
+            if not cookies or not cookies[0]:
+                break
+            control.cookie = cookies[0]
+
+    def close(self):
+        self.connection.unbind_s()
+
+
+def parse_groups(member_of):
+    """Returns the names of the agency groups in a memberOf list."""
+    groups = []
+    for ldap_group in member_of:
+        if GROUPS_OU in ldap_group:
+            for elem in ldap_group.decode('utf-8').split(','):
+                if elem.startswith('CN'):
+                    groups.append(elem.split('=', 1)[1])
+    return sorted(groups)
+
+
+def parse_user(values):
+    """Returns the username and the details of a user object."""
+    def first(key):
+        value = values.get(key, [None])[0]
+        return value.decode('utf-8') if value is not None else None
+    return first('sAMAccountName'), {
+        'first_name': first('givenName'),
+        'last_name': first('sn'),
+        'email': first('mail'),
+        'groups': parse_groups(values.get('memberOf', [])),
+    }
+
+
+class Snapshot(object):
+    """
+    The users as last synchronized, and the watermark of the directory at
+    that time, stored as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = 0
+        self.users = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.watermark = data['watermark']
+            self.users = data['users']
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'watermark': self.watermark, 'users': self.users}, f)
+
+
+def fetch_changes(directory, watermark=0):
+    """
+    Returns the users changed after the watermark, by username, and the new
+    watermark. All users are returned if the watermark is 0.
+    """
+    search_filter = '(objectclass=user)'
+    if watermark:
+        search_filter = '(&{0}(uSNChanged>={1}))'.format(search_filter,
+                watermark + 1)
+    users = {}
+    for dn, values in directory.search(search_filter, USER_ATTRIBUTES):
+        username, user = parse_user(values)
+        if username:
+            users[username] = user
+        watermark = max(watermark, int(values.get('uSNChanged', [0])[0]))
+    return users, watermark
+
+
+def apply_changes(changes):
+    """
+    Creates and updates the given users, by username, and sets their group
+    memberships to the groups listed, creating missing groups. Queries are
+    made in bulk, except for one update per changed user. Returns the
+    usernames of the users which differed from the database.
+    """
+    if not changes:
+        return set()
+    group_names = set()
+    for user in changes.values():
+        group_names.update(user['groups'])
+    groups = dict(Group.objects.filter(name__in=group_names)
+            .values_list('name', 'pk'))
+    missing = group_names - set(groups)
+    if missing:
+        Group.objects.bulk_create([Group(name=name) for name in missing])
+        groups.update(Group.objects.filter(name__in=missing)
+                .values_list('name', 'pk'))
+
+    existing = User.objects.filter(username__in=changes.keys())
+    existing = dict((u.username, u) for u in existing)
+    new_users = []
+    changed = set()
+    for username, user in changes.iteritems():
+        details = dict((key, user[key] or '')
+                for key in ('first_name', 'last_name', 'email'))
+        if username not in existing:
+            new_user = User(username=username, **details)
+            new_user.set_unusable_password()
+            new_users.append(new_user)
+            changed.add(username)
+        else:
+            old = existing[username]
+            if any(getattr(old, key) != value
+                    for key, value in details.iteritems()):
+                User.objects.filter(pk=old.pk).update(**details)
+                changed.add(username)
+    if new_users:
+        User.objects.bulk_create(new_users)
+    user_ids = dict(User.objects.filter(username__in=changes.keys())
+            .values_list('username', 'pk'))
+
+    Membership = User.groups.through
+    current = set(Membership.objects.filter(user__in=user_ids.values())
+            .values_list('user_id', 'group_id'))
+    wanted = set((user_ids[username], groups[name])
+            for username, user in changes.iteritems()
+            for name in user['groups'])
+    removed = Q()
+    for user_id, group_id in current - wanted:
+        removed |= Q(user=user_id, group=group_id)
+    if removed:
+        Membership.objects.filter(removed).delete()
+    added = wanted - current
+    if added:
+        Membership.objects.bulk_create([Membership(user_id=user_id,
+                group_id=group_id) for user_id, group_id in added])
+    usernames = dict((pk, username) for username, pk in user_ids.iteritems())
+    changed.update(usernames[user_id]
+            for user_id, group_id in (current - wanted) | added)
+
+    # Bulk changes do not send the signals which keep these up to date.
+    if changed:
+        SearchIndex.objects.update_users(User.objects.filter(
+                username__in=changed))
+        cache.bump_version(SCHEDULE_REFERENCES)
+    return changed
+
+
+def sync(directory, snapshot, full=False):
+    """
+    Applies the changes made in the directory since the snapshot was taken
+    and updates the snapshot, which should be saved once the changes are
+    committed. If full is True, all users in the directory are compared
+    with the database instead, whatever the snapshot says. Returns the
+    usernames of the users changed in the database.
+    """
+    if full:
+        users, watermark = fetch_changes(directory)
+        changed = apply_changes(users)
+        snapshot.users = users
+    else:
+        users, watermark = fetch_changes(directory, snapshot.watermark)
+        changes = dict((username, user)
+                for username, user in users.iteritems()
+                if snapshot.users.get(username) != user)
+        changed = apply_changes(changes)
+        snapshot.users.update(changes)
+    snapshot.watermark = watermark
+    return sorted(changed)
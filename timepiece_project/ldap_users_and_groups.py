@@ -1,6 +1,5 @@
 import os, sys
 import argparse
-import ldap
 
 
 
@@ -11,54 +10,17 @@ def test():
     else:
         print 'Cannot get user gentisi. Please check the LDAP python connection.'
 
+def get_directory():
+    return LDAPDirectory(ldap_server_uri, timepiece_ldap_user_dn,
+            timepiece_ldap_password, base_dn)
+
 def get_user_dn(username):
-    connect = ldap.open(ldap_server)
-    connect.bind_s(timepiece_ldap_user_dn,timepiece_ldap_password)
+    directory = get_directory()
     search_filter = "(&(objectclass=user)(sAMAccountName="+username+"))"
-    result = connect.search_s(base_dn,ldap.SCOPE_SUBTREE,search_filter)
-    connect.unbind_s()
+    result = list(directory.search(search_filter, ['sAMAccountName']))
+    directory.close()
     return result[0][0]
 
-def get_users_from_ldap_users():
-    connect = ldap.open(ldap_server)
-    connect.bind_s(timepiece_ldap_user_dn,timepiece_ldap_password)
-    search_filter = "(objectclass=user)"    
-    ldap_users = connect.search_s(base_dn,ldap.SCOPE_SUBTREE,search_filter)
-    connect.unbind_s()
-    
-    users = []
-    for ldap_user in ldap_users:
-        user_dn = ldap_user[0]
-        ldap_user_info = ldap_user[1]
-        username = ldap_user_info['sAMAccountName'][0]
-
-        try: first_name = ldap_user_info["givenName"][0]
-        except KeyError: first_name = None
-        try: last_name = ldap_user_info["sn"][0]
-        except: last_name = None
-        email = ldap_user_info["mail"][0]
-        try: ldap_groups = ldap_user_info['memberOf'] # e.g.: ['CN=P-MYRIAD,OU=Printer Groups,OU=Agency Groups,DC=agency,DC=dom', ...
-        except: print 'WARNING: '+username+' is not member of any group'
-        groups = []
-        for ldap_group in ldap_groups:
-            if 'Agency Groups' in ldap_group:
-                elements = ldap_group.split(',')
-                for elem in elements:
-                    if elem.startswith('CN'):
-                        cn, group = elem.split('=')
-                        groups.append(group)
-
-        user = {}
-        user['username'] = username
-        user['first_name'] = first_name
-        user['last_name'] = last_name
-        user['email'] = email
-        user['groups'] = groups
-        users.append(user)
-        if not user_belongs_to_a_unit(user):
-            print 'WARNING: '+user['username']+' is not assigned to any unit of '+str(ldap_units)
-    return users
-
 
 def user_belongs_to_a_unit(user):
     assigned_to_a_unit = False
@@ -102,34 +64,20 @@ def _create_permission(codename):
     return p
 
 
-def sync_users_and_groups():
-    users = get_users_from_ldap_users()
-    print 'INFO: '+str(len(users))+' users found in LDAP'
-    for user in users:
-        try:
-            u = User.objects.get(username=user['username'])
-        except ObjectDoesNotExist:
-            u = User.objects.create_user(user['username'])
-            if user['first_name'] is not None:
-                u.first_name = user['first_name']
-            if user['last_name'] is not None:
-                u.last_name = user['last_name']
-            u.save()
-            print 'INFO: User '+user['username']+' created'
-
-        old_groups = u.groups.order_by('name')
-        old_groups_set = set(old_groups)
-        u.groups.clear()
-        for group_name in user['groups']:
-            group = _create_group(group_name)
-            u.groups.add(group)
-
-        new_groups = u.groups.order_by('name')
-        new_groups_set = set(new_groups)
-        if old_groups_set <> new_groups_set:
-            print 'INFO: '+u.username
-            print 'now: '+str(new_groups)
-            print 'was: '+str(old_groups)
+def sync_users_and_groups(snapshot_path, full=False):
+    snapshot = Snapshot(snapshot_path)
+    directory = get_directory()
+    with transaction.commit_on_success():
+        changed = sync(directory, snapshot, full)
+    cache.bump_committed()
+    snapshot.save()
+    directory.close()
+    print 'INFO: '+str(len(changed))+' users changed in LDAP'
+    for username in changed:
+        user = snapshot.users[username]
+        print 'INFO: '+username+' groups: '+', '.join(user['groups'])
+        if not user_belongs_to_a_unit(user):
+            print 'WARNING: '+username+' is not assigned to any unit of '+str(ldap_units)
     prepare_permissions_and_groups()
 
 
@@ -182,17 +130,24 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--settings', required=True)
     parser.add_argument('--do', choices=["sync", 'preparedb', 'test'], required=True)
+    parser.add_argument('--snapshot', default='ldap_snapshot.json',
+        help='where the directory is recorded between incremental syncs')
+    parser.add_argument('--full', action='store_true',
+        help='compare all users in the directory with the database '
+            'instead of those changed since the last sync')
     args = parser.parse_args()
 
     sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", args.settings)
     from django.contrib.auth.models import User, Group, Permission
-    from django.db import connection
+    from django.db import connection, transaction
     from django.core.exceptions import ObjectDoesNotExist
     from django.conf import settings
+    from timepiece_project.ldap_sync import LDAPDirectory, Snapshot, sync
+    from timepiece.utils import cache
 
     # PERMISSIONS AND GROUPS CONFIGURATION
-    ldap_server = getattr(settings, "AUTH_LDAP_SERVER_URI", None).replace('ldap://','')
+    ldap_server_uri = getattr(settings, "AUTH_LDAP_SERVER_URI", None)
     timepiece_ldap_user_dn = getattr(settings, "AUTH_LDAP_BIND_DN", None)
     timepiece_ldap_password = getattr(settings, "AUTH_LDAP_BIND_PASSWORD", None)
     base_dn = getattr(settings, "AUTH_LDAP_USER_SEARCH_BASEDN", None)
@@ -219,6 +174,6 @@ if __name__ == "__main__":
     ]
 
 
-    if args.do == "sync": sync_users_and_groups()
+    if args.do == "sync": sync_users_and_groups(args.snapshot, args.full)
     if args.do == "preparedb": prepare_permissions_and_groups()
     if args.do == "test": test()
@@ -75,6 +75,7 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'timepiece.middleware.PermissionSnapshotMiddleware',
     'pagination.middleware.PaginationMiddleware',
     # Uncomment the next line for simple clickjacking protection:
     # 'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -166,6 +167,18 @@ LOGGING = {
     }
 }
 
+# timepiece caches lists and versions which are invalidated whenever the
+# data they come from changes. The cache must be shared by all the server
+# processes, or the processes which did not make a change keep serving
+# stale data.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 'timepiece',
+    }
+}
+
 # compressor settings
 COMPRESS_PRECOMPILERS = (
     ('text/less', 'lessc {infile} {outfile}'),